@@ -0,0 +1,271 @@
+"""
+End-to-end benchmark suite of the pipeline stages on synthetic data. The results are written to a
+machine-readable json report and compared against a saved baseline report.
+"""
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime
+
+from serialization import time_call
+
+REGRESSION_FACTOR = 1.25
+
+
+def run_benchmarks(scale: float = 1.0, repeat: int = 3) -> dict[str, dict]:
+    """
+    Runs every benchmark on synthetic data, the number of cities and properties grows with scale.
+    :return: for each benchmark the best time, the number of items and the items per second
+    """
+    from bs4 import BeautifulSoup
+    from transformers import pipeline
+
+    import compute_threshold
+    import embedding_alignment
+    import main
+    import test_system
+    import value_alignment
+    from infobox_store import InfoBoxStore
+    from parse_infoboxes import clean_text, convert_infobox_html_to_dict
+    from synthetic_data import (
+        create_tiny_model, generate_cities, generate_infobox_html, generate_similarity_mapping
+    )
+    from util import EmbeddingComparisonMode
+
+    number_of_cities = max(1, int(1000 * scale))
+    cities = generate_cities(number_of_cities, keys_per_infobox=20, number_of_keys=60)
+    store = InfoBoxStore.from_cities(cities)
+    value_alignments = value_alignment.align_properties(value_alignment.process_cities(cities))
+    embedding_alignments = {
+        f"Property {index}": f"Eigenschap {index}" for index in range(0, 60, 3)
+    }
+
+    texts = [value for city in cities for values in city.infobox_en.values() for value in values]
+    texts = [f"\ufeff {text}[1]\xa0\u200b" for text in texts]
+    tables = [
+        BeautifulSoup(generate_infobox_html(city.infobox_en), "lxml").select("table.infobox")[0]
+        for city in cities[:max(1, number_of_cities // 10)]
+    ]
+    similarity_mapping = generate_similarity_mapping(max(2, int(100 * scale)))
+    ids, matrix = test_system.mapping_to_matrix(similarity_mapping)
+
+    embedding_cities = generate_cities(
+        max(1, int(20 * scale)), keys_per_infobox=4, number_of_keys=8
+    )
+    with tempfile.TemporaryDirectory() as model_path:
+        pipe = pipeline(
+            "feature-extraction", model=create_tiny_model(model_path), device=-1
+        )
+        embedding_pairs = len(value_alignment.get_unique_properties(embedding_cities)[0]) \
+            * len(value_alignment.get_unique_properties(embedding_cities)[1])
+
+        benchmarks = {
+            "clean_text": (lambda: [clean_text(text) for text in texts], len(texts)),
+            "convert_infobox_html_to_dict": (
+                lambda: [convert_infobox_html_to_dict(table) for table in tables], len(tables)
+            ),
+            "value_alignment.process_cities": (
+                lambda: value_alignment.process_cities(cities), len(cities)
+            ),
+            "value_alignment.process_store": (
+                lambda: value_alignment.process_store(store), len(cities)
+            ),
+            "value_alignment.process_store_approximate": (
+                lambda: value_alignment.process_store_approximate(store), len(cities)
+            ),
+            "embedding_alignment.align_properties": (
+                lambda: embedding_alignment.align_properties(
+                    embedding_cities, EmbeddingComparisonMode.EUCLIDEAN, pipe
+                ),
+                embedding_pairs,
+            ),
+            "compute_threshold.find_threshold": (
+                lambda: compute_threshold.find_threshold(similarity_mapping, 0.8, 0.01),
+                len(similarity_mapping) ** 2,
+            ),
+            "test_system.test_all_properties": (
+                lambda: test_system.test_all_properties(similarity_mapping),
+                len(similarity_mapping),
+            ),
+            "test_system.compute_ranks": (lambda: test_system.compute_ranks(matrix), len(ids)),
+            "main.complete_infobox": (
+                lambda: main.complete_infobox(
+                    main.CompletionMode.ALL, cities, value_alignments, embedding_alignments
+                ),
+                len(cities),
+            ),
+            "main.complete_store": (
+                lambda: main.complete_store(
+                    main.CompletionMode.ALL, store, value_alignments, embedding_alignments
+                ),
+                len(cities),
+            ),
+        }
+
+        results = {}
+        for name, (function, items) in benchmarks.items():
+            # find_threshold prints every step, which is not part of the benchmark
+            with open(os.devnull, "w") as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    seconds = time_call(function, repeat)
+                finally:
+                    sys.stdout = stdout
+
+            results[name] = {
+                "seconds": seconds,
+                "items": items,
+                "items_per_second": items / seconds if seconds > 0 else None,
+            }
+            print(f"{name:<40} {seconds * 1000:10.2f} ms {items:10d} items")
+
+    return results
+
+
+def compare_value_matching(scale: float = 1.0, reformat: float = 0.5) -> dict[str, dict]:
+    """
+    Compares the exact and the approximate value matching on synthetic cities where a fraction
+    reformat of the shared values is written with Dutch thousands separators. English property i
+    corresponds to Dutch property i, and a pair of their entries should be counted when the
+    values are equal after normalisation.
+    :return: for each mode the results of value_alignment.compare_matching_modes, and the
+    fraction of the pairs that should be counted that is counted
+    """
+    from infobox_store import InfoBoxStore
+    from synthetic_data import generate_cities
+    from value_alignment import compare_matching_modes, normalize_value
+
+    cities = generate_cities(
+        max(1, int(1000 * scale)), keys_per_infobox=20, number_of_keys=60, reformat=reformat
+    )
+
+    def tokens(values: list[str]) -> set[str]:
+        return {token for value in values for token in normalize_value(value)}
+
+    expected_pairs = 0
+    for city in cities:
+        for key, values in city.infobox_en.items():
+            target = key.replace("Property", "Eigenschap")
+            if target in city.infobox_nl and tokens(values) == tokens(city.infobox_nl[target]):
+                expected_pairs += 1
+
+    results = compare_matching_modes(
+        InfoBoxStore.from_cities(cities),
+        {f"Property {index}": f"Eigenschap {index}" for index in range(60)},
+    )
+    for name, result in results.items():
+        result["pair_recall"] = result["correct_pairs"] / expected_pairs
+        print(
+            f"value matching {name:<12} {result['seconds'] * 1000:10.2f} ms "
+            f"pair recall {result['pair_recall']:.3f} precision {result['precision']:.3f}"
+        )
+    print(
+        f"approximate value matching adds {results['approximate']['approximate_only_alignments']} "
+        f"alignments, recall gain {results['approximate']['recall_gain']:+.3f}"
+    )
+
+    return results
+
+
+def compare_value_matching_annotated(
+        infoboxes_path: str = "data/infoboxes_250000.json",
+        test_cities_pattern: str = "data/test-cities_{name}.json"
+) -> dict[str, dict] | None:
+    """
+    Compares the exact and the approximate value matching on the real infoboxes, with the
+    precision on the alignments that were annotated in the test cities of every annotator.
+    :return: the results of value_alignment.compare_matching_modes, or None without the files
+    """
+    from database import ANNOTATORS
+    from infobox_store import InfoBoxStore
+    from serialization import load_infobox_cities
+    from util import Language
+    from value_alignment import annotated_alignments, compare_matching_modes
+
+    paths = [test_cities_pattern.format(name=name) for name in ANNOTATORS]
+    if not all(os.path.exists(path) for path in [infoboxes_path, *paths]):
+        return None
+
+    results = compare_matching_modes(
+        InfoBoxStore.from_cities(load_infobox_cities(infoboxes_path), [Language.EN, Language.NL]),
+        annotations=annotated_alignments(
+            [city for path in paths for city in load_infobox_cities(path)]
+        ),
+    )
+    for name, result in results.items():
+        print(
+            f"annotated value matching {name:<12} {result['seconds'] * 1000:10.2f} ms "
+            f"{result['alignments']} alignments, precision {result['annotated_precision']:.3f} "
+            f"on {result['annotated_alignments']} annotated, "
+            f"recall {result['annotated_recall']:.3f}"
+        )
+    print(
+        f"annotated approximate value matching adds "
+        f"{results['approximate']['approximate_only_alignments']} alignments, "
+        f"recall gain {results['approximate']['annotated_recall_gain']:+.3f}"
+    )
+
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict]) -> dict[str, float]:
+    """
+    Compares the results to the baseline.
+    :return: for each benchmark in both reports, the time relative to the baseline
+    """
+    return {
+        name: result["seconds"] / baseline[name]["seconds"]
+        for name, result in results.items()
+        if name in baseline and baseline[name]["seconds"] > 0
+    }
+
+
+def main(argv: list[str]):
+    """
+    Runs the benchmarks and writes the report. If a baseline report is given, the results are
+    compared to it and the exit code is 1 if a benchmark is more than REGRESSION_FACTOR slower.
+    Run with: python benchmark.py [scale] [report_path] [baseline_path]
+    """
+    scale = float(argv[1]) if len(argv) > 1 else 1.0
+    report_path = argv[2] if len(argv) > 2 else "data/benchmark.json"
+    baseline_path = argv[3] if len(argv) > 3 else None
+
+    results = run_benchmarks(scale)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scale": scale,
+        "results": results,
+        "value_matching": compare_value_matching(scale),
+        "value_matching_annotated": compare_value_matching_annotated(),
+    }
+
+    regressions = []
+    if baseline_path is not None:
+        with open(baseline_path, "r", encoding="utf-8") as inp:
+            baseline = json.load(inp)
+
+        if baseline.get("scale") != scale:
+            print(f"Warning: the baseline was measured with scale {baseline.get('scale')}")
+
+        report["baseline"] = baseline_path
+        report["relative_to_baseline"] = compare(results, baseline["results"])
+        print("---" * 20)
+        for name, ratio in report["relative_to_baseline"].items():
+            flag = "REGRESSION" if ratio > REGRESSION_FACTOR else ""
+            print(f"{name:<40} {ratio:6.2f}x {flag}")
+            if ratio > REGRESSION_FACTOR:
+                regressions.append(name)
+
+    with open(report_path, "w", encoding="utf-8") as out:
+        json.dump(report, out, indent=4)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,224 @@
+"""
+Local HTTP service that completes Dutch infoboxes on demand. The value and embedding alignment
+tables are loaded once at startup, and the completions of all cached cities are computed and
+serialised up front, so a request for a cached city is a single dictionary lookup.
+
+Endpoints:
+    GET  /complete?uri=<wikidata uri>   completions of a cached city
+    POST /complete                      completions of {"infobox_en": ..., "infobox_nl": ...}
+    GET  /health
+"""
+import json
+import sys
+import threading
+from collections import ChainMap
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from config import EUCLIDEAN_THRESHOLD
+from main import CompletionMode, complete_infobox
+from serialization import alignment_to_dict, load_infobox_cities, load_json
+from util import InfoBoxCity
+import value_alignment
+
+
+class KeyEncoder:
+    """
+    Aligns English properties that are not in the alignment tables to the known Dutch properties
+    with the embedding model. The Dutch properties are encoded once at startup, every English
+    property is encoded once and its alignment is cached.
+    """
+
+    def __init__(self, properties_nl: set[str], pipe=None):
+        if pipe is None:
+            import embedding_alignment
+            pipe = embedding_alignment.get_pipe()
+
+        self.pipe = pipe
+        self.properties_nl = sorted(properties_nl)
+        self.embeddings_nl = np.stack([self.encode(property_) for property_ in self.properties_nl])
+        self.alignments = {}
+        self.lock = threading.Lock()
+
+    def encode(self, text: str) -> np.ndarray:
+        return np.array(self.pipe(text)).mean(axis=1).squeeze()
+
+    def align(self, property_en: str) -> str | None:
+        # the pipeline is not thread safe, and the cache is checked and filled under the same
+        # lock, so that concurrent requests for a property encode it only once
+        with self.lock:
+            if property_en in self.alignments:
+                return self.alignments[property_en]
+
+            distances = np.linalg.norm(self.embeddings_nl - self.encode(property_en), axis=1)
+            best = int(np.argmin(distances))
+            alignment = self.properties_nl[best] if distances[best] < EUCLIDEAN_THRESHOLD else None
+            self.alignments[property_en] = alignment
+            return alignment
+
+
+class CompletionService:
+    def __init__(
+            self,
+            cities: list[InfoBoxCity],
+            value_alignments: dict[str, str],
+            embedding_alignments: dict[str, str],
+            encoder: KeyEncoder = None
+    ):
+        self.value_alignments = value_alignments
+        self.embedding_alignments = embedding_alignments
+        self.encoder = encoder
+
+        self.responses = {
+            city.uri: self.encode_response(city)
+            for city in complete_infobox(
+                CompletionMode.ALL, cities, value_alignments, embedding_alignments
+            )
+        }
+
+    @staticmethod
+    def encode_response(city: InfoBoxCity) -> bytes:
+        return json.dumps({
+            "value_alignment_completed_infobox": [
+                alignment_to_dict(alignment) for alignment in city.value_alignment_completed_infobox
+            ],
+            "embedding_alignment_completed_infobox": [
+                alignment_to_dict(alignment)
+                for alignment in city.embedding_alignment_completed_infobox
+            ],
+        }).encode("utf-8")
+
+    def complete_cached(self, uri: str) -> bytes | None:
+        return self.responses.get(uri, None)
+
+    def complete(self, infobox_en: dict[str, list[str]], infobox_nl: dict[str, list[str]]) -> bytes:
+        embedding_alignments = self.embedding_alignments
+        if self.encoder is not None:
+            embedding_alignments = ChainMap(self.embedding_alignments, {
+                property_: self.encoder.align(property_) for property_ in infobox_en
+                if property_ not in self.value_alignments
+                and property_ not in self.embedding_alignments
+            })
+
+        city = InfoBoxCity("", "", "", "", infobox_en, infobox_nl)
+        complete_infobox(CompletionMode.ALL, [city], self.value_alignments, embedding_alignments)
+        return self.encode_response(city)
+
+
+def validate_infobox(infobox, name: str) -> dict[str, list[str]]:
+    """Raises a ValueError with a readable message if infobox is not a dict[str, list[str]]"""
+    if not isinstance(infobox, dict):
+        raise ValueError(f"{name} must be an object, not {type(infobox).__name__}")
+
+    for property_, values in infobox.items():
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"{name}[{property_!r}] must be a list of strings")
+    return infobox
+
+
+def create_handler(service: CompletionService) -> type[BaseHTTPRequestHandler]:
+    class CompletionHandler(BaseHTTPRequestHandler):
+        # keep connections alive, so clients do not pay a TCP handshake per request, and send
+        # the headers and the body without waiting for the delayed ACK of the client
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def send_body(self, status: int, body: bytes) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_error_message(self, status: int, message: str) -> None:
+            self.send_body(status, json.dumps({"error": message}).encode("utf-8"))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                self.send_body(200, b'{"status": "ok"}')
+            elif url.path == "/complete":
+                uri = parse_qs(url.query).get("uri", [None])[0]
+                body = service.complete_cached(uri)
+                if body is None:
+                    self.send_error_message(404, f"Unknown city {uri}")
+                else:
+                    self.send_body(200, body)
+            else:
+                self.send_error_message(404, f"Unknown path {url.path}")
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/complete":
+                self.send_error_message(404, f"Unknown path {self.path}")
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length))
+                if not isinstance(request, dict):
+                    raise ValueError(f"the body must be an object, not {type(request).__name__}")
+                if "uri" in request:
+                    if not isinstance(request["uri"], str):
+                        raise ValueError("uri must be a string")
+                    body = service.complete_cached(request["uri"])
+                    if body is None:
+                        self.send_error_message(404, f"Unknown city {request['uri']}")
+                        return
+                else:
+                    for name in ["infobox_en", "infobox_nl"]:
+                        if name not in request:
+                            raise ValueError(f"the body has no {name}")
+                        validate_infobox(request[name], name)
+                    body = service.complete(request["infobox_en"], request["infobox_nl"])
+            except ValueError as error:
+                # json.JSONDecodeError is a ValueError as well
+                self.send_error_message(400, f"Invalid request: {error}")
+                return
+
+            self.send_body(200, body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return CompletionHandler
+
+
+def load_service(population: int, use_encoder: bool) -> CompletionService:
+    cities = load_infobox_cities(f"data/infoboxes_{population}.json")
+
+    try:
+        value_alignments = load_json(f"data/value-alignments_{population}.json")
+    except FileNotFoundError:
+        value_alignments = value_alignment.align_properties(value_alignment.process_cities(cities))
+
+    embedding_alignments = load_json(f"data/embedding-alignments_{population}.json")
+
+    encoder = None
+    if use_encoder:
+        _, properties_nl = value_alignment.get_unique_properties(cities)
+        encoder = KeyEncoder(properties_nl)
+
+    return CompletionService(cities, value_alignments, embedding_alignments, encoder)
+
+
+def main(argv: list[str]):
+    """
+    Starts the service on localhost. Add --encoder to align English properties that are not in
+    the alignment tables with the embedding model.
+    Run with: python completion_service.py [port] [population] [--encoder]
+    """
+    use_encoder = "--encoder" in argv
+    argv = [arg for arg in argv if arg != "--encoder"]
+    port = int(argv[1]) if len(argv) > 1 else 8080
+    population = int(argv[2]) if len(argv) > 2 else 250000
+
+    service = load_service(population, use_encoder)
+    server = ThreadingHTTPServer(("127.0.0.1", port), create_handler(service))
+    print(f"Serving {len(service.responses)} cities on http://127.0.0.1:{port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
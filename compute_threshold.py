@@ -4,6 +4,8 @@ from sklearn.metrics import precision_score
 import numpy as np
 from tqdm import tqdm
 
+import metrics
+
 
 def compute_similarity(emb1: list[float], emb2: list[float]) -> float:
     """Computes the similarity between two embeddings"""
@@ -43,6 +45,7 @@ def create_similarity_mapping(
     return similarity_mapping
 
 
+@metrics.timed("find_threshold")
 def find_threshold(
     similarity_mapping: dict[str, dict[str, float]],
     min_precision: float,
@@ -72,6 +75,32 @@ def find_threshold(
     return prev_threshold
 
 
+def matrix_precision(matrix: np.ndarray, threshold: float) -> float:
+    """The precision of find_threshold at a threshold, for a distance matrix where the diagonal
+    holds the distances between the same properties
+    """
+    predictions = matrix < threshold
+    predicted = predictions.sum()
+    return float(predictions.diagonal().sum() / predicted) if predicted > 0 else 0.0
+
+
+def save_threshold(
+    embeddings_path: str,
+    threshold_path: str,
+    min_precision: float = 0.8,
+    increment: float = 0.001,
+) -> None:
+    """Finds the threshold for the embeddings in embeddings_path and writes it to threshold_path"""
+    with open(embeddings_path, "r", encoding="utf-8") as inp:
+        all_properties = json.load(inp)
+
+    threshold = find_threshold(
+        create_similarity_mapping(all_properties), min_precision, increment
+    )
+    with open(threshold_path, "w", encoding="utf-8") as out:
+        json.dump({"threshold": threshold, "min_precision": min_precision}, out, indent=4)
+
+
 def main():
     """Find the threshold for the Euclidean distance between embeddings.
     Comment/uncomment saving/load of similarity mapping to save time."""
@@ -88,6 +117,7 @@ def main():
 
     threshold = find_threshold(similarity_mapping, 0.8, 0.001)
     print(f"Found threshold: {threshold:.3f}")
+    metrics.export("compute_threshold")
 
 
 if __name__ == "__main__":
@@ -2,3 +2,15 @@ COSINE_THRESHOLD = 0.8
 EUCLIDEAN_THRESHOLD = 0.537
 RANDOM_SEED = 42
 MODEL_NAME = "xlm-roberta-base"
+# one of "fp32", "int8" and "onnx", see inference_backend.py
+EMBEDDING_BACKEND = "fp32"
+# round the stored embeddings to float16
+EMBEDDING_FLOAT16 = False
+# "exact" counts two properties when their values are equal, "approximate" also when their
+# normalised values are similar, see value_alignment.process_store_approximate
+VALUE_MATCHING = "exact"
+# the MinHash signature length, the number of LSH bands it is split into and the minimal
+# estimated Jaccard similarity of two values
+MINHASH_PERMUTATIONS = 32
+MINHASH_BANDS = 8
+MINHASH_THRESHOLD = 0.75
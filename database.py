@@ -0,0 +1,374 @@
+"""
+Indexed SQLite store for the infoboxes, the alignments and the annotations. The json files stay
+the source of truth, they can be imported into and exported from the database. Evaluation and
+inspection queries are then index lookups instead of reloading and scanning all json files.
+"""
+import hashlib
+import json
+import sqlite3
+import sys
+
+from serialization import load_infobox_cities, load_json, dump_infobox_cities
+from util import Alignment, InfoBoxCity
+
+ANNOTATORS = ["Rina", "Sijbren", "Bjorn", "Oscar"]
+
+VALUE_ALIGNMENT = "value"
+EMBEDDING_ALIGNMENT = "embedding"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cities (
+    id INTEGER PRIMARY KEY,
+    uri TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    url_en TEXT NOT NULL,
+    url_nl TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS infobox_rows (
+    city_id INTEGER NOT NULL REFERENCES cities (id),
+    language TEXT NOT NULL,
+    key TEXT NOT NULL,
+    key_position INTEGER NOT NULL,
+    value_position INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (city_id, language, key_position, value_position)
+);
+CREATE INDEX IF NOT EXISTS infobox_rows_key ON infobox_rows (language, key);
+CREATE INDEX IF NOT EXISTS infobox_rows_value ON infobox_rows (value);
+
+CREATE TABLE IF NOT EXISTS property_alignments (
+    method TEXT NOT NULL,
+    property_en TEXT NOT NULL,
+    property_nl TEXT NOT NULL,
+    PRIMARY KEY (method, property_en)
+);
+
+CREATE TABLE IF NOT EXISTS alignments (
+    id INTEGER PRIMARY KEY,
+    city_id INTEGER NOT NULL REFERENCES cities (id),
+    method TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    original_property TEXT NOT NULL,
+    property TEXT NOT NULL,
+    "values" TEXT NOT NULL,
+    UNIQUE (city_id, method, original_property, property)
+);
+CREATE INDEX IF NOT EXISTS alignments_method_property ON alignments (method, property);
+
+CREATE TABLE IF NOT EXISTS annotated_cities (
+    city_id INTEGER NOT NULL REFERENCES cities (id),
+    annotator TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (annotator, city_id)
+);
+
+CREATE TABLE IF NOT EXISTS annotations (
+    alignment_id INTEGER NOT NULL REFERENCES alignments (id),
+    annotator TEXT NOT NULL,
+    correct INTEGER NOT NULL,
+    PRIMARY KEY (alignment_id, annotator)
+);
+CREATE INDEX IF NOT EXISTS annotations_annotator ON annotations (annotator);
+
+CREATE TABLE IF NOT EXISTS annotation_files (
+    annotator TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+"""
+
+
+def connect(path: str = "data/infoboxes.db") -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def upsert_city(connection: sqlite3.Connection, city: InfoBoxCity) -> int:
+    """
+    Inserts or updates a city and replaces its infobox rows. The alignments of the city are
+    upserted as well when the city has them, so existing annotations are kept.
+    :return: the id of the city in the database
+    """
+    connection.execute(
+        "INSERT INTO cities (uri, name, url_en, url_nl) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (uri) DO UPDATE SET name = excluded.name, url_en = excluded.url_en, "
+        "url_nl = excluded.url_nl",
+        (city.uri, city.name, city.url_en, city.url_nl),
+    )
+    city_id = connection.execute(
+        "SELECT id FROM cities WHERE uri = ?", (city.uri,)
+    ).fetchone()[0]
+
+    connection.execute("DELETE FROM infobox_rows WHERE city_id = ?", (city_id,))
+    connection.executemany(
+        "INSERT INTO infobox_rows VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (city_id, language, key, key_position, value_position, value)
+            for language, infobox in (("en", city.infobox_en), ("nl", city.infobox_nl))
+            for key_position, (key, values) in enumerate((infobox or {}).items())
+            # keys without values are stored as a single row with value_position -1
+            for value_position, value in (enumerate(values) if values else [(-1, "")])
+        ],
+    )
+
+    for method, alignments in (
+            (VALUE_ALIGNMENT, city.value_alignment_completed_infobox),
+            (EMBEDDING_ALIGNMENT, city.embedding_alignment_completed_infobox),
+    ):
+        for position, alignment in enumerate(alignments or []):
+            upsert_alignment(connection, city_id, method, position, alignment)
+
+    return city_id
+
+
+def upsert_alignment(
+        connection: sqlite3.Connection,
+        city_id: int,
+        method: str,
+        position: int,
+        alignment: Alignment
+) -> int:
+    connection.execute(
+        "INSERT INTO alignments "
+        '(city_id, method, position, original_property, property, "values") '
+        "VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (city_id, method, original_property, property) DO UPDATE SET "
+        'position = excluded.position, "values" = excluded."values"',
+        (
+            city_id, method, position, alignment.original_property, alignment.property_,
+            json.dumps(alignment.values),
+        ),
+    )
+    return connection.execute(
+        "SELECT id FROM alignments "
+        "WHERE city_id = ? AND method = ? AND original_property = ? AND property = ?",
+        (city_id, method, alignment.original_property, alignment.property_),
+    ).fetchone()[0]
+
+
+def import_cities(connection: sqlite3.Connection, cities: list[InfoBoxCity]) -> None:
+    with connection:
+        for city in cities:
+            upsert_city(connection, city)
+
+
+def import_property_alignments(
+        connection: sqlite3.Connection, method: str, alignments: dict[str, str]
+) -> None:
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO property_alignments VALUES (?, ?, ?)",
+            [(method, property_en, property_nl) for property_en, property_nl in alignments.items()],
+        )
+
+
+def insert_annotations(
+        connection: sqlite3.Connection, annotator: str, cities: list[InfoBoxCity]
+) -> None:
+    for city_position, city in enumerate(cities):
+        city_id = upsert_city(connection, city)
+        connection.execute(
+            "INSERT OR REPLACE INTO annotated_cities VALUES (?, ?, ?)",
+            (city_id, annotator, city_position),
+        )
+        for method, alignments in (
+                (VALUE_ALIGNMENT, city.value_alignment_completed_infobox),
+                (EMBEDDING_ALIGNMENT, city.embedding_alignment_completed_infobox),
+        ):
+            for position, alignment in enumerate(alignments or []):
+                alignment_id = upsert_alignment(connection, city_id, method, position, alignment)
+                connection.execute(
+                    "INSERT OR REPLACE INTO annotations VALUES (?, ?, ?)",
+                    (alignment_id, annotator, alignment.correct),
+                )
+
+
+def import_annotations(
+        connection: sqlite3.Connection, annotator: str, cities: list[InfoBoxCity]
+) -> None:
+    """Imports the annotated test cities of one annotator, as saved in test-cities_<name>.json"""
+    with connection:
+        insert_annotations(connection, annotator, cities)
+
+
+def sync_annotations(connection: sqlite3.Connection, annotator: str, path: str) -> bool:
+    """
+    Re-imports the annotations of an annotator when the file changed since the last import. The
+    previous annotations of the annotator are replaced, so labels that were changed or removed
+    from the file do not linger in the counts.
+    :return: whether the file was imported
+    """
+    with open(path, "rb") as file:
+        sha256 = hashlib.sha256(file.read()).hexdigest()
+    imported = connection.execute(
+        "SELECT sha256 FROM annotation_files WHERE annotator = ?", (annotator,)
+    ).fetchone()
+    if imported is not None and imported[0] == sha256:
+        return False
+
+    cities = load_infobox_cities(path)
+    with connection:
+        connection.execute("DELETE FROM annotations WHERE annotator = ?", (annotator,))
+        connection.execute("DELETE FROM annotated_cities WHERE annotator = ?", (annotator,))
+        insert_annotations(connection, annotator, cities)
+        connection.execute(
+            "INSERT OR REPLACE INTO annotation_files VALUES (?, ?)", (annotator, sha256)
+        )
+    return True
+
+
+def get_infobox(
+        connection: sqlite3.Connection, city_id: int, language: str
+) -> dict[str, list[str]]:
+    infobox = {}
+    for key, value_position, value in connection.execute(
+            "SELECT key, value_position, value FROM infobox_rows "
+            "WHERE city_id = ? AND language = ? ORDER BY key_position, value_position",
+            (city_id, language),
+    ):
+        values = infobox.setdefault(key, [])
+        if value_position >= 0:
+            values.append(value)
+    return infobox
+
+
+def get_alignments(
+        connection: sqlite3.Connection, city_id: int, method: str, annotator: str = None
+) -> list[Alignment]:
+    """
+    Returns the alignments of a city. If an annotator is given, only the alignments annotated by
+    that annotator are returned, with correct set to their label.
+    """
+    if annotator is None:
+        rows = connection.execute(
+            'SELECT original_property, property, "values", 0 FROM alignments '
+            "WHERE city_id = ? AND method = ? ORDER BY position",
+            (city_id, method),
+        )
+    else:
+        rows = connection.execute(
+            'SELECT original_property, property, "values", correct FROM alignments '
+            "JOIN annotations ON annotations.alignment_id = alignments.id "
+            "WHERE city_id = ? AND method = ? AND annotator = ? ORDER BY position",
+            (city_id, method, annotator),
+        )
+    return [
+        Alignment(original_property, property_, json.loads(values), bool(correct))
+        for original_property, property_, values, correct in rows
+    ]
+
+
+def export_cities(
+        connection: sqlite3.Connection, annotator: str = None
+) -> list[InfoBoxCity]:
+    """
+    Exports cities in the same format as the json files. If an annotator is given, only the
+    cities with annotations of that annotator are exported, like test-cities_<name>.json.
+    """
+    if annotator is None:
+        city_rows = connection.execute(
+            "SELECT id, name, uri, url_en, url_nl FROM cities ORDER BY id"
+        )
+    else:
+        city_rows = connection.execute(
+            "SELECT id, name, uri, url_en, url_nl FROM cities "
+            "JOIN annotated_cities ON annotated_cities.city_id = cities.id "
+            "WHERE annotator = ? ORDER BY position",
+            (annotator,),
+        )
+
+    cities = []
+    for city_id, name, uri, url_en, url_nl in city_rows.fetchall():
+        cities.append(InfoBoxCity(
+            name=name,
+            uri=uri,
+            url_en=url_en,
+            url_nl=url_nl,
+            infobox_en=get_infobox(connection, city_id, "en"),
+            infobox_nl=get_infobox(connection, city_id, "nl"),
+            value_alignment_completed_infobox=get_alignments(
+                connection, city_id, VALUE_ALIGNMENT, annotator
+            ),
+            embedding_alignment_completed_infobox=get_alignments(
+                connection, city_id, EMBEDDING_ALIGNMENT, annotator
+            ),
+        ))
+
+    return cities
+
+
+def precision(
+        connection: sqlite3.Connection, group_by: str, where: str = "", parameters: tuple = ()
+) -> dict[str, tuple[int, int]]:
+    """
+    Counts the correct and total annotated alignments per value of the group_by column.
+    :return: a dictionary with (correct, total) for each group
+    """
+    rows = connection.execute(
+        f"SELECT {group_by}, SUM(correct), COUNT(*) FROM annotations "
+        f"JOIN alignments ON alignments.id = annotations.alignment_id {where} "
+        f"GROUP BY {group_by} ORDER BY COUNT(*) DESC",
+        parameters,
+    )
+    return {group: (correct, total) for group, correct, total in rows}
+
+
+def precision_per_method(
+        connection: sqlite3.Connection, annotator: str = None
+) -> dict[str, tuple[int, int]]:
+    if annotator is None:
+        return precision(connection, "method")
+    return precision(connection, "method", "WHERE annotator = ?", (annotator,))
+
+
+def precision_per_annotator(
+        connection: sqlite3.Connection, method: str = None
+) -> dict[str, tuple[int, int]]:
+    if method is None:
+        return precision(connection, "annotator")
+    return precision(connection, "annotator", "WHERE method = ?", (method,))
+
+
+def precision_per_property(
+        connection: sqlite3.Connection, method: str = None
+) -> dict[str, tuple[int, int]]:
+    if method is None:
+        return precision(connection, "property")
+    return precision(connection, "property", "WHERE method = ?", (method,))
+
+
+def import_all(connection: sqlite3.Connection, population: int = 250000) -> None:
+    """
+    Imports the completed infoboxes, the embedding alignments and the annotation files that
+    changed since the last import
+    """
+    import_cities(connection, load_infobox_cities(f"data/cities-completed_{population}.json"))
+    import_property_alignments(
+        connection, EMBEDDING_ALIGNMENT, load_json(f"data/embedding-alignments_{population}.json")
+    )
+    for annotator in ANNOTATORS:
+        sync_annotations(connection, annotator, f"data/test-cities_{annotator}.json")
+
+
+def main(argv: list[str]):
+    """
+    Imports the json files into the database, or exports the annotations of an annotator.
+    Run with: python database.py import
+          or: python database.py export <annotator> <path>
+    """
+    connection = connect()
+
+    if argv[1] == "import":
+        import_all(connection)
+        for method, (correct, total) in precision_per_method(connection).items():
+            print(f"{method}: {correct}/{total}")
+    elif argv[1] == "export":
+        dump_infobox_cities(export_cities(connection, argv[2]), argv[3])
+    else:
+        raise ValueError(f"Unknown command {argv[1]}")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,375 @@
+"""
+Ingest from offline dumps instead of the live endpoints. The Wikidata JSON dump replaces
+get_cities and get_properties: in one pass it keeps the cities (instance of city, P31 = Q515,
+with a population, P1082, above the threshold, and an English and a Dutch article) with the
+properties of their statements, and the labels of all properties. The Wikipedia dumps replace
+parse_infoboxes: the infoboxes of the city articles are read from an XML wikitext dump
+(pages-articles) or an NDJSON dump with html or wikitext per article (enterprise html dump,
+optionally inside a tar archive).
+
+The dumps are decompressed while they are read, and at most MAX_PENDING batches of lines are
+in flight to the process pool that parses them, so the memory use does not grow with the size
+of the dump.
+"""
+import bz2
+import gzip
+import json
+import lzma
+import os
+import sys
+import tarfile
+import xml.etree.ElementTree as ElementTree
+from collections import deque
+from multiprocessing import Pool
+from urllib.parse import quote
+
+from tqdm import tqdm
+
+import metrics
+from serialization import dump_infobox_cities
+from util import CityProperty, Language, city_urls, city_with_infoboxes
+
+CITY = "Q515"
+BATCH_SIZE = 256
+MAX_PENDING = 64
+
+ENTITY_URI = "http://www.wikidata.org/entity/"
+ARTICLE_URL = "https://{language}.wikipedia.org/wiki/"
+
+
+def open_dump(path: str):
+    """Opens a, possibly compressed, dump as binary stream"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_lines(path: str):
+    """Yields the lines of a dump, or of every file in a tar archive"""
+    if ".tar" in os.path.basename(path):
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield from archive.extractfile(member)
+    else:
+        with open_dump(path) as file:
+            yield from file
+
+
+def read_batches(lines, batch_size: int = BATCH_SIZE):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bounded_imap(pool, function, batches, max_pending: int = MAX_PENDING):
+    """
+    Like Pool.imap, but reads the next batch only when fewer than max_pending batches are in
+    flight. Pool.imap reads all of its input ahead, which would load the whole dump.
+    """
+    pending = deque()
+    for batch in batches:
+        pending.append(pool.apply_async(function, (batch,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def best_statements(statements: list[dict]) -> list[dict]:
+    """The statements that are truthy (wdt:) in the query service: the best rank, not deprecated"""
+    preferred = [statement for statement in statements if statement.get("rank") == "preferred"]
+    if preferred:
+        return preferred
+    return [statement for statement in statements if statement.get("rank") == "normal"]
+
+
+def statement_values(entity: dict, property_id: str) -> list:
+    return [
+        statement["mainsnak"]["datavalue"]["value"]
+        for statement in best_statements(entity.get("claims", {}).get(property_id, []))
+        if statement["mainsnak"].get("snaktype") == "value"
+    ]
+
+
+def article_url(language: str, title: str) -> str:
+    return ARTICLE_URL.format(language=language) + quote(
+        title.replace(" ", "_"), safe="/:(),'!*$;@&=+~"
+    )
+
+
+def label(entity: dict, language: str) -> str | None:
+    value = entity.get("labels", {}).get(language, None)
+    return value["value"] if value else None
+
+
+def parse_entity(entity: dict, population: int, languages: list[str] = ()) -> tuple | None:
+    """
+    Returns ("property", id, label_en, label_nl) for a property, ("city", city, property ids)
+    for a city above the population threshold, and None for other entities. The urls of the
+    articles of the city in the other languages are stored in urls, by language code.
+    """
+    if entity.get("type") == "property":
+        uri = ENTITY_URI + entity["id"]
+        return "property", uri, label(entity, "en"), label(entity, "nl")
+
+    if CITY not in {value.get("id") for value in statement_values(entity, "P31")}:
+        return None
+    populations = [float(value["amount"]) for value in statement_values(entity, "P1082")]
+    sitelinks = entity.get("sitelinks", {})
+    name = label(entity, "en")
+    if not populations or max(populations) <= population or name is None \
+            or "enwiki" not in sitelinks or "nlwiki" not in sitelinks:
+        return None
+
+    city = {
+        "uri": ENTITY_URI + entity["id"],
+        "name": name,
+        "url_en": article_url("en", sitelinks["enwiki"]["title"]),
+        "url_nl": article_url("nl", sitelinks["nlwiki"]["title"]),
+    }
+    urls = {
+        language: article_url(language, sitelinks[f"{language}wiki"]["title"])
+        for language in languages if f"{language}wiki" in sitelinks
+    }
+    if urls:
+        city["urls"] = urls
+    property_ids = [
+        ENTITY_URI + property_id
+        for property_id, statements in entity.get("claims", {}).items()
+        if any(statement.get("rank") != "deprecated" and
+               statement["mainsnak"].get("snaktype") != "novalue" for statement in statements)
+    ]
+    return "city", city, property_ids
+
+
+def parse_wikidata_lines(arguments: tuple[list[bytes], int, list[str]]) -> list[tuple]:
+    lines, population, languages = arguments
+    results = []
+    for line in lines:
+        # the dump is one large json array with one entity per line, most entities are skipped
+        # before parsing the json
+        if b'"P1082"' not in line and b'"type":"property"' not in line:
+            continue
+        line = line.strip().rstrip(b",")
+        if not line.startswith(b"{"):
+            continue
+        result = parse_entity(json.loads(line), population, languages)
+        if result is not None:
+            results.append(result)
+    return results
+
+
+def ingest_wikidata(
+        dump_path: str, population: int, processes: int | None = None, languages: list[str] = ()
+) -> tuple[list[dict], dict[str, dict[str, CityProperty]]]:
+    """
+    Reads the cities and the properties per city from a Wikidata JSON dump, in one pass.
+    :param languages: the codes of the languages besides English and Dutch to get the urls of
+    :return: the cities in the format of get_cities, and the properties per city in the format
+    of get_properties
+    """
+    cities = []
+    city_properties = []
+    labels = {}
+
+    batches = (
+        (batch, population, languages) for batch in read_batches(read_lines(dump_path))
+    )
+    with Pool(processes) as pool:
+        for results in tqdm(
+                bounded_imap(pool, parse_wikidata_lines, batches), desc="Reading Wikidata dump"
+        ):
+            metrics.increment("dump_batches_total", source="wikidata")
+            for result in results:
+                if result[0] == "property":
+                    labels[result[1]] = result[2:]
+                else:
+                    cities.append(result[1])
+                    city_properties.append(result[2])
+
+    # the labels of the properties are only known at the end of the dump
+    properties_per_city = {
+        city["uri"].split("/")[-1]: {
+            property_id: CityProperty(property_id, *labels.get(property_id, (None, None)))
+            for property_id in property_ids
+        }
+        for city, property_ids in zip(cities, city_properties)
+    }
+    metrics.increment("dump_cities_total", len(cities), source="wikidata")
+    return cities, properties_per_city
+
+
+WANTED_TITLES: set[str] = set()
+
+
+def set_wanted_titles(titles: set[str]) -> None:
+    global WANTED_TITLES
+    WANTED_TITLES = titles
+
+
+def convert_article(content: str, content_format: str) -> dict[str, list[str]]:
+    if content_format == "html":
+        from parse_infoboxes import convert_infobox_html_to_dict, get_html_table_from_page
+        table = get_html_table_from_page(content)
+        return convert_infobox_html_to_dict(table[0]) if len(table) > 0 else {}
+
+    from wikitext_infoboxes import convert_infobox_wikitext_to_dict
+    return convert_infobox_wikitext_to_dict(content)
+
+
+def parse_article_lines(lines: list[bytes]) -> list[tuple[str, dict[str, list[str]]]]:
+    """Parses the infoboxes of the wanted articles in a batch of NDJSON lines"""
+    results = []
+    for line in lines:
+        # the title is one of the first fields, articles that are not wanted are not parsed
+        start = line.find(b'"name":')
+        if start == -1:
+            continue
+        try:
+            title = json.JSONDecoder().raw_decode(line[start + 7:].decode("utf-8").lstrip())[0]
+        except ValueError:
+            continue
+        if title not in WANTED_TITLES:
+            continue
+
+        article = json.loads(line)
+        body = article.get("article_body", {})
+        if "wikitext" in body:
+            results.append((title, convert_article(body["wikitext"], "wikitext")))
+        elif "html" in body:
+            results.append((title, convert_article(body["html"], "html")))
+    return results
+
+
+def parse_wikitext_pages(pages: list[tuple[str, str]]) -> list[tuple[str, dict[str, list[str]]]]:
+    return [(title, convert_article(text, "wikitext")) for title, text in pages]
+
+
+def read_xml_pages(path: str, titles: set[str]):
+    """Yields the title and wikitext of the wanted articles in a pages-articles XML dump"""
+    with open_dump(path) as file:
+        root = title = None
+        for event, element in ElementTree.iterparse(file, events=("start", "end")):
+            if root is None:
+                root = element
+            if event == "start":
+                continue
+            tag = element.tag.rsplit("}", 1)[-1]
+            if tag == "title":
+                title = element.text
+            elif tag == "text" and title in titles:
+                yield title, element.text or ""
+            elif tag == "page":
+                # the parsed pages stay attached to the root, so the root is cleared instead of
+                # the page, otherwise the whole tree stays in memory
+                root.clear()
+                title = None
+
+
+def ingest_wikipedia(
+        dump_path: str, titles: set[str], processes: int | None = None
+) -> dict[str, dict[str, list[str]]]:
+    """
+    Reads the infoboxes of the articles with the given titles from a Wikipedia dump.
+    :return: the infobox per title, for the titles that were found in the dump
+    """
+    is_xml = ".xml" in os.path.basename(dump_path)
+    infoboxes = {}
+
+    with Pool(processes, initializer=set_wanted_titles, initargs=(titles,)) as pool:
+        if is_xml:
+            results = bounded_imap(
+                pool, parse_wikitext_pages, read_batches(read_xml_pages(dump_path, titles), 16)
+            )
+        else:
+            results = bounded_imap(pool, parse_article_lines, read_batches(read_lines(dump_path)))
+
+        for batch in tqdm(results, desc=f"Reading {os.path.basename(dump_path)}"):
+            metrics.increment("dump_batches_total", source="wikipedia")
+            infoboxes.update(batch)
+
+    metrics.increment("dump_articles_total", len(infoboxes), source="wikipedia")
+    return infoboxes
+
+
+def save_infoboxes(cities_path: str, dump_paths: dict[str, str], infoboxes_path: str) -> None:
+    """
+    Writes the infoboxes of the cities from the Wikipedia dumps.
+    :param dump_paths: the path of the dump of every language, by language code, English and
+    Dutch are required
+    """
+    from wikitext_infoboxes import parse_page_url
+
+    with open(cities_path, "r", encoding="utf-8") as file:
+        cities = json.load(file)
+
+    titles = {language: set() for language in dump_paths}
+    for city in cities:
+        for language, url in city_urls(city).items():
+            if language in titles:
+                titles[language].add(parse_page_url(url)[1])
+    infoboxes = {
+        language: ingest_wikipedia(dump_path, titles[language])
+        for language, dump_path in dump_paths.items()
+    }
+
+    dump_infobox_cities(
+        [
+            city_with_infoboxes(city, {
+                language: infoboxes.get(language, {}).get(parse_page_url(url)[1], {})
+                for language, url in city_urls(city).items()
+            })
+            for city in cities
+        ],
+        infoboxes_path,
+    )
+
+
+def main(argv: list[str]):
+    """
+    Writes the cities and properties files from a Wikidata dump, with the urls of the articles
+    in the other languages, or the infoboxes file from an English and a Dutch Wikipedia dump and
+    the dumps of the other languages, given as <language>=<dump>.
+    Run with: python dump_ingest.py wikidata <dump> [population] [language ...]
+          or: python dump_ingest.py wikipedia <dump_en> <dump_nl> [population] [language=dump ...]
+    """
+    from get_properties import write_properties
+
+    if argv[1] == "wikidata":
+        population = int(argv[3]) if len(argv) > 3 else 1_000_000
+        languages = [Language(code).value for code in argv[4:] if code not in ("en", "nl")]
+        cities, properties_per_city = ingest_wikidata(argv[2], population, languages=languages)
+        with open(f"data/cities_{population}.json", "w") as file:
+            json.dump(cities, file, indent=4)
+        write_properties(
+            properties_per_city,
+            f"data/properties-per-city_{population}.json",
+            f"data/all-properties_{population}.json",
+        )
+    elif argv[1] == "wikipedia":
+        population = int(argv[4]) if len(argv) > 4 else 1_000_000
+        dump_paths = {"en": argv[2], "nl": argv[3]}
+        for argument in argv[5:]:
+            language, dump_path = argument.split("=", 1)
+            dump_paths[Language(language).value] = dump_path
+        save_infoboxes(
+            f"data/cities_{population}.json", dump_paths, f"data/infoboxes_{population}.json"
+        )
+    else:
+        raise ValueError(f"Unknown command {argv[1]}")
+
+    metrics.export("dump_ingest")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,28 +1,43 @@
-import itertools
 import json
-from enum import Enum
+import sys
+from functools import cache
 
+from scipy.spatial.distance import cdist
 from tqdm import tqdm
-from transformers import pipeline
 import numpy as np
 
-from util import InfoBoxCity, EmbeddingComparisonMode
-from config import COSINE_THRESHOLD, EUCLIDEAN_THRESHOLD, MODEL_NAME
+from infobox_store import InfoBoxStore
+import metrics
+from serialization import load_infobox_cities
+from util import InfoBoxCity, EmbeddingComparisonMode, Language
+from config import COSINE_THRESHOLD, EUCLIDEAN_THRESHOLD, MODEL_NAME, EMBEDDING_BACKEND
+from inference_backend import create_pipe, FeatureExtractor
 
-pipe = pipeline("feature-extraction", model=MODEL_NAME, device=0)
+# the number of source properties that are compared with all target properties at once
+BATCH_SIZE = 1024
+
+
+@cache
+def get_pipe():
+    """Loads the extraction pipeline on first use, so importing this module stays cheap"""
+    return create_pipe(MODEL_NAME, EMBEDDING_BACKEND)
 
 
 def compute_similarity(
         property_en: str,
         property_nl: str,
         mode: EmbeddingComparisonMode = EmbeddingComparisonMode.EUCLIDEAN,
+        pipe=None,
 ) -> float:
     """
     Uses the extraction pipeline to extract embeddings for the input strings and computes
     """
 
-    emb1 = np.array(pipe(property_en)).mean(axis=1)
-    emb2 = np.array(pipe(property_nl)).mean(axis=1)
+    pipe = get_pipe() if pipe is None else pipe
+    with metrics.stage("encode", source="embedding_alignment"):
+        emb1 = np.array(pipe(property_en)).mean(axis=1)
+        emb2 = np.array(pipe(property_nl)).mean(axis=1)
+    metrics.increment("encoded_labels_total", 2, source="embedding_alignment")
 
     if mode == EmbeddingComparisonMode.COSINE:
         distance = np.dot(emb1, emb2) / (np.linalg.norm(emb1) * np.linalg.norm(emb2))
@@ -34,54 +49,169 @@ def compute_similarity(
     return distance
 
 
-class Language(Enum):
-    EN = "en"
-    NL = "nl"
+def get_unique_properties(
+        cities: list[InfoBoxCity] | InfoBoxStore, language: Language
+) -> set[str]:
+    if isinstance(cities, InfoBoxStore):
+        return cities.unique_properties(language)
 
-
-def get_unique_properties(cities: list[InfoBoxCity], language: Language) -> set[str]:
     properties = set()
 
     for city in cities:
-        if language == Language.EN:
-            properties.update(city.infobox_en.keys())
-        elif language == Language.NL:
-            properties.update(city.infobox_nl.keys())
-        else:
-            raise ValueError(f"Unknown language {language}")
+        properties.update(city.infobox(language).keys())
 
     return properties
 
 
+def encode_properties(properties: list[str], pipe=None) -> np.ndarray:
+    """
+    The mean embedding of every property, with shape (properties, hidden size). The feature
+    extractors of the int8 and onnx backends embed the properties in padded batches, the
+    transformers pipeline embeds them one by one.
+    """
+    pipe = get_pipe() if pipe is None else pipe
+    with metrics.stage("encode", source="embedding_alignment"):
+        if isinstance(pipe, FeatureExtractor):
+            embeddings = pipe.embed(properties)
+        else:
+            embeddings = np.concatenate([np.array(pipe(text)).mean(axis=1) for text in properties])
+    metrics.increment("encoded_labels_total", len(properties), source="embedding_alignment")
+
+    return embeddings.astype(np.float64)
+
+
+def best_matches(
+        source: np.ndarray, targets: np.ndarray, mode: EmbeddingComparisonMode
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compares every source embedding with every target embedding in one matrix operation.
+    :return: for every source embedding the index of the closest target, and whether it is within
+    the threshold of the mode
+    """
+    if mode == EmbeddingComparisonMode.COSINE:
+        scores = 1 - cdist(source, targets, "cosine")
+        scores[~(scores > COSINE_THRESHOLD)] = -np.inf
+        best = scores.argmax(axis=1)
+    elif mode == EmbeddingComparisonMode.EUCLIDEAN:
+        scores = cdist(source, targets)
+        scores[~(scores < EUCLIDEAN_THRESHOLD)] = np.inf
+        best = scores.argmin(axis=1)
+    else:
+        raise ValueError(f"Unknown comparison mode {mode}")
+
+    return best, np.isfinite(scores[np.arange(len(best)), best])
+
+
+def align_languages(
+        cities: list[InfoBoxCity] | InfoBoxStore,
+        mode: EmbeddingComparisonMode,
+        source: Language,
+        targets: list[Language],
+        pipe=None,
+        batch_size: int = BATCH_SIZE,
+) -> dict[Language, dict[str, str]]:
+    """
+    Aligns the properties of the source language to the closest property of every target
+    language. The properties of all languages are encoded once into the shared space of the
+    multilingual model, a property that occurs in several languages only once. Each batch of
+    source properties is then compared with the properties of all targets at once, so both the
+    encoding and the comparison grow linearly with the number of languages.
+    :param cities: the infoboxes of the cities
+    :param mode: the distance to compare the embeddings with
+    :param source: the language whose properties are aligned
+    :param targets: the languages that the properties are aligned to
+    :param pipe: the feature extraction pipeline, by default the configured backend
+    :param batch_size: the number of source properties that are compared at once
+    :return: for every target language, the aligned target property per source property
+    """
+    properties = {
+        language: sorted(get_unique_properties(cities, language))
+        for language in [source, *targets]
+    }
+    texts = sorted(set().union(*properties.values()))
+    alignments = {target: {} for target in targets}
+    if not properties[source] or not any(properties[target] for target in targets):
+        return alignments
+
+    embeddings = encode_properties(texts, pipe)
+    indices = {text: index for index, text in enumerate(texts)}
+    source_embeddings = embeddings[[indices[text] for text in properties[source]]]
+    target_embeddings = embeddings[
+        [indices[text] for target in targets for text in properties[target]]
+    ]
+    target_offsets = np.cumsum([0] + [len(properties[target]) for target in targets])
+
+    for start in tqdm(
+            range(0, len(properties[source]), batch_size),
+            desc="Aligning properties with embeddings",
+    ):
+        batch = source_embeddings[start:start + batch_size]
+        for target, target_start, target_end in zip(
+                targets, target_offsets[:-1], target_offsets[1:]
+        ):
+            if target_start == target_end:
+                continue
+            best, found = best_matches(batch, target_embeddings[target_start:target_end], mode)
+            for index in np.flatnonzero(found):
+                alignments[target][properties[source][start + index]] = \
+                    properties[target][best[index]]
+
+    return alignments
+
+
+@metrics.timed("embedding_alignment")
 def align_properties(
-        cities: list[InfoBoxCity], mode: EmbeddingComparisonMode
+        cities: list[InfoBoxCity] | InfoBoxStore, mode: EmbeddingComparisonMode, pipe=None
 ) -> dict[str, str]:
-    alignments = {}
+    return align_languages(cities, mode, Language.EN, [Language.NL], pipe)[Language.NL]
 
-    properties_en = get_unique_properties(cities, Language.EN)
-    properties_nl = get_unique_properties(cities, Language.NL)
 
-    for property_en, property_nl in tqdm(
-            itertools.product(properties_en, properties_nl),
-            total=len(properties_en) * len(properties_nl),
-            desc='Aligning properties with embeddings'
-    ):
-        distance = compute_similarity(property_en, property_nl, mode)
+def save_embedding_alignments(
+        infoboxes_path: str,
+        embedding_alignments_path: str,
+        mode: EmbeddingComparisonMode = EmbeddingComparisonMode.EUCLIDEAN
+) -> None:
+    cities = InfoBoxStore.from_cities(load_infobox_cities(infoboxes_path))
+    alignments = align_properties(cities, mode)
+
+    with open(embedding_alignments_path, "w") as file:
+        json.dump(alignments, file, indent=4)
+
 
-        if mode == EmbeddingComparisonMode.COSINE and distance > COSINE_THRESHOLD:
-            if alignments.get(property_en, None) is None or alignments[property_en][1] < distance:
-                alignments[property_en] = (property_nl, distance)
-        elif mode == EmbeddingComparisonMode.EUCLIDEAN and distance < EUCLIDEAN_THRESHOLD:
-            if alignments.get(property_en, None) is None or alignments[property_en][1] > distance:
-                alignments[property_en] = (property_nl, distance)
+def save_language_alignments(
+        infoboxes_path: str,
+        alignments_path: str,
+        source: Language,
+        targets: list[Language],
+        mode: EmbeddingComparisonMode = EmbeddingComparisonMode.EUCLIDEAN
+) -> None:
+    """Writes the alignments from the source language to every target, by language code"""
+    cities = InfoBoxStore.from_cities(load_infobox_cities(infoboxes_path), [source, *targets])
+    with metrics.stage("embedding_alignment", source="languages"):
+        alignments = align_languages(cities, mode, source, targets)
 
-    return {key: value[0] for key, value in alignments.items()}
+    with open(alignments_path, "w") as file:
+        json.dump({target.value: alignments[target] for target in targets}, file, indent=4)
 
 
-def main():
-    with open("data/infoboxes.json", "r") as file:
-        cities = [InfoBoxCity.from_dict(city) for city in json.load(file)]
+def main(argv: list[str]):
+    """
+    Aligns the properties of the first language to those of the other languages, the alignments
+    are written to data/embedding-alignments_<languages>.json.
+    Run with: python embedding_alignment.py [infoboxes_path] [source target ...]
+    """
+    infoboxes_path = argv[1] if len(argv) > 1 else "data/infoboxes.json"
+    languages = argv[2:] or [Language.EN.value, Language.NL.value]
+
+    source, *targets = [Language(code) for code in languages]
+    save_language_alignments(
+        infoboxes_path,
+        f"data/embedding-alignments_{'-'.join(languages)}.json",
+        source,
+        targets,
+    )
+    metrics.export("embedding_alignment")
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv)
@@ -0,0 +1,275 @@
+"""
+Long-running encoder server for property similarity. The model is loaded once, and concurrent
+embedding and similarity requests are gathered into micro-batches: the worker waits at most
+BATCH_WINDOW seconds after the first queued request, then runs one padded forward pass for all
+texts in the window that are not in the embedding cache.
+
+Endpoints:
+    POST /embed       {"texts": [...], "layer": -1}
+    POST /similarity  {"pairs": [[text1, text2], ...], "layer": -1, "cosine_similarity": false}
+"""
+import http.client
+import json
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer
+
+from config import MODEL_NAME
+from inference_backend import load_model
+import metrics
+
+BATCH_WINDOW = 0.005
+MAX_BATCH_SIZE = 64
+CACHE_SIZE = 100_000
+
+
+class EmbeddingCache:
+    """Least recently used cache of embeddings, keyed by text and layer"""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.embeddings = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[str, int]) -> np.ndarray | None:
+        with self.lock:
+            embedding = self.embeddings.get(key, None)
+            if embedding is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.embeddings.move_to_end(key)
+            return embedding
+
+    def put(self, key: tuple[str, int], embedding: np.ndarray) -> None:
+        with self.lock:
+            self.embeddings[key] = embedding
+            self.embeddings.move_to_end(key)
+            if len(self.embeddings) > self.size:
+                self.embeddings.popitem(last=False)
+
+
+class BatchEncoder:
+    """Gathers the texts of concurrent requests into batches for a single worker thread"""
+
+    def __init__(
+            self,
+            model_id: str = MODEL_NAME,
+            batch_window: float = BATCH_WINDOW,
+            max_batch_size: int = MAX_BATCH_SIZE,
+            backend: str = "fp32"
+    ):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.model = load_model(model_id, backend)
+
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.cache = EmbeddingCache()
+        self.requests = queue.Queue()
+        self.batch_sizes = []
+
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def embed(self, texts: list[str], layer: int = -1) -> list[np.ndarray]:
+        """Returns the mean embedding of every text at the given layer, blocks until done"""
+        # the hidden states are the embedding output followed by the output of every layer
+        layers = self.model.config.num_hidden_layers + 1
+        if not -layers <= layer < layers:
+            raise ValueError(f"Layer {layer} is not in [{-layers}, {layers})")
+
+        embeddings = [self.cache.get((text, layer)) for text in texts]
+        missing = {text for text, embedding in zip(texts, embeddings) if embedding is None}
+
+        if missing:
+            futures = {}
+            for text in missing:
+                future = Future()
+                self.requests.put((text, layer, future))
+                futures[text] = future
+            embeddings = [
+                futures[text].result() if embedding is None else embedding
+                for text, embedding in zip(texts, embeddings)
+            ]
+
+        return embeddings
+
+    def next_batch(self) -> list[tuple[str, int, Future]]:
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.batch_window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self) -> None:
+        while True:
+            batch = self.next_batch()
+            try:
+                self.encode_batch(batch)
+            except Exception as error:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def encode_batch(self, batch: list[tuple[str, int, Future]]) -> None:
+        # several requests can ask for the same text, it is only encoded once
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self.batch_sizes.append(len(texts))
+        metrics.observe("encode_batch_size", len(texts), metrics.SIZE_BUCKETS, source="server")
+        metrics.increment("encoded_labels_total", len(texts), source="server")
+
+        with metrics.stage("encode", source="server"):
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True)
+            with torch.no_grad():
+                outputs = self.model(**inputs, output_hidden_states=True)
+
+        # mean over the tokens of each text, ignoring the padding
+        mask = inputs["attention_mask"].unsqueeze(-1)
+        lengths = mask.sum(dim=1)
+        indices = {text: index for index, text in enumerate(texts)}
+
+        embeddings = {}
+        for text, layer, future in batch:
+            key = (text, layer)
+            # a failing request only fails its own future, not the others in the batch
+            try:
+                if key not in embeddings:
+                    index = indices[text]
+                    hidden_states = outputs.hidden_states[layer][index] * mask[index]
+                    embeddings[key] = (hidden_states.sum(dim=0) / lengths[index]).numpy()
+                    self.cache.put(key, embeddings[key])
+            except Exception as error:
+                future.set_exception(error)
+            else:
+                future.set_result(embeddings[key])
+
+
+def compute_similarities(
+        encoder: BatchEncoder,
+        pairs: list[tuple[str, str]],
+        layer: int = -1,
+        cosine_similarity: bool = False
+) -> list[float]:
+    """Same distances as property_similarity.compute_similarity, for a batch of pairs"""
+    embeddings = encoder.embed([text for pair in pairs for text in pair], layer)
+    emb1, emb2 = np.stack(embeddings[0::2]), np.stack(embeddings[1::2])
+
+    if cosine_similarity:
+        distances = (emb1 * emb2).sum(axis=1) / (
+            np.linalg.norm(emb1, axis=1) * np.linalg.norm(emb2, axis=1)
+        )
+    else:
+        distances = np.linalg.norm(emb1 - emb2, axis=1)
+
+    return distances.tolist()
+
+
+def create_handler(encoder: BatchEncoder) -> type[BaseHTTPRequestHandler]:
+    class EncoderHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def send_json(self, status: int, data: dict) -> None:
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.send_json(200, {
+                    "status": "ok",
+                    "cache_hits": encoder.cache.hits,
+                    "cache_misses": encoder.cache.misses,
+                    "batches": len(encoder.batch_sizes),
+                    "mean_batch_size": float(np.mean(encoder.batch_sizes or [0])),
+                })
+            else:
+                self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length))
+                layer = int(request.get("layer", -1))
+                if self.path == "/embed":
+                    embeddings = encoder.embed(request["texts"], layer)
+                    response = {"embeddings": [embedding.tolist() for embedding in embeddings]}
+                elif self.path == "/similarity":
+                    response = {"similarities": compute_similarities(
+                        encoder, request["pairs"], layer,
+                        bool(request.get("cosine_similarity", False)),
+                    )}
+                else:
+                    self.send_json(404, {"error": f"Unknown path {self.path}"})
+                    return
+            except (ValueError, KeyError, TypeError, AttributeError, IndexError) as error:
+                self.send_json(400, {"error": f"Invalid request: {error!r}"})
+                return
+
+            self.send_json(200, response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return EncoderHandler
+
+
+def request_similarities(
+        pairs: list[tuple[str, str]],
+        layer: int = -1,
+        cosine_similarity: bool = False,
+        port: int = 8081
+) -> list[float]:
+    """Client for the /similarity endpoint of a running encoder server"""
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    body = json.dumps({"pairs": pairs, "layer": layer, "cosine_similarity": cosine_similarity})
+    connection.request(
+        "POST", "/similarity", body=body.encode("utf-8"),
+        headers={"Content-Type": "application/json"}
+    )
+    response = json.loads(connection.getresponse().read())
+    connection.close()
+
+    if "error" in response:
+        raise ValueError(response["error"])
+    return response["similarities"]
+
+
+def main(argv: list[str]):
+    """
+    Starts the encoder server on localhost, with the fp32 or the int8 backend.
+    Run with: python encoder_server.py [port] [model_id] [backend]
+    """
+    port = int(argv[1]) if len(argv) > 1 else 8081
+    model_id = argv[2] if len(argv) > 2 else MODEL_NAME
+    backend = argv[3] if len(argv) > 3 else "fp32"
+
+    encoder = BatchEncoder(model_id, backend=backend)
+    server = ThreadingHTTPServer(("127.0.0.1", port), create_handler(encoder))
+    print(f"Serving {model_id} on http://127.0.0.1:{port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
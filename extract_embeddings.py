@@ -1,18 +1,23 @@
 """Extracts the embeddings for all properties in Dutch and English in the fetched infoboxes (all-properties.json)"""
+from functools import cache
 from tqdm import tqdm
 import json
 import numpy as np
-from transformers import pipeline
 import warnings
-from config import MODEL_NAME
+from config import MODEL_NAME, EMBEDDING_BACKEND, EMBEDDING_FLOAT16
+from inference_backend import create_pipe, to_float16
+import metrics
 
 warnings.filterwarnings("ignore")
 
 # define types
 Embedding = np.ndarray[float]
 
-# Load the model and tokenizer
-pipe = pipeline("feature-extraction", model=MODEL_NAME, device=0)
+
+@cache
+def get_pipe():
+    """Loads the model and tokenizer of the configured backend on first use"""
+    return create_pipe(MODEL_NAME, EMBEDDING_BACKEND)
 
 
 def extract_mean_embedding(token: str) -> Embedding:
@@ -20,35 +25,50 @@ def extract_mean_embedding(token: str) -> Embedding:
     is multiple embeddings.
     """
 
-    embedding = np.array(pipe(token)).mean(axis=1).squeeze()
+    with metrics.stage("encode", source="extract_embeddings"):
+        embedding = np.array(get_pipe()(token)).mean(axis=1).squeeze()
+    metrics.increment("encoded_labels_total", source="extract_embeddings")
+    metrics.observe("encode_batch_size", 1, metrics.SIZE_BUCKETS, source="extract_embeddings")
 
     return embedding
 
 
-def extract_all_embeddings(all_properties: dict[str, dict]) -> dict[str, dict]:
-    """Supplements the all_properties dict with embeddings for the properties"""
+def extract_all_embeddings(
+        all_properties: dict[str, dict], float16: bool = EMBEDDING_FLOAT16
+) -> dict[str, dict]:
+    """Supplements the all_properties dict with embeddings for the properties, rounded to
+    float16 if float16 is True
+    """
+    convert = to_float16 if float16 else np.ndarray.tolist
 
     for property_id in tqdm(all_properties):
         # extract mean of embeddings
-        all_properties[property_id]["emb_nl"] = list(
+        all_properties[property_id]["emb_nl"] = convert(
             extract_mean_embedding(all_properties[property_id]["label_nl"])
         )
-        all_properties[property_id]["emb_en"] = list(
+        all_properties[property_id]["emb_en"] = convert(
             extract_mean_embedding(all_properties[property_id]["label_en"])
         )
 
     return all_properties
 
 
-def main():
-    """Extracts embeddings for all properties in all-properties.json"""
-    with open("data/all-properties.json", "r", encoding="utf-8") as inp:
+def save_embeddings(
+        all_properties_path: str, embeddings_path: str, float16: bool = EMBEDDING_FLOAT16
+) -> None:
+    """Extracts embeddings for all properties in all_properties_path"""
+    with open(all_properties_path, "r", encoding="utf-8") as inp:
         all_properties = json.load(inp)
 
-    all_properties_emb = extract_all_embeddings(all_properties)
-    with open("data/all-properties-with-emb.json", "w", encoding="utf-8") as outp:
+    all_properties_emb = extract_all_embeddings(all_properties, float16)
+    with open(embeddings_path, "w", encoding="utf-8") as outp:
         json.dump(all_properties_emb, outp, indent=4)
 
+
+def main():
+    """Extracts embeddings for all properties in all-properties.json"""
+    save_embeddings("data/all-properties.json", "data/all-properties-with-emb.json")
+    metrics.export("extract_embeddings")
     print("Done!")
 
 
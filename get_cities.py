@@ -1,23 +1,65 @@
 import pprint
+import sys
+import textwrap
+from collections.abc import Iterator
 
 import requests
 import json
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
-def get_cities(population_size: int = 125000) -> list[dict[str, dict[str, str]]]:
+import metrics
+from parse_infoboxes import request_with_retries
+from util import Language
+
+SPARQL_URL = "https://query.wikidata.org/sparql"
+PAGE_SIZE = 10000
+
+HEADERS = {
+    'Accept': 'application/sparql-results+json,*/*;q=0.9',
+    'User-Agent': 'python-requests/2.24.0',
+    'Content-Type': 'application/x-www-form-urlencoded',
+}
+
+
+def article_variable(language: str) -> str:
+    return f"?article_{language.replace('-', '_')}"
+
+
+def create_query(
+        population_size: int,
+        page_size: int | None = None,
+        after: str | None = None,
+        languages: list[str] = ()
+) -> str:
     """
-    With a SPARQL query, get all cities with a population of over 125000. The city name and
-    population size are returned.
-    :return:
+    Creates the SPARQL query for the cities with a population over population_size. With a page
+    size, the results are ordered by ?cid and only the cities after the city uri "after" are
+    returned, so that the next page can be requested without an OFFSET. The articles in the
+    other languages are optional, the cities need an English and a Dutch article.
     """
-    url = "https://query.wikidata.org/sparql"
-    query = f"""
+    keyset_filter = "" if after is None else f'FILTER (STR(?cid) > "{after}")'
+    variables = " ".join(article_variable(language) for language in languages)
+    page = "" if page_size is None else \
+        f"ORDER BY STR(?cid) ?article_en ?article_nl {variables} LIMIT {page_size}"
+    optional_articles = ""
+    for language in languages:
+        article = article_variable(language)
+        optional_articles += f"""
+        OPTIONAL {{
+            {article} schema:about ?cid ; schema:inLanguage "{language}" .
+            FILTER (STRSTARTS(STR({article}), "https://{language}.wikipedia.org/"))
+        }}"""
+    return f"""
     prefix schema: <http://schema.org/>
     PREFIX wikibase: <http://wikiba.se/ontology#>
     PREFIX wd: <http://www.wikidata.org/entity/>
     PREFIX wdt: <http://www.wikidata.org/prop/direct/>
 
-    SELECT DISTINCT ?cid ?city ?article_en ?article_nl
+    SELECT DISTINCT ?cid ?city ?article_en ?article_nl {variables}
     WHERE {{
         ?cid wdt:P31 wd:Q515 .
         ?cid wdt:P1082 ?population .
@@ -30,38 +72,151 @@ def get_cities(population_size: int = 125000) -> list[dict[str, dict[str, str]]]
             SUBSTR(str(?article_en), 1, 25) = "https://en.wikipedia.org/" 
             && SUBSTR(str(?article_nl), 1, 25) = "https://nl.wikipedia.org/"
             && ?population > {population_size}
-        )
+        ){optional_articles}
+        {keyset_filter}
     }} 
+    {page}
     """
 
-    headers = {
-        'Accept': 'application/sparql-results+json,*/*;q=0.9',
-        'User-Agent': 'python-requests/2.24.0',
-        'Content-Type': 'application/x-www-form-urlencoded',
-    }
+
+def get_cities(
+        population_size: int = 125000, languages: list[str] = ()
+) -> list[dict[str, dict[str, str]]]:
+    """
+    With a SPARQL query, get all cities with a population of over 125000. The city name and
+    population size are returned.
+    :param languages: the codes of the languages besides English and Dutch to get the urls of
+    :return:
+    """
     data = {
-        'query': query,
+        'query': create_query(population_size, languages=languages),
         'format': 'json'
     }
-    response = requests.post(url, headers=headers, data=data)
+    with metrics.stage("fetch", source="wikidata_cities"):
+        response = requests.post(SPARQL_URL, headers=HEADERS, data=data)
+    metrics.increment(
+        "fetch_requests_total", source="wikidata_cities", status=str(response.status_code)
+    )
+    metrics.increment("fetch_bytes_total", len(response.content), source="wikidata_cities")
+
     result = [
-        {
-            "uri": item['cid']['value'],
-            "name": item['city']['value'],
-            "url_en": item['article_en']['value'],
-            "url_nl": item['article_nl']['value']
-        }
-        for item in response.json()['results']['bindings']
+        convert_binding(item, languages) for item in response.json()['results']['bindings']
     ]
     return result
 
 
-def main():
-    population = 1_000_000
-    cities = get_cities(population)
-    with open(f"data/cities_{population}.json", "w") as file:
-        json.dump(cities, file, indent=4)
+def convert_binding(item: dict, languages: list[str] = ()) -> dict[str, str]:
+    """The city of a binding, with the urls of the other languages it has an article in"""
+    city = {
+        "uri": item['cid']['value'],
+        "name": item['city']['value'],
+        "url_en": item['article_en']['value'],
+        "url_nl": item['article_nl']['value']
+    }
+    urls = {
+        language: item[article_variable(language)[1:]]['value'] for language in languages
+        if article_variable(language)[1:] in item
+    }
+    if urls:
+        city["urls"] = urls
+    return city
+
+
+def get_cities_page(
+        population_size: int,
+        page_size: int,
+        after: str | None = None,
+        url: str = SPARQL_URL,
+        languages: list[str] = ()
+) -> Iterator[dict]:
+    """
+    Yields the bindings of one page of the paginated query. If ijson is installed, the response
+    is parsed while it is downloaded, otherwise the page is parsed at once. A request that is
+    throttled or fails on the server is retried, see parse_infoboxes.request_with_retries, other
+    errors raise a requests.HTTPError.
+    """
+    data = {
+        'query': create_query(population_size, page_size, after, languages),
+        'format': 'json'
+    }
+    response = request_with_retries(
+        lambda: requests.post(url, headers=HEADERS, data=data, stream=True), "wikidata_cities"
+    )
+    with response:
+        if ijson is not None:
+            response.raw.decode_content = True
+            yield from ijson.items(response.raw, "results.bindings.item")
+        else:
+            yield from response.json()['results']['bindings']
+
+
+def iter_cities(
+        population_size: int = 125000,
+        page_size: int = PAGE_SIZE,
+        url: str = SPARQL_URL,
+        languages: list[str] = ()
+) -> Iterator[dict[str, str]]:
+    """
+    Like get_cities, but requests the cities in pages of page_size bindings with keyset
+    pagination on ?cid, and yields every city once, as soon as its page arrives. A city with
+    several articles in a language is yielded with its first binding.
+    """
+    after = None
+    while True:
+        bindings = 0
+        for item in get_cities_page(population_size, page_size, after, url, languages):
+            bindings += 1
+            uri = item['cid']['value']
+            # the bindings are ordered by ?cid, so the duplicates of a city follow each other,
+            # and the bindings of the last city of a page that spill into the next are skipped
+            # by the keyset filter
+            if uri != after:
+                after = uri
+                metrics.increment("cities_total", source="wikidata_cities")
+                yield convert_binding(item, languages)
+
+        metrics.increment("fetch_pages_total", source="wikidata_cities")
+        if bindings < page_size:
+            return
+
+
+def save_cities(
+        population: int, cities_path: str, page_size: int | None = None, languages: list[str] = ()
+) -> None:
+    """
+    Saves the cities with a population over population. With a page size, the cities are
+    requested with iter_cities and written while they arrive, in the same format. The urls of
+    the articles in the other languages are stored in urls, by language code.
+    """
+    if page_size is None:
+        cities = get_cities(population, languages)
+        with open(cities_path, "w") as file:
+            json.dump(cities, file, indent=4)
+        return
+
+    with open(cities_path, "w") as file:
+        file.write("[")
+        for index, city in enumerate(
+                iter_cities(population, page_size, languages=languages)
+        ):
+            file.write(",\n" if index > 0 else "\n")
+            file.write(textwrap.indent(json.dumps(city, indent=4), " " * 4))
+        file.write("\n]" if file.tell() > 1 else "]")
+
+
+def main(argv: list[str]):
+    """
+    Saves the cities with a population over the threshold, in pages of page_size, with the urls
+    of their articles in the other languages, for example de fr.
+    Run with: python get_cities.py [population] [page_size] [language ...]
+    """
+    population = int(argv[1]) if len(argv) > 1 else 1_000_000
+    page_size = int(argv[2]) if len(argv) > 2 else PAGE_SIZE
+    # only the languages that can be aligned, a typo fails before the crawl
+    languages = [Language(code).value for code in argv[3:] if code not in ("en", "nl")]
+    save_cities(population, f"data/cities_{population}.json", page_size, languages)
+    metrics.export("get_cities")
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv)
@@ -4,6 +4,7 @@ import time
 import requests
 from tqdm import tqdm
 
+import metrics
 from util import CityProperty, City, Property
 
 # use user agent to prevent API from blocking requests
@@ -41,9 +42,13 @@ def get_entity_properties_and_labels(entity_id: str) -> dict[str, CityProperty]:
         'Content-Type': 'application/x-www-form-urlencoded',
     }
     data = {'query': query, 'format': 'json'}
-    response = requests.post(url, headers=headers, data=data)
+    with metrics.stage("fetch", source="wikidata"):
+        response = requests.post(url, headers=headers, data=data)
+    metrics.increment("fetch_requests_total", source="wikidata", status=str(response.status_code))
+    metrics.increment("fetch_bytes_total", len(response.content), source="wikidata")
 
     if response.status_code != 200:
+        metrics.increment("fetch_retries_total", source="wikidata")
         time.sleep(5)
         return get_entity_properties_and_labels(entity_id)
 
@@ -104,13 +109,11 @@ def create_all_properties_dict(
     return all_properties
 
 
-def main(argv: list[str]):
-    """Retrieves all properties from a list of cities and their wikidata URI's
-    Run with: python get_properties.py ./data/cities.json ./data/all_properties.json
-    To get properties per city, set PER_CITY to True and run again.
-    """
-    population = 1_000_000
-    with open(f"data/cities_{population}.json", 'r', encoding='utf-8') as inp:
+def save_properties(
+        cities_path: str, properties_per_city_path: str, all_properties_path: str
+) -> None:
+    """Retrieves all properties from a list of cities and their wikidata URI's"""
+    with open(cities_path, 'r', encoding='utf-8') as inp:
         cities = [
             City(
                 name=city['name'],
@@ -121,17 +124,40 @@ def main(argv: list[str]):
             ) for city in json.load(inp)
         ]
 
-    properties_per_city = get_properties_per_city(cities)
+    write_properties(
+        get_properties_per_city(cities), properties_per_city_path, all_properties_path
+    )
+
+
+def write_properties(
+        properties_per_city: dict[str, dict[str, CityProperty]],
+        properties_per_city_path: str,
+        all_properties_path: str
+) -> None:
+    """Writes the properties per city and all properties with their frequencies to file"""
     all_properties = create_all_properties_dict(properties_per_city)
 
     # write properties to file
-    with open(f"data/properties-per-city_{population}.json", 'w', encoding='utf-8') as out:
+    with open(properties_per_city_path, 'w', encoding='utf-8') as out:
         json.dump(properties_per_city, out, indent=4, default=lambda x: x.to_dict())
 
-    with open(f"data/all-properties_{population}.json", 'w', encoding='utf-8') as out:
+    with open(all_properties_path, 'w', encoding='utf-8') as out:
         json.dump(all_properties, out, indent=4, default=lambda x: x.to_dict())
 
 
+def main(argv: list[str]):
+    """Retrieves all properties from a list of cities and their wikidata URI's
+    Run with: python get_properties.py ./data/cities.json ./data/all_properties.json
+    To get properties per city, set PER_CITY to True and run again.
+    """
+    population = 1_000_000
+    save_properties(
+        f"data/cities_{population}.json",
+        f"data/properties-per-city_{population}.json",
+        f"data/all-properties_{population}.json",
+    )
+    metrics.export("get_properties")
+
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -0,0 +1,286 @@
+"""
+Selectable CPU inference backends for the embedding model:
+    fp32: the full precision model
+    int8: the weights of the linear layers dynamically quantized to int8 with torch
+    onnx: the model exported to ONNX, quantized to int8 and run with onnxruntime (optional)
+The backend is set with EMBEDDING_BACKEND in config.py. Run this file directly to compare the
+speed, memory and accuracy of the backends before switching.
+"""
+import io
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from transformers import AutoModel, AutoTokenizer, pipeline
+
+from config import EMBEDDING_BACKEND, EUCLIDEAN_THRESHOLD, MODEL_NAME
+
+BACKENDS = ["fp32", "int8", "onnx"]
+
+# the ONNX exports are kept per model, exporting and quantizing the model takes minutes
+ONNX_DIRECTORY = "data/onnx"
+
+
+def quantize_model(model: torch.nn.Module) -> torch.nn.Module:
+    """Quantizes the weights of the linear layers to int8, activations are quantized on the fly"""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_model(model_id: str = MODEL_NAME, backend: str = EMBEDDING_BACKEND) -> torch.nn.Module:
+    """Loads the model of a torch backend, these can return the hidden states of every layer"""
+    if backend not in ("fp32", "int8"):
+        raise ValueError(f"Backend {backend} does not return the hidden states of all layers")
+
+    model = AutoModel.from_pretrained(model_id)
+    model.eval()
+    return quantize_model(model) if backend == "int8" else model
+
+
+class OnnxModel:
+    """The model exported to ONNX with int8 weights, returns the last hidden state"""
+
+    def __init__(self, model_id: str, directory: str):
+        try:
+            import onnxruntime
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError as error:
+            raise ImportError("The onnx backend needs onnx and onnxruntime") from error
+
+        path = os.path.join(directory, "model.onnx")
+        quantized_path = os.path.join(directory, "model-int8.onnx")
+        if not os.path.exists(quantized_path):
+            model = AutoModel.from_pretrained(model_id)
+            model.eval()
+            tokenizer = AutoTokenizer.from_pretrained(model_id)
+            inputs = tokenizer(["export"], return_tensors="pt")
+            torch.onnx.export(
+                model,
+                (inputs["input_ids"], inputs["attention_mask"]),
+                path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "tokens"},
+                    "attention_mask": {0: "batch", 1: "tokens"},
+                    "last_hidden_state": {0: "batch", 1: "tokens"},
+                },
+            )
+            quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+
+        self.session = onnxruntime.InferenceSession(
+            quantized_path, providers=["CPUExecutionProvider"]
+        )
+        self.path = quantized_path
+
+    def __call__(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        return self.session.run(
+            ["last_hidden_state"],
+            {
+                "input_ids": input_ids.astype(np.int64),
+                "attention_mask": attention_mask.astype(np.int64),
+            },
+        )[0]
+
+
+class FeatureExtractor:
+    """
+    Extracts the last hidden state of a text, with the same output as the feature-extraction
+    pipeline, and mean embeddings of batches of texts.
+    """
+
+    def __init__(
+            self,
+            model_id: str = MODEL_NAME,
+            backend: str = EMBEDDING_BACKEND,
+            onnx_directory: str = ONNX_DIRECTORY
+    ):
+        self.backend = backend
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        if backend == "onnx":
+            directory = os.path.join(onnx_directory, model_id.strip("/").replace("/", "--"))
+            os.makedirs(directory, exist_ok=True)
+            self.model = OnnxModel(model_id, directory)
+        else:
+            self.model = load_model(model_id, backend)
+
+    def hidden_states(self, inputs) -> np.ndarray:
+        if self.backend == "onnx":
+            return self.model(inputs["input_ids"].numpy(), inputs["attention_mask"].numpy())
+        with torch.no_grad():
+            return self.model(**inputs).last_hidden_state.numpy()
+
+    def __call__(self, text: str) -> np.ndarray:
+        """The hidden state of every token of the text, with shape (1, tokens, hidden size)"""
+        return self.hidden_states(self.tokenizer(text, return_tensors="pt"))
+
+    def embed(self, texts: list[str], batch_size: int = 32) -> np.ndarray:
+        """The mean hidden state of every text, ignoring the padding of the batch"""
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + batch_size], return_tensors="pt", padding=True
+            )
+            mask = inputs["attention_mask"].numpy()[:, :, np.newaxis]
+            hidden_states = self.hidden_states(inputs)
+            embeddings.append((hidden_states * mask).sum(axis=1) / mask.sum(axis=1))
+        return np.concatenate(embeddings)
+
+
+def create_pipe(model_id: str = MODEL_NAME, backend: str = EMBEDDING_BACKEND):
+    """
+    Returns the feature extractor of a backend. The fp32 backend is the transformers pipeline,
+    the other backends return an extractor with the same output.
+    """
+    if backend == "fp32":
+        return pipeline("feature-extraction", model=model_id, device=0)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, choose from {BACKENDS}")
+    return FeatureExtractor(model_id, backend)
+
+
+def to_float16(embedding) -> list[float]:
+    """
+    Rounds an embedding to float16 for storage. The values are written with the shortest decimal
+    representation of the float16 value, so the json file shrinks as well.
+    """
+    return [float(value) for value in np.asarray(embedding, dtype=np.float16).astype(str)]
+
+
+def model_size(extractor: FeatureExtractor) -> int:
+    """The size of the weights of the model in bytes"""
+    if extractor.backend == "onnx":
+        return os.path.getsize(extractor.model.path)
+    buffer = io.BytesIO()
+    torch.save(extractor.model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def measure_backend(
+        texts: list[str],
+        model_id: str,
+        backend: str,
+        repeat: int,
+        onnx_directory: str = ONNX_DIRECTORY
+) -> tuple[dict[str, float], np.ndarray]:
+    """
+    Loads the backend and embeds the texts, the embeddings are rounded to float16. Runs in a
+    separate process, so that the peak memory belongs to this backend only. The ONNX export is
+    reused from onnx_directory, so the load time of the onnx backend only includes the export
+    on the first run.
+    """
+    start = time.perf_counter()
+    extractor = FeatureExtractor(model_id, backend, onnx_directory)
+    load_seconds = time.perf_counter() - start
+
+    extractor.embed(texts[:32])
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        embeddings = extractor.embed(texts)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    return {
+        "load_seconds": load_seconds,
+        "labels_per_second": len(texts) / seconds,
+        "model_bytes": model_size(extractor),
+        # kilobytes on Linux
+        "peak_resident_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }, np.asarray(embeddings, dtype=np.float16)
+
+
+def evaluate_embeddings(
+        embeddings_nl: np.ndarray, embeddings_en: np.ndarray, threshold: float
+) -> dict[str, float]:
+    """The test_system ranking metrics and the compute_threshold precision of the embeddings"""
+    from scipy.spatial.distance import cdist
+    from compute_threshold import matrix_precision
+    from test_system import compute_ranks, ranking_metrics
+
+    matrix = cdist(embeddings_nl.astype(np.float64), embeddings_en.astype(np.float64))
+    return {
+        **ranking_metrics(compute_ranks(matrix)),
+        "precision": matrix_precision(matrix, threshold),
+    }
+
+
+def compare_backends(
+        texts_en: list[str],
+        texts_nl: list[str],
+        model_id: str = MODEL_NAME,
+        backends: list[str] = None,
+        threshold: float = EUCLIDEAN_THRESHOLD,
+        repeat: int = 3,
+        onnx_directory: str = ONNX_DIRECTORY
+) -> dict[str, dict]:
+    """
+    Embeds the English and Dutch labels with every backend, stores the embeddings as float16 and
+    compares the speed, the memory and the accuracy with the fp32 backend.
+    """
+    backends = backends or ["fp32", "int8"]
+    texts = texts_en + texts_nl
+
+    results = {}
+    reference = None
+    for backend in backends:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            measurements, embeddings = executor.submit(
+                measure_backend, texts, model_id, backend, repeat, onnx_directory
+            ).result()
+
+        if reference is None:
+            reference = embeddings.astype(np.float64)
+
+        difference = embeddings.astype(np.float64) - reference
+        results[backend] = {
+            **measurements,
+            "max_embedding_difference": float(np.abs(difference).max()),
+            "mean_relative_difference": float(
+                np.mean(np.linalg.norm(difference, axis=1) / np.linalg.norm(reference, axis=1))
+            ),
+            **evaluate_embeddings(
+                embeddings[len(texts_en):], embeddings[:len(texts_en)], threshold
+            ),
+        }
+
+    return results
+
+
+def main(argv: list[str]):
+    """
+    Compares the backends on the labels of all properties, the report is written to
+    data/backend-comparison.json.
+    Run with: python inference_backend.py [all_properties_path] [model_id] [backend ...]
+    """
+    all_properties_path = argv[1] if len(argv) > 1 else "data/all-properties.json"
+    model_id = argv[2] if len(argv) > 2 else MODEL_NAME
+    backends = argv[3:] or None
+
+    with open(all_properties_path, "r", encoding="utf-8") as file:
+        properties = [
+            value for value in json.load(file).values() if value["label_en"] and value["label_nl"]
+        ]
+
+    results = compare_backends(
+        [value["label_en"] for value in properties],
+        [value["label_nl"] for value in properties],
+        model_id,
+        backends,
+    )
+    for backend, result in results.items():
+        print(backend)
+        for name, value in result.items():
+            print(f"    {name:<28} {value:.4f}")
+
+    with open("data/backend-comparison.json", "w", encoding="utf-8") as file:
+        json.dump(
+            {"model": model_id, "labels": 2 * len(properties), "results": results}, file, indent=4
+        )
+
+
+if __name__ == '__main__':
+    main(sys.argv)
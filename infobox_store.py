@@ -0,0 +1,262 @@
+"""
+Columnar, interned in-memory representation of the infoboxes of all cities. Every key and value
+string is stored once in a vocabulary and referred to by its id. The infoboxes of each language
+are stored as CSR-style arrays: the entries (key, value list) of city i are
+entry_offsets[i]:entry_offsets[i + 1], and the values of entry j are
+value_ids[value_offsets[j]:value_offsets[j + 1]]. Identical value lists are interned as well, so
+comparing two values is an integer comparison and property-wide queries are array operations.
+"""
+import sys
+import time
+from dataclasses import dataclass, field
+from functools import cached_property
+
+import numpy as np
+
+from serialization import load_infobox_cities
+from util import InfoBoxCity, Language
+
+
+@dataclass
+class LanguageColumns:
+    """The infoboxes of all cities in one language"""
+    entry_offsets: np.ndarray
+    entry_cities: np.ndarray
+    key_ids: np.ndarray
+    value_list_ids: np.ndarray
+    value_offsets: np.ndarray
+    value_ids: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            array.nbytes for array in (
+                self.entry_offsets, self.entry_cities, self.key_ids, self.value_list_ids,
+                self.value_offsets, self.value_ids,
+            )
+        )
+
+
+@dataclass
+class InfoBoxStore:
+    """
+    The infoboxes of all cities, with the city metadata stored as plain lists. The vocabulary and
+    the value lists are shared by all languages, so equal values have equal ids in every language.
+    """
+    names: list[str]
+    uris: list[str]
+    urls_en: list[str]
+    urls_nl: list[str]
+
+    vocabulary: list[str]
+    value_list_count: int
+    columns: dict[Language, LanguageColumns]
+
+    # the urls of the languages other than English and Dutch
+    urls: dict[Language, list[str | None]] = field(default_factory=dict)
+
+    @classmethod
+    def from_cities(
+            cls, cities: list[InfoBoxCity], languages: list[Language] = None
+    ) -> "InfoBoxStore":
+        """
+        :param cities: the cities to store
+        :param languages: the languages to store, by default English, Dutch and every other
+        language that one of the cities has an infobox in
+        """
+        if languages is None:
+            languages = list(dict.fromkeys(
+                [Language.EN, Language.NL]
+                + [language for city in cities for language in city.languages()]
+            ))
+
+        ids = {}
+        value_lists = {}
+        builders = {language: ([0], [], [], [], [0], []) for language in languages}
+
+        for city_index, city in enumerate(cities):
+            for language in languages:
+                entry_offsets, entry_cities, key_ids, value_list_ids, value_offsets, value_ids = \
+                    builders[language]
+
+                for key, values in (city.infobox(language) or {}).items():
+                    value_list = tuple(ids.setdefault(value, len(ids)) for value in values)
+                    entry_cities.append(city_index)
+                    key_ids.append(ids.setdefault(key, len(ids)))
+                    value_list_ids.append(value_lists.setdefault(value_list, len(value_lists)))
+                    value_ids.extend(value_list)
+                    value_offsets.append(len(value_ids))
+
+                entry_offsets.append(len(key_ids))
+
+        columns = {
+            language: LanguageColumns(
+                entry_offsets=np.array(entry_offsets, dtype=np.int32),
+                entry_cities=np.array(entry_cities, dtype=np.int32),
+                key_ids=np.array(key_ids, dtype=np.int32),
+                value_list_ids=np.array(value_list_ids, dtype=np.int32),
+                value_offsets=np.array(value_offsets, dtype=np.int32),
+                value_ids=np.array(value_ids, dtype=np.int32),
+            )
+            for language, (
+                entry_offsets, entry_cities, key_ids, value_list_ids, value_offsets, value_ids
+            ) in builders.items()
+        }
+
+        return cls(
+            names=[city.name for city in cities],
+            uris=[city.uri for city in cities],
+            urls_en=[city.url_en for city in cities],
+            urls_nl=[city.url_nl for city in cities],
+            vocabulary=list(ids),
+            value_list_count=len(value_lists),
+            columns=columns,
+            urls={
+                language: [city.url(language) for city in cities]
+                for language in languages if language not in (Language.EN, Language.NL)
+            },
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @cached_property
+    def ids(self) -> dict[str, int]:
+        """The id of every string in the vocabulary, only built when a string is looked up"""
+        return {string: index for index, string in enumerate(self.vocabulary)}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(columns.nbytes for columns in self.columns.values())
+
+    def values(self, language: Language, entry: int) -> list[str]:
+        columns = self.columns[language]
+        start, end = columns.value_offsets[entry], columns.value_offsets[entry + 1]
+        return [self.vocabulary[value_id] for value_id in columns.value_ids[start:end]]
+
+    def infobox(self, city_index: int, language: Language) -> dict[str, list[str]]:
+        columns = self.columns[language]
+        start, end = columns.entry_offsets[city_index], columns.entry_offsets[city_index + 1]
+        return {
+            self.vocabulary[columns.key_ids[entry]]: self.values(language, entry)
+            for entry in range(start, end)
+        }
+
+    def to_cities(self) -> list[InfoBoxCity]:
+        others = [
+            language for language in self.columns if language not in (Language.EN, Language.NL)
+        ]
+        return [
+            InfoBoxCity(
+                name=self.names[index],
+                uri=self.uris[index],
+                url_en=self.urls_en[index],
+                url_nl=self.urls_nl[index],
+                infobox_en=self.infobox(index, Language.EN),
+                infobox_nl=self.infobox(index, Language.NL),
+                urls={
+                    language.value: self.urls[language][index] for language in others
+                } if others else None,
+                infoboxes={
+                    language.value: self.infobox(index, language) for language in others
+                } if others else None,
+            )
+            for index in range(len(self))
+        ]
+
+    def unique_properties(self, language: Language) -> set[str]:
+        return {self.vocabulary[key_id] for key_id in np.unique(self.columns[language].key_ids)}
+
+    def lookup_table(self, alignments: dict[str, str]) -> tuple[np.ndarray, list[str]]:
+        """
+        Converts a property alignment to an array that maps key ids to the id of the aligned
+        property, or -1 if the key is not aligned. Aligned properties that are not in the
+        vocabulary get ids after the vocabulary, their strings are returned separately.
+        :param alignments: the alignment from the properties of one language to another
+        :return: the lookup array and the strings of the ids after the vocabulary
+        """
+        table = np.full(len(self.vocabulary), -1, dtype=np.int64)
+        extra = {}
+
+        for key, target in alignments.items():
+            key_id = self.ids.get(key, None)
+            if key_id is None:
+                continue
+
+            target_id = self.ids.get(target, None)
+            if target_id is None:
+                target_id = len(self.vocabulary) + extra.setdefault(target, len(extra))
+            table[key_id] = target_id
+
+        return table, list(extra)
+
+
+def deep_size(value, seen: set[int] = None) -> int:
+    """Approximates the memory use of nested lists, dicts and dataclasses in bytes"""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(deep_size(item, seen) for item in value)
+    elif hasattr(value, "__slots__"):
+        size += sum(deep_size(getattr(value, name), seen) for name in value.__slots__)
+
+    return size
+
+
+def main(argv: list[str]):
+    """
+    Compares the memory use, the value alignment speed and the completion speed of the list of
+    cities and the store. The completion uses the embedding alignments if they are given.
+    Run with: python infobox_store.py [data/infoboxes.json] [embedding_alignments_path]
+    """
+    from main import CompletionMode, complete_infobox, complete_store
+    from serialization import load_json, time_call
+    from value_alignment import align_properties, process_cities, process_store
+
+    path = argv[1] if len(argv) > 1 else "data/infoboxes.json"
+    embedding_alignments = load_json(argv[2]) if len(argv) > 2 else None
+    cities = load_infobox_cities(path)
+
+    start = time.perf_counter()
+    store = InfoBoxStore.from_cities(cities)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    properties = process_cities(cities)
+    cities_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store_properties = process_store(store)
+    store_time = time.perf_counter() - start
+
+    assert properties == store_properties
+
+    mode = CompletionMode.VALUE_ALIGNMENT if embedding_alignments is None else CompletionMode.ALL
+    value_alignments = align_properties(properties)
+    completion_cities_time = time_call(
+        lambda: complete_infobox(mode, cities, value_alignments, embedding_alignments), 5
+    )
+    completion_store_time = time_call(
+        lambda: complete_store(mode, store, value_alignments, embedding_alignments), 5
+    )
+
+    store_size = store.nbytes + deep_size(
+        [store.names, store.uris, store.urls_en, store.urls_nl, store.vocabulary]
+    )
+    print(f"{len(store)} cities, {len(store.vocabulary)} unique strings")
+    print(f"memory cities: {deep_size(cities) / 2 ** 20:.2f} MiB")
+    print(f"memory store:  {store_size / 2 ** 20:.2f} MiB (build {build_time * 1000:.1f} ms)")
+    print(f"value alignment cities: {cities_time * 1000:.1f} ms")
+    print(f"value alignment store:  {store_time * 1000:.1f} ms")
+    print(f"completion cities: {completion_cities_time * 1000:.1f} ms (best of 5)")
+    print(f"completion store:  {completion_store_time * 1000:.1f} ms (best of 5)")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,83 @@
+"""Load test for completion_service.py, run it against a local instance of the service."""
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+import numpy as np
+
+from config import RANDOM_SEED
+from serialization import load_infobox_cities
+
+
+def run_client(
+        port: int,
+        requests: list[tuple[str, str, bytes | None]],
+        latencies: list[float],
+        errors: list[int]
+) -> None:
+    """Sends the requests over a single keep-alive connection and records the latencies"""
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    for method, path, body in requests:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        start = time.perf_counter()
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors.append(response.status)
+    connection.close()
+
+
+def main(argv: list[str]):
+    """
+    Sends a mix of cached city and infobox pair requests from concurrent clients and prints the
+    throughput and latency percentiles.
+    Run with: python load_test_service.py [port] [requests] [clients] [population]
+    """
+    port = int(argv[1]) if len(argv) > 1 else 8080
+    total = int(argv[2]) if len(argv) > 2 else 10000
+    clients = int(argv[3]) if len(argv) > 3 else 8
+    population = int(argv[4]) if len(argv) > 4 else 250000
+
+    cities = load_infobox_cities(f"data/infoboxes_{population}.json")
+    random.seed(RANDOM_SEED)
+
+    requests = []
+    for _ in range(total):
+        city = random.choice(cities)
+        if random.random() < 0.5:
+            requests.append(("GET", f"/complete?uri={quote(city.uri)}", None))
+        else:
+            body = json.dumps({"infobox_en": city.infobox_en, "infobox_nl": city.infobox_nl})
+            requests.append(("POST", "/complete", body.encode("utf-8")))
+
+    latencies = []
+    errors = []
+    threads = [
+        threading.Thread(
+            target=run_client, args=(port, requests[index::clients], latencies, errors)
+        )
+        for index in range(clients)
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    print(f"{len(latencies)} requests from {clients} clients in {duration:.2f}s")
+    print(f"throughput: {len(latencies) / duration:.0f} requests/s, errors: {len(errors)}")
+    for percentile in (50, 90, 99, 99.9):
+        print(f"p{percentile}: {np.percentile(latencies_ms, percentile):.2f} ms")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,13 +1,15 @@
-import json
-import pprint
 import random
 from enum import Enum
 
+import numpy as np
+
 from config import RANDOM_SEED
-from util import InfoBoxCity, EmbeddingComparisonMode, Alignment
-from value_alignment import process_cities
-import value_alignment
-import embedding_alignment
+from serialization import load_infobox_cities, load_json, dump_infobox_cities
+from infobox_store import InfoBoxStore
+import metrics
+from util import InfoBoxCity, Alignment, Language
+from value_alignment import save_value_alignments
+from embedding_alignment import save_embedding_alignments
 
 
 class CompletionMode(Enum):
@@ -20,6 +22,7 @@ class CompletionMode(Enum):
     ALL = "all"
 
 
+@metrics.timed("completion")
 def complete_infobox(
         mode: CompletionMode,
         cities: list[InfoBoxCity],
@@ -48,46 +51,123 @@ def complete_infobox(
     return cities
 
 
-def main():
-    population = 125000
-    use_embedding_alignments_file = True
-
-    with open(f"data/infoboxes_{population}.json", "r") as file:
-        cities = [InfoBoxCity.from_dict(city) for city in json.load(file)]
+@metrics.timed("completion", source="store")
+def complete_store(
+        mode: CompletionMode,
+        store: InfoBoxStore,
+        value_alignments: dict[str, str],
+        embedding_alignments: dict[str, str] = None
+) -> list[tuple[list[Alignment], list[Alignment]]]:
+    """
+    Same as complete_infobox, but checks the conditions for all infobox entries at once on the
+    columnar store.
+    :return: the value alignments and the embedding alignments for each city in the store
+    """
+    columns_en, columns_nl = store.columns[Language.EN], store.columns[Language.NL]
+    cities_en = columns_en.entry_cities.astype(np.int64)
+    cities_nl = columns_nl.entry_cities.astype(np.int64)
 
-    value_properties = process_cities(cities)
-    value_alignments = value_alignment.align_properties(value_properties)
+    value_table, value_extra = store.lookup_table(value_alignments)
+    embedding_table, embedding_extra = store.lookup_table(
+        embedding_alignments if mode == CompletionMode.ALL else {}
+    )
+    targets = store.vocabulary + value_extra + embedding_extra
+    embedding_table[embedding_table >= len(store.vocabulary)] += len(value_extra)
 
-    with open(f"data/value-alignments_{population}.json", "w") as file:
-        json.dump(value_alignments, file, indent=4)
+    keys_nl = cities_nl * len(targets) + columns_nl.key_ids
 
-    population = 250000
-    if use_embedding_alignments_file:
-        with open(f"data/embedding-alignments_{population}.json", "r") as file:
-            embedding_alignments = json.load(file)
-    else:
-        with open(f"data/value-alignments_{population}.json", "r") as file:
-            embedding_cities = [InfoBoxCity.from_dict(city) for city in json.load(file)]
-
-        embedding_alignments = embedding_alignment.align_properties(
-            embedding_cities, EmbeddingComparisonMode.EUCLIDEAN
-        )
+    def target_not_in_infobox_nl(target_ids: np.ndarray) -> np.ndarray:
+        codes = cities_en * len(targets) + np.maximum(target_ids, 0)
+        return (target_ids >= 0) & ~np.isin(codes, keys_nl)
 
-        with open(f"data/embedding-alignments_{population}.json", "w") as file:
-            json.dump(embedding_alignments, file, indent=4)
+    value_not_in_infobox_nl = ~np.isin(
+        cities_en * store.value_list_count + columns_en.value_list_ids,
+        cities_nl * store.value_list_count + columns_nl.value_list_ids,
+    )
+    value_targets = value_table[columns_en.key_ids]
+    use_value = value_not_in_infobox_nl & target_not_in_infobox_nl(value_targets)
+
+    embedding_targets = embedding_table[columns_en.key_ids]
+    use_embedding = ~use_value & target_not_in_infobox_nl(embedding_targets)
+
+    value_ids = columns_en.value_ids.tolist()
+    completed = [([], []) for _ in range(len(store))]
+    for index, (use, target_ids) in enumerate(
+            ((use_value, value_targets), (use_embedding, embedding_targets))
+    ):
+        # plain python lists are much faster to index one element at a time than arrays
+        entries = np.flatnonzero(use)
+        starts = columns_en.value_offsets[entries].tolist()
+        ends = columns_en.value_offsets[entries + 1].tolist()
+        for entry_city, key_id, target_id, start, end in zip(
+                cities_en[entries].tolist(),
+                columns_en.key_ids[entries].tolist(),
+                target_ids[entries].tolist(),
+                starts,
+                ends,
+        ):
+            alignment = Alignment(
+                store.vocabulary[key_id],
+                targets[target_id],
+                [store.vocabulary[value_id] for value_id in value_ids[start:end]],
+            )
+            completed[entry_city][index].append(alignment)
+
+    return completed
+
+
+def save_completed_infoboxes(
+        infoboxes_path: str,
+        value_alignments_path: str,
+        embedding_alignments_path: str,
+        completed_path: str,
+        test_cities_path: str,
+        test_sample_size: int = 40
+) -> None:
+    """
+    Completes the infoboxes with the saved alignments, and saves the completed infoboxes and a
+    random sample of them for the qualitative evaluation.
+    """
+    cities = load_infobox_cities(infoboxes_path)
+    value_alignments = load_json(value_alignments_path)
+    embedding_alignments = load_json(embedding_alignments_path)
 
-    cities = complete_infobox(
-        CompletionMode.ALL, cities, value_alignments, embedding_alignments
+    completed = complete_store(
+        CompletionMode.ALL, InfoBoxStore.from_cities(cities), value_alignments, embedding_alignments
     )
+    for city, (value_completed, embedding_completed) in zip(cities, completed):
+        city.value_alignment_completed_infobox = value_completed
+        city.embedding_alignment_completed_infobox = embedding_completed
 
     random.seed(RANDOM_SEED)
-    test_cities = random.sample(cities, 40)
+    test_cities = random.sample(cities, min(test_sample_size, len(cities)))
+
+    dump_infobox_cities(cities, completed_path)
+    dump_infobox_cities(test_cities, test_cities_path)
+
 
-    with open(f"data/cities-completed_{population}.json", "w") as file:
-        json.dump(cities, file, indent=4, default=lambda x: x.to_dict())
+def main():
+    population = 125000
+    use_embedding_alignments_file = True
 
-    with open(f"data/test-cities_{population}.json", "w") as file:
-        json.dump(test_cities, file, indent=4, default=lambda x: x.to_dict())
+    save_value_alignments(
+        f"data/infoboxes_{population}.json", f"data/value-alignments_{population}.json"
+    )
+
+    population = 250000
+    if not use_embedding_alignments_file:
+        save_embedding_alignments(
+            f"data/infoboxes_{population}.json", f"data/embedding-alignments_{population}.json"
+        )
+
+    save_completed_infoboxes(
+        "data/infoboxes_125000.json",
+        "data/value-alignments_125000.json",
+        f"data/embedding-alignments_{population}.json",
+        f"data/cities-completed_{population}.json",
+        f"data/test-cities_{population}.json",
+    )
+    metrics.export("main")
 
 
 if __name__ == '__main__':
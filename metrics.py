@@ -0,0 +1,224 @@
+"""
+Lightweight instrumentation of the pipeline stages: counters, histograms and stage timers, with
+an optional cProfile hook per stage. At the end of a script the metrics are exported to a json
+file and a Prometheus textfile (data/metrics_<script>.json and data/metrics_<script>.prom).
+
+Set PROFILE_STAGES to a comma separated list of stage names (or "all") to write a cProfile
+profile of every run of those stages to PROFILE_DIR (default data/profiles).
+"""
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+PREFIX = "infobox_"
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for index, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[index] += 1
+
+    def merge(self, other: "Histogram") -> None:
+        self.sum += other.sum
+        self.count += other.count
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": dict(zip(map(str, self.buckets), self.counts)),
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+class Registry:
+    def __init__(self):
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(
+            self,
+            name: str,
+            value: float,
+            buckets: tuple[float, ...] = LATENCY_BUCKETS,
+            **labels: str
+    ) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def merge(self, other: "Registry") -> None:
+        """Adds the metrics of another registry, for example the registry of a worker process"""
+        with self.lock:
+            for key, value in other.counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, histogram in other.histograms.items():
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(histogram.buckets)
+                self.histograms[key].merge(histogram)
+
+    def __getstate__(self) -> dict:
+        # the lock cannot be pickled, so a registry can be sent back from a worker process
+        with self.lock:
+            return {"counters": dict(self.counters), "histograms": dict(self.histograms)}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__()
+        self.counters.update(state["counters"])
+        self.histograms.update(state["histograms"])
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **histogram.to_dict()}
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                for (counter_name, labels), value in self.counters.items():
+                    if counter_name == name:
+                        lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for (histogram_name, labels), histogram in self.histograms.items():
+                    if histogram_name != name:
+                        continue
+                    for bucket, count in zip(histogram.buckets, histogram.counts):
+                        bucket_labels = format_labels(labels + (("le", str(bucket)),))
+                        lines.append(f"{PREFIX}{name}_bucket{bucket_labels} {count}")
+                    infinity_labels = format_labels(labels + (("le", "+Inf"),))
+                    lines.append(f"{PREFIX}{name}_bucket{infinity_labels} {histogram.count}")
+                    lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+REGISTRY = Registry()
+
+
+def increment(name: str, value: float = 1, **labels: str) -> None:
+    REGISTRY.increment(name, value, **labels)
+
+
+def observe(
+        name: str, value: float, buckets: tuple[float, ...] = LATENCY_BUCKETS, **labels: str
+) -> None:
+    REGISTRY.observe(name, value, buckets, **labels)
+
+
+def profiled_stages() -> set[str]:
+    return {stage for stage in os.environ.get("PROFILE_STAGES", "").split(",") if stage}
+
+
+@contextmanager
+def profile(name: str):
+    """
+    Profiles a stage with cProfile if it is in PROFILE_STAGES, unless another profiler is already
+    running. The profile is written to a file, so this also works in worker processes.
+    """
+    stages = profiled_stages()
+    profiler = None
+    if name in stages or "all" in stages:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            profiler = None
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            directory = os.environ.get("PROFILE_DIR", "data/profiles")
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(
+                os.path.join(directory, f"{name}_{os.getpid()}_{time.time_ns()}.prof")
+            )
+
+
+@contextmanager
+def stage(name: str, **labels: str):
+    """Times a stage into the <name>_seconds histogram, and profiles it, see profile"""
+    with profile(name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+
+def timed(name: str, **labels: str):
+    """Decorator that runs every call of the function as a stage"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export(script: str, directory: str = "data") -> None:
+    """Writes the metrics to <directory>/metrics_<script>.json and .prom"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"metrics_{script}.json"), "w", encoding="utf-8") as out:
+        json.dump({"script": script, **REGISTRY.to_dict()}, out, indent=4)
+
+    # the textfile collector may read the file at any moment, so it is replaced atomically
+    path = os.path.join(directory, f"metrics_{script}.prom")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as out:
+        out.write(REGISTRY.to_prometheus())
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,168 @@
+"""
+Local mock of the query/revisions part of the MediaWiki action API, to test wikitext_infoboxes.py
+without network access. Like the real API, it normalises titles, follows redirects, reports
+missing pages and returns the content of a large batch in several parts with "continue".
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# the real API returns the content of at most 50 pages per response, less for large pages
+MAX_CONTENT_PAGES = 20
+
+
+def normalise_title(title: str) -> str:
+    title = title.replace("_", " ").strip()
+    return title[:1].upper() + title[1:]
+
+
+def query_pages(
+        pages: dict[str, str], redirects: dict[str, str], parameters: dict[str, str]
+) -> dict:
+    """Answers an action=query&prop=revisions request in formatversion 2"""
+    titles = parameters["titles"].split("|")
+    offset = int(parameters.get("rvcontinue", 0))
+
+    query = {"normalized": [], "redirects": [], "pages": []}
+    resolved = []
+    for title in titles:
+        normalised = normalise_title(title)
+        if normalised != title:
+            query["normalized"].append({"from": title, "to": normalised})
+        if normalised in redirects and parameters.get("redirects") in ("1", "true"):
+            query["redirects"].append({"from": normalised, "to": redirects[normalised]})
+            normalised = redirects[normalised]
+        if normalised not in resolved:
+            resolved.append(normalised)
+
+    for index, title in enumerate(resolved):
+        if title not in pages:
+            query["pages"].append({"ns": 0, "title": title, "missing": True})
+        elif offset <= index < offset + MAX_CONTENT_PAGES:
+            query["pages"].append({
+                "pageid": index + 1, "ns": 0, "title": title,
+                "revisions": [{"slots": {"main": {
+                    "contentmodel": "wikitext", "contentformat": "text/x-wiki",
+                    "content": pages[title],
+                }}}],
+            })
+        else:
+            query["pages"].append({"pageid": index + 1, "ns": 0, "title": title})
+
+    result = {"batchcomplete": offset + MAX_CONTENT_PAGES >= len(resolved), "query": query}
+    if offset + MAX_CONTENT_PAGES < len(resolved):
+        result["continue"] = {"rvcontinue": str(offset + MAX_CONTENT_PAGES), "continue": "||"}
+    return result
+
+
+def create_handler(
+        pages: dict[str, dict[str, str]],
+        redirects: dict[str, dict[str, str]] | None = None,
+        statistics: dict[str, int] | None = None
+) -> type[BaseHTTPRequestHandler]:
+    """
+    :param pages: the wikitext per title, per language
+    :param redirects: the target title per redirected title, per language
+    :param statistics: counts the requests and the response bytes
+    """
+    redirects = redirects or {}
+    statistics = statistics if statistics is not None else {}
+    lock = threading.Lock()
+
+    class MockApiHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def answer(self, parameters: dict[str, list[str]]) -> None:
+            # the path is /<language>/api.php
+            language = urlparse(self.path).path.strip("/").split("/")[0]
+            parameters = {key: values[-1] for key, values in parameters.items()}
+
+            if language not in pages or parameters.get("action") != "query" \
+                    or parameters.get("prop") != "revisions" or "titles" not in parameters:
+                status, result = 400, {"error": {"code": "badrequest", "info": self.path}}
+            else:
+                status = 200
+                result = query_pages(pages[language], redirects.get(language, {}), parameters)
+
+            # formatversion 2 returns the text as utf-8 instead of escaped ascii
+            body = json.dumps(result, ensure_ascii=False).encode("utf-8")
+            with lock:
+                statistics["requests"] = statistics.get("requests", 0) + 1
+                statistics["bytes"] = statistics.get("bytes", 0) + len(body)
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self.answer(parse_qs(urlparse(self.path).query))
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.answer(parse_qs(self.rfile.read(length).decode("utf-8")))
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockApiHandler
+
+
+def main(argv: list[str]):
+    """
+    Serves synthetic articles and compares the infoboxes parsed from the wikitext with the
+    infoboxes the articles were generated from, and the request count with that of fetching the
+    html of every article.
+    Run with: python mock_mediawiki_api.py [cities] [port]
+    """
+    import wikitext_infoboxes
+    from synthetic_data import generate_cities, generate_infobox_html, generate_infobox_wikitext
+
+    number_of_cities = int(argv[1]) if len(argv) > 1 else 500
+    port = int(argv[2]) if len(argv) > 2 else 8090
+
+    cities = generate_cities(number_of_cities)
+    pages = {"en": {}, "nl": {}}
+    for city in cities:
+        pages["en"][wikitext_infoboxes.parse_page_url(city.url_en)[1]] = \
+            generate_infobox_wikitext(city.infobox_en, "Infobox settlement")
+        pages["nl"][wikitext_infoboxes.parse_page_url(city.url_nl)[1]] = \
+            generate_infobox_wikitext(city.infobox_nl, "Infobox plaats")
+
+    statistics = {}
+    server = ThreadingHTTPServer(("127.0.0.1", port), create_handler(pages, None, statistics))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    start = time.perf_counter()
+    infoboxes = wikitext_infoboxes.get_infoboxes_batch(
+        [city.url_en for city in cities] + [city.url_nl for city in cities],
+        f"http://127.0.0.1:{port}/{{language}}/api.php",
+    )
+    seconds = time.perf_counter() - start
+    server.shutdown()
+
+    mismatches = sum(
+        infoboxes[city.url_en] != city.infobox_en or infoboxes[city.url_nl] != city.infobox_nl
+        for city in cities
+    )
+    html_bytes = sum(
+        len(generate_infobox_html(infobox).encode("utf-8"))
+        for city in cities for infobox in (city.infobox_en, city.infobox_nl)
+    )
+    print(f"{2 * len(cities)} articles in {seconds:.2f} s, {mismatches} cities differ")
+    print(f"wikitext: {statistics['requests']} requests, {statistics['bytes']} bytes")
+    # the synthetic pages contain only the infobox, while the wikitext has a reference for every
+    # value, so the mock shows the reduction in requests but not in payload
+    print(f"html:     {2 * len(cities)} requests, {html_bytes} bytes of infobox-only pages")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
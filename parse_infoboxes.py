@@ -1,11 +1,80 @@
 import json
+import os
+import queue
+import sys
+import threading
+import time
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from functools import partial
+
 import requests
 from bs4 import BeautifulSoup, ResultSet, Tag
 import re
 from tqdm import tqdm
 
-from util import InfoBoxCity
+import metrics
+from serialization import dump_infobox_cities
+from util import InfoBoxCity, city_urls, city_with_infoboxes
+
+# the threads that download the pages, the processes that parse them, and the number of downloaded
+# pages that can wait for a parse process before the downloads pause
+FETCH_THREADS = 8
+PARSE_PROCESSES = os.cpu_count()
+MAX_QUEUED_PAGES = 32
+
+# a request that is throttled (429) or fails on the server (5xx) is retried at most MAX_RETRIES
+# times, after the Retry-After of the response or else after RETRY_SECONDS, doubled every retry
+MAX_RETRIES = 5
+RETRY_SECONDS = 1.0
+MAX_RETRY_SECONDS = 120.0
+
+
+def retry_delay(response: requests.Response, retry: int) -> float:
+    """The seconds to wait before the retry, counting from 0"""
+    retry_after = response.headers.get("Retry-After", None)
+    if retry_after is not None:
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                seconds = RETRY_SECONDS * 2 ** retry
+    else:
+        seconds = RETRY_SECONDS * 2 ** retry
+    return min(max(seconds, 0.0), MAX_RETRY_SECONDS)
+
+
+def request_with_retries(send, source: str) -> requests.Response:
+    """
+    Sends a request until it succeeds. A request that is throttled (429) or fails on the server
+    (5xx) is retried at most MAX_RETRIES times, any other status raises at once.
+    :param send: sends the request and returns the response
+    :param source: the source of the fetch metrics
+    :return: the response with status 200
+    """
+    for retry in range(MAX_RETRIES + 1):
+        with metrics.stage("fetch", source=source):
+            response = send()
+        metrics.increment("fetch_requests_total", source=source, status=str(response.status_code))
+
+        if response.status_code == 200:
+            return response
+        if (response.status_code != 429 and response.status_code < 500) or retry == MAX_RETRIES:
+            break
+
+        response.close()
+        metrics.increment("fetch_retries_total", source=source)
+        time.sleep(retry_delay(response, retry))
+
+    raise requests.HTTPError(
+        f"Status {response.status_code} for {response.url} after {retry} retries",
+        response=response,
+    )
 
 
 def get_wiki_page(url: str) -> str:
@@ -13,12 +82,25 @@ def get_wiki_page(url: str) -> str:
         'accept': 'text/html; charset=utf-8; profile="https://www.mediawiki.org/wiki/Specs/HTML/2'
                   '.1.0"'
     }
-    response = requests.get(url, headers=headers)
+    response = request_with_retries(lambda: requests.get(url, headers=headers), "wikipedia")
+    metrics.increment("fetch_bytes_total", len(response.content), source="wikipedia")
+    return response.text
 
-    if response.status_code != 200:
-        return get_wiki_page(url)
 
-    return response.text
+def fetch_page(url: str) -> str | None:
+    """
+    Like get_wiki_page, but a page that fails permanently, like a deleted article or a page that
+    is still throttled after the retries, is counted and logged and None is returned, so that one
+    page does not stop a crawl. Other errors, like a lost connection, are raised.
+    """
+    try:
+        return get_wiki_page(url)
+    except requests.HTTPError as error:
+        metrics.increment(
+            "failed_pages_total", source="wikipedia", status=str(error.response.status_code)
+        )
+        tqdm.write(f"Skipping {url}: {error}")
+        return None
 
 
 def get_html_table_from_page(page: str) -> ResultSet[Tag]:
@@ -96,39 +178,300 @@ def get_infoboxes(url: str) -> dict[str, list[str]]:
     """
     Get all infoboxes from a wikipedia page.
     :param url: the url of the wikipedia page
-    :return: a dictionary with the infoboxes
+    :return: a dictionary with the infoboxes, empty if the page failed, see fetch_page
     """
 
-    page = get_wiki_page(url)
-    table = get_html_table_from_page(page)
-    if len(table) == 0:
+    page = fetch_page(url)
+    if page is None:
         return {}
-    infobox = convert_infobox_html_to_dict(table[0])
+    infobox, timings = parse_page(page)
+    record_parse_timings(timings)
     return infobox
 
 
-def main():
-    population = 1_000_000
-    with open(f"data/cities_{population}.json", "r") as file:
+def parse_page(page: str) -> tuple[dict[str, list[str]], dict[str, float]]:
+    """
+    Parses the infobox of a page. The seconds of the parse_html and the extract_rows phase are
+    returned instead of recorded, because the metrics of a parse process are not exported, see
+    record_parse_timings.
+    """
+    start = time.perf_counter()
+    with metrics.profile("parse_html"):
+        table = get_html_table_from_page(page)
+    parsed = time.perf_counter()
+    with metrics.profile("extract_rows"):
+        infobox = convert_infobox_html_to_dict(table[0]) if len(table) > 0 else {}
+    return infobox, {"parse_html": parsed - start, "extract_rows": time.perf_counter() - parsed}
+
+
+def record_parse_timings(timings: dict[str, float]) -> None:
+    """Records the phase timings of parse_page in the metrics of this process"""
+    for phase, seconds in timings.items():
+        metrics.observe(f"{phase}_seconds", seconds)
+
+
+@dataclass
+class StageStatistics:
+    """
+    The throughput of a stage of the infobox pipeline. The busy time is the sum of the time of
+    every item, the waiting time is the time the stage waited for the stage before or after it.
+    """
+    items: int = 0
+    busy_seconds: float = 0.0
+    waiting_seconds: float = 0.0
+    start: float = float("inf")
+    end: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, start: float, end: float, waiting_seconds: float = 0.0) -> None:
+        with self.lock:
+            self.items += 1
+            self.busy_seconds += end - start
+            self.waiting_seconds += waiting_seconds
+            self.start = min(self.start, start)
+            self.end = max(self.end, end)
+
+    def to_dict(self) -> dict[str, float]:
+        seconds = max(self.end - self.start, 0.0)
+        return {
+            "items": self.items,
+            "seconds": seconds,
+            "busy_seconds": self.busy_seconds,
+            "waiting_seconds": self.waiting_seconds,
+            "items_per_second": self.items / seconds if seconds > 0 else 0.0,
+        }
+
+
+def iter_infoboxes(
+        urls: list[str],
+        fetch_threads: int = FETCH_THREADS,
+        parse_processes: int = PARSE_PROCESSES,
+        max_queued_pages: int = MAX_QUEUED_PAGES,
+        statistics: dict[str, StageStatistics] = None,
+):
+    """
+    Fetches and parses the infoboxes of wikipedia pages in a pipeline. The fetch threads put the
+    downloaded pages in a bounded queue, from which they are handed to a pool of processes that
+    parse them. The threads download the next pages while the processes parse, and wait when the
+    queue is full, so a slow stage only holds up the other one when it falls behind for long.
+    :param urls: the urls of the wikipedia pages
+    :param fetch_threads: the number of threads that download pages
+    :param parse_processes: the number of processes that parse pages, with 0 every fetch thread
+    parses the pages it downloads
+    :param max_queued_pages: the number of downloaded pages that can wait for a parse process,
+    and the number of pages that the processes hold at most
+    :param statistics: filled with the StageStatistics of the fetch and the parse stage
+    :return: yields the infobox of every url, in the order of the urls, empty for a page that
+    failed permanently (see fetch_page). Any other error stops the pipeline and is raised.
+    """
+    statistics = {} if statistics is None else statistics
+    fetch_statistics = statistics.setdefault("fetch", StageStatistics())
+    parse_statistics = statistics.setdefault("parse", StageStatistics())
+
+    urls_queue = queue.Queue()
+    for item in enumerate(urls):
+        urls_queue.put(item)
+    pages = queue.Queue(maxsize=max_queued_pages)
+    results = queue.Queue()
+    parsing = threading.Semaphore(max_queued_pages)
+    stopped = threading.Event()
+
+    def put_page(item: tuple[int, str] | None) -> None:
+        # waits while the queue is full, unless the pipeline is stopped
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def fetch() -> None:
+        try:
+            while not stopped.is_set():
+                try:
+                    index, url = urls_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                start = time.perf_counter()
+                page = fetch_page(url)
+                end = time.perf_counter()
+                if page is None:
+                    fetch_statistics.add(start, end)
+                    results.put((index, {}, None))
+                elif parse_processes == 0:
+                    fetch_statistics.add(start, end)
+                    infobox, timings = parse_page(page)
+                    record(index, infobox, timings, 0.0)
+                else:
+                    put_page((index, page))
+                    fetch_statistics.add(start, end, time.perf_counter() - end)
+        except Exception as error:
+            results.put((None, None, error))
+        finally:
+            if parse_processes > 0:
+                put_page(None)
+
+    def record(
+            index: int, infobox: dict[str, list[str]], timings: dict[str, float], waiting: float
+    ) -> None:
+        seconds = sum(timings.values())
+        end = time.perf_counter()
+        parse_statistics.add(end - seconds, end, waiting)
+        metrics.observe("parse_page_seconds", seconds)
+        record_parse_timings(timings)
+        results.put((index, infobox, None))
+
+    def parsed(index: int, waiting_seconds: float, future) -> None:
+        parsing.release()
+        if future.exception() is not None:
+            results.put((index, None, future.exception()))
+            return
+        infobox, timings = future.result()
+        record(index, infobox, timings, waiting_seconds)
+
+    def dispatch(executor: ProcessPoolExecutor) -> None:
+        finished = 0
+        while finished < fetch_threads and not stopped.is_set():
+            start = time.perf_counter()
+            item = pages.get()
+            if item is None:
+                finished += 1
+                continue
+
+            index, page = item
+            waiting_seconds = time.perf_counter() - start
+            parsing.acquire()
+            metrics.observe("queued_pages", pages.qsize(), metrics.SIZE_BUCKETS)
+            try:
+                future = executor.submit(parse_page, page)
+            except RuntimeError:
+                # the pool is shut down because the pipeline stopped early
+                return
+            future.add_done_callback(partial(parsed, index, waiting_seconds))
+
+    with ProcessPoolExecutor(parse_processes) if parse_processes > 0 else nullcontext() \
+            as executor:
+        threads = [threading.Thread(target=fetch, daemon=True) for _ in range(fetch_threads)]
+        if parse_processes > 0:
+            threads.append(threading.Thread(target=dispatch, args=(executor,), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        # the pages are parsed in the order they are downloaded, the infoboxes are held back
+        # until the infoboxes of all earlier urls are done
+        done = {}
+        next_index = 0
+        try:
+            while next_index < len(urls):
+                index, infobox, error = results.get()
+                if error is not None:
+                    raise error
+                done[index] = infobox
+                while next_index in done:
+                    yield done.pop(next_index)
+                    next_index += 1
+        finally:
+            stopped.set()
+            for _ in range(fetch_threads):
+                # wakes up the dispatcher if it waits for a page
+                try:
+                    pages.put_nowait(None)
+                except queue.Full:
+                    break
+
+
+def get_city_infoboxes(city: dict) -> InfoBoxCity:
+    """
+    Get the English and Dutch infobox of a city, and those of the other languages in its urls.
+    :param city: the city as stored in the cities file
+    :return: the city with its infoboxes
+    """
+    return city_with_infoboxes(city, {
+        language: get_infoboxes(url) for language, url in city_urls(city).items()
+    })
+
+
+def save_infoboxes(
+        cities_path: str,
+        infoboxes_path: str,
+        fetch_threads: int = FETCH_THREADS,
+        parse_processes: int = PARSE_PROCESSES
+) -> dict[str, dict[str, float]]:
+    """
+    Fetches and parses the infoboxes of all cities with iter_infoboxes, the English and Dutch
+    infoboxes and those of the other languages in the urls of a city. With
+    one fetch thread and no parse processes the pages are fetched and parsed one by one, with more
+    fetch threads and no parse processes every thread parses the pages it downloads.
+    :return: the throughput of the fetch, the parse and the write stage
+    """
+    with open(cities_path, "r") as file:
+        cities = json.load(file)
+
+    urls = [city_urls(city) for city in cities]
+    pages = sum(len(city_pages) for city_pages in urls)
+
+    if fetch_threads == 1 and parse_processes == 0:
+        start = time.perf_counter()
+        cities = [get_city_infoboxes(city) for city in tqdm(cities, desc='Getting infoboxes')]
+        seconds = time.perf_counter() - start
+        statistics = {"fetch_and_parse": {
+            "items": pages, "seconds": seconds,
+            "items_per_second": pages / seconds if seconds > 0 else 0.0,
+        }}
+    else:
+        stage_statistics = {}
+        infoboxes = list(tqdm(
+            iter_infoboxes(
+                [url for city_pages in urls for url in city_pages.values()],
+                fetch_threads,
+                parse_processes,
+                statistics=stage_statistics,
+            ),
+            total=pages,
+            desc='Getting infoboxes',
+        ))
+        # the infoboxes are in the order of the urls, the languages of a city follow each other
+        infoboxes = iter(infoboxes)
         cities = [
-            InfoBoxCity(
-                name=city['name'],
-                uri=city['uri'],
-                url_en=city['url_en'],
-                url_nl=city['url_nl'],
-                infobox_en=None,
-                infobox_nl=None,
-            )
-            for city in json.load(file)
+            city_with_infoboxes(city, {language: next(infoboxes) for language in city_pages})
+            for city, city_pages in zip(cities, urls)
         ]
+        statistics = {name: value.to_dict() for name, value in stage_statistics.items()}
+
+    write_statistics = StageStatistics()
+    start = time.perf_counter()
+    dump_infobox_cities(cities, infoboxes_path)
+    write_statistics.add(start, time.perf_counter())
+    write_statistics.items = len(cities)
+    statistics["write"] = write_statistics.to_dict()
 
-    for city in tqdm(cities, desc='Getting infoboxes'):
-        city.infobox_en = get_infoboxes(city.url_en)
-        city.infobox_nl = get_infoboxes(city.url_nl)
+    for stage, result in statistics.items():
+        metrics.increment("pipeline_items_total", result["items"], stage=stage)
+        print(
+            f"{stage:<16} {result['items']:8d} items {result['seconds']:9.2f} s "
+            f"{result['items_per_second']:9.1f} items/s"
+            + (f", waited {result['waiting_seconds']:.2f} s" if "waiting_seconds" in result else "")
+        )
+    return statistics
 
-    with open(f"data/infoboxes_{population}.json", "w") as file:
-        json.dump(cities, file, indent=4, default=lambda x: x.to_dict())
+
+def main(argv: list[str]):
+    """
+    Retrieves the infoboxes of the cities. The pages are downloaded by fetch threads and parsed
+    by parse processes at the same time, with 0 parse processes by the fetch threads, and with
+    1 fetch thread and 0 parse processes one by one.
+    Run with: python parse_infoboxes.py [population] [fetch_threads] [parse_processes]
+    """
+    population = int(argv[1]) if len(argv) > 1 else 1_000_000
+    fetch_threads = int(argv[2]) if len(argv) > 2 else FETCH_THREADS
+    parse_processes = int(argv[3]) if len(argv) > 3 else PARSE_PROCESSES
+    save_infoboxes(
+        f"data/cities_{population}.json", f"data/infoboxes_{population}.json",
+        fetch_threads, parse_processes,
+    )
+    metrics.export("parse_infoboxes")
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv)
@@ -0,0 +1,314 @@
+"""
+Runs the pipeline from the flowchart in the README as a DAG of stages. Every stage declares its
+input and output files and the module it runs, the other modules it depends on are found through
+the imports. A stage is skipped when the hashes of its
+inputs, its code and its parameters are the same as in the previous run and its outputs have not
+changed since. Stages whose inputs are ready run concurrently.
+"""
+import ast
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from functools import cache
+from typing import Callable
+
+import metrics
+
+STATE_PATH = "data/pipeline-state.json"
+
+# every stage depends on the stage definitions below, which import the modules of all stages, so
+# the imports of this module are not followed
+COMMON_MODULES = ["pipeline.py"]
+
+
+@dataclass
+class Stage:
+    """
+    A step of the pipeline, run calls the function with the inputs and the outputs as paths.
+    modules are the modules that run imports, the modules they import are added by stage_key.
+    """
+    name: str
+    run: Callable[..., None]
+    inputs: list[str]
+    outputs: list[str]
+    modules: list[str]
+    parameters: dict = field(default_factory=dict)
+
+
+def create_stages(population: int = 250000, data_directory: str = "data") -> list[Stage]:
+    """Declares the stages of the pipeline for a population threshold"""
+
+    def path(name: str) -> str:
+        return os.path.join(data_directory, f"{name}_{population}.json")
+
+    def get_cities(cities_path: str) -> None:
+        from get_cities import save_cities, PAGE_SIZE
+        save_cities(population, cities_path, PAGE_SIZE)
+
+    def parse_infoboxes(cities_path: str, infoboxes_path: str) -> None:
+        from parse_infoboxes import save_infoboxes
+        save_infoboxes(cities_path, infoboxes_path)
+
+    def get_properties(cities_path: str, properties_per_city_path: str, all_path: str) -> None:
+        from get_properties import save_properties
+        save_properties(cities_path, properties_per_city_path, all_path)
+
+    def extract_embeddings(all_properties_path: str, embeddings_path: str) -> None:
+        from extract_embeddings import save_embeddings
+        save_embeddings(all_properties_path, embeddings_path)
+
+    def compute_threshold(embeddings_path: str, threshold_path: str) -> None:
+        from compute_threshold import save_threshold
+        save_threshold(embeddings_path, threshold_path)
+
+    def test_system(
+            embeddings_path: str, properties_per_city_path: str, evaluation_path: str
+    ) -> None:
+        from test_system import save_evaluation
+        save_evaluation(embeddings_path, properties_per_city_path, evaluation_path)
+
+    def value_alignment(infoboxes_path: str, value_alignments_path: str) -> None:
+        from value_alignment import save_value_alignments
+        save_value_alignments(infoboxes_path, value_alignments_path)
+
+    def embedding_alignment(infoboxes_path: str, embedding_alignments_path: str) -> None:
+        from embedding_alignment import save_embedding_alignments
+        save_embedding_alignments(infoboxes_path, embedding_alignments_path)
+
+    def complete_infoboxes(
+            infoboxes_path: str,
+            value_alignments_path: str,
+            embedding_alignments_path: str,
+            completed_path: str,
+            test_cities_path: str
+    ) -> None:
+        from main import save_completed_infoboxes
+        save_completed_infoboxes(
+            infoboxes_path, value_alignments_path, embedding_alignments_path, completed_path,
+            test_cities_path,
+        )
+
+    return [
+        Stage(
+            "get_cities", get_cities, [], [path("cities")], ["get_cities.py"],
+            {"population": population},
+        ),
+        Stage(
+            "parse_infoboxes", parse_infoboxes, [path("cities")], [path("infoboxes")],
+            ["parse_infoboxes.py"],
+        ),
+        Stage(
+            "get_properties", get_properties, [path("cities")],
+            [path("properties-per-city"), path("all-properties")], ["get_properties.py"],
+        ),
+        Stage(
+            "extract_embeddings", extract_embeddings, [path("all-properties")],
+            [path("all-properties-with-emb")], ["extract_embeddings.py"],
+        ),
+        Stage(
+            "compute_threshold", compute_threshold, [path("all-properties-with-emb")],
+            [path("threshold")], ["compute_threshold.py"],
+        ),
+        Stage(
+            "test_system", test_system,
+            [path("all-properties-with-emb"), path("properties-per-city")],
+            [path("test-system")], ["test_system.py"],
+        ),
+        Stage(
+            "value_alignment", value_alignment, [path("infoboxes")],
+            [path("value-alignments")], ["value_alignment.py"],
+        ),
+        Stage(
+            "embedding_alignment", embedding_alignment, [path("infoboxes")],
+            [path("embedding-alignments")], ["embedding_alignment.py"],
+        ),
+        Stage(
+            "complete_infoboxes", complete_infoboxes,
+            [path("infoboxes"), path("value-alignments"), path("embedding-alignments")],
+            [path("cities-completed"), path("test-cities")], ["main.py"],
+        ),
+    ]
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@cache
+def imported_modules(module: str, directory: str) -> frozenset[str]:
+    """
+    The modules of the repository that a module imports, also inside functions, so a stage can be
+    run again for a change in code it does not use, but is never skipped for code it does use
+    """
+    with open(os.path.join(directory, module), "r", encoding="utf-8") as file:
+        tree = ast.parse(file.read(), module)
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split(".")[0])
+
+    return frozenset(
+        f"{name}.py" for name in names if os.path.isfile(os.path.join(directory, f"{name}.py"))
+    )
+
+
+def module_dependencies(modules: list[str], directory: str) -> list[str]:
+    """The modules and everything they import from the repository, transitively"""
+    found = set()
+    pending = list(modules)
+    while pending:
+        module = pending.pop()
+        if module not in found:
+            found.add(module)
+            pending.extend(imported_modules(module, directory))
+    return sorted(found)
+
+
+def stage_key(stage: Stage) -> str:
+    """Hashes everything that determines the outputs of a stage"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    modules = sorted(set(module_dependencies(stage.modules, directory) + COMMON_MODULES))
+    key = {
+        "code": {module: hash_file(os.path.join(directory, module)) for module in modules},
+        "inputs": {path: hash_file(path) for path in stage.inputs},
+        "outputs": stage.outputs,
+        "parameters": stage.parameters,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def is_up_to_date(stage: Stage, key: str, previous: dict | None) -> bool:
+    """Whether the key and the output hashes are the same as in the previous state of the stage"""
+    if previous is None or previous["key"] != key:
+        return False
+
+    return all(
+        os.path.exists(path) and hash_file(path) == previous["outputs"].get(path, None)
+        for path in stage.outputs
+    )
+
+
+def select_stages(stages: list[Stage], targets: list[str]) -> list[Stage]:
+    """Returns the target stages and all stages they depend on, or all stages without targets"""
+    if not targets:
+        return stages
+
+    producers = {path: stage for stage in stages for path in stage.outputs}
+    by_name = {stage.name: stage for stage in stages}
+    unknown = [target for target in targets if target not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown stages {unknown}")
+
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name in selected:
+            continue
+        selected.add(name)
+        pending.extend(
+            producers[path].name for path in by_name[name].inputs if path in producers
+        )
+
+    return [stage for stage in stages if stage.name in selected]
+
+
+def run_pipeline(
+        stages: list[Stage],
+        force: bool = False,
+        max_workers: int = 4,
+        state_path: str = STATE_PATH
+) -> dict[str, str]:
+    """
+    Runs the stages in dependency order, independent stages run concurrently.
+    :param stages: the stages to run
+    :param force: run every stage, even if it is up to date
+    :param max_workers: the maximum number of stages that run at the same time
+    :param state_path: the file with the hashes of the previous runs
+    :return: for every stage whether it was "run" or "skipped"
+    """
+    try:
+        with open(state_path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        state = {}
+
+    producers = {path: stage.name for stage in stages for path in stage.outputs}
+    dependencies = {
+        stage.name: {producers[path] for path in stage.inputs if path in producers}
+        for stage in stages
+    }
+    for stage in stages:
+        for path in stage.inputs:
+            if path not in producers and not os.path.exists(path):
+                raise FileNotFoundError(f"Input {path} of stage {stage.name} does not exist")
+
+    def execute(stage: Stage, previous: dict | None) -> tuple[str, dict | None]:
+        """Runs a stage in a worker, the new state of the stage is stored by the main thread"""
+        key = stage_key(stage)
+        if not force and is_up_to_date(stage, key, previous):
+            print(f"Skipping {stage.name}, it is up to date")
+            return "skipped", None
+
+        print(f"Running {stage.name}")
+        with metrics.stage("pipeline_stage", stage=stage.name):
+            stage.run(*stage.inputs, *stage.outputs)
+        return "run", {
+            "key": key,
+            "outputs": {path: hash_file(path) for path in stage.outputs},
+        }
+
+    results = {}
+    running = {}
+    by_name = {stage.name: stage for stage in stages}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(results) < len(stages):
+            for name, stage_dependencies in dependencies.items():
+                if name not in results and name not in running.values() \
+                        and stage_dependencies <= results.keys():
+                    running[executor.submit(execute, by_name[name], state.get(name, None))] = name
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name], stage_state = future.result()
+                    if stage_state is not None:
+                        state[name] = stage_state
+                finally:
+                    # save the progress, so finished stages are skipped after a failure
+                    with open(state_path, "w", encoding="utf-8") as file:
+                        json.dump(state, file, indent=4)
+
+    return results
+
+
+def main(argv: list[str]):
+    """
+    Runs the pipeline, or only the given stages and the stages they depend on.
+    Run with: python pipeline.py [population] [stage ...] [--force]
+    """
+    force = "--force" in argv
+    argv = [arg for arg in argv if arg != "--force"]
+    population = int(argv[1]) if len(argv) > 1 else 250000
+
+    stages = select_stages(create_stages(population), argv[2:])
+    results = run_pipeline(stages, force)
+
+    for name, result in results.items():
+        print(f"{name}: {result}")
+    metrics.export("pipeline")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -5,9 +5,10 @@ different language.
 """
 import sys
 import numpy as np
-from transformers import pipeline
 import torch
-from transformers import AutoTokenizer, AutoModel
+from transformers import AutoTokenizer
+
+from inference_backend import load_model
 
 
 def compute_similarity(
@@ -16,15 +17,17 @@ def compute_similarity(
     model_id: str = 'xlm-roberta-base',
     layer: int = -1,
     cosine_similarity: bool = False,
+    backend: str = "fp32",
 ) -> float:
     """Extracts word embeddings from an LLM (default xlm-roberta-base)
     at a given layer and returns their euclidean distance. If cosine_similarity
-    is True, returns their cosine similarity.
+    is True, returns their cosine similarity. With backend "int8" the model
+    runs with dynamically quantized weights.
     """
 
     # Load the model and tokenizer
     tokenizer = AutoTokenizer.from_pretrained(model_id)
-    model = AutoModel.from_pretrained(model_id)
+    model = load_model(model_id, backend)
 
     # Tokenize the input strings
     inputs1 = tokenizer(token1, return_tensors='pt')
@@ -47,12 +50,21 @@ def compute_similarity(
 
 
 def main(argv: list[str]):
-    """Provide two strings as arguments to compute their similarity."""
+    """Provide two strings as arguments to compute their similarity. Add --server to use a
+    running encoder_server.py instead of loading the model, or --int8 to use the quantized model.
+    """
+    use_server = "--server" in argv
+    backend = "int8" if "--int8" in argv else "fp32"
+    argv = [arg for arg in argv if arg not in ("--server", "--int8")]
     word1 = argv[1]
     word2 = argv[2]
     layer = int(argv[3]) if len(argv) == 4 else -1
 
-    similarity = compute_similarity(word1, word2, layer=layer)
+    if use_server:
+        from encoder_server import request_similarities
+        similarity = request_similarities([(word1, word2)], layer=layer)[0]
+    else:
+        similarity = compute_similarity(word1, word2, layer=layer, backend=backend)
 
     print(
         f'The euclidean distance between \'{word1}\' and \'{word2}\' is'
@@ -0,0 +1,217 @@
+"""
+Fast, hand-written (de)serialization for InfoBoxCity and Alignment. The dataclasses_json
+from_dict/to_dict methods inspect the type hints of every field for every object, which is slow
+when loading thousands of cities. The converters below do the same work with plain dict access.
+The on-disk format is the same as the one written by to_dict, fields that the dataclass does not
+know are kept. If orjson is installed it is used to load the files, they are always written with
+the standard json module, so that the files are the same with and without orjson.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import metrics
+from util import Alignment, InfoBoxCity
+
+
+def alignment_from_dict(data: dict) -> Alignment:
+    return Alignment(
+        data["original_property"],
+        data["property_"],
+        data["values"],
+        data.get("correct", False),
+    )
+
+
+def alignment_to_dict(alignment: Alignment) -> dict:
+    return {
+        "original_property": alignment.original_property,
+        "property_": alignment.property_,
+        "values": alignment.values,
+        "correct": alignment.correct,
+    }
+
+
+def alignments_from_data(
+        data: list[dict] | dict[str, list[str]] | None, infobox_en: dict[str, list[str]]
+) -> list[Alignment] | None:
+    """
+    Converts the alignments of a city to Alignment objects. Older output files store the
+    alignments as a mapping from the Dutch property to the values, in that case the original
+    English property is looked up by its values in the English infobox.
+    :param data: the alignments as stored in the json file
+    :param infobox_en: the English infobox of the city
+    :return: the list of alignments, or None if the city has no alignments
+    """
+    if data is None:
+        return None
+
+    if isinstance(data, dict):
+        original_properties = {tuple(value): key for key, value in infobox_en.items()}
+        return [
+            Alignment(original_properties.get(tuple(values), ""), property_, values)
+            for property_, values in data.items()
+        ]
+
+    return [alignment_from_dict(alignment) for alignment in data]
+
+
+# the fields of the json representation of InfoBoxCity
+INFOBOX_CITY_FIELDS = {
+    "name", "uri", "url_en", "url_nl", "infobox_en", "infobox_nl",
+    "value_alignment_completed_infobox", "embedding_alignment_completed_infobox", "urls",
+    "infoboxes",
+}
+
+
+def infobox_city_from_dict(data: dict) -> InfoBoxCity:
+    infobox_en = data["infobox_en"]
+    other_fields = {key: value for key, value in data.items() if key not in INFOBOX_CITY_FIELDS}
+    return InfoBoxCity(
+        data["name"],
+        data["uri"],
+        data["url_en"],
+        data["url_nl"],
+        infobox_en,
+        data["infobox_nl"],
+        alignments_from_data(data.get("value_alignment_completed_infobox"), infobox_en),
+        alignments_from_data(data.get("embedding_alignment_completed_infobox"), infobox_en),
+        data.get("urls"),
+        data.get("infoboxes"),
+        other_fields or None,
+    )
+
+
+def infobox_city_to_dict(city: InfoBoxCity) -> dict:
+    value_alignments = city.value_alignment_completed_infobox
+    embedding_alignments = city.embedding_alignment_completed_infobox
+    data = {
+        "name": city.name,
+        "uri": city.uri,
+        "url_en": city.url_en,
+        "url_nl": city.url_nl,
+        "infobox_en": city.infobox_en,
+        "infobox_nl": city.infobox_nl,
+        "value_alignment_completed_infobox": None if value_alignments is None else [
+            alignment_to_dict(alignment) for alignment in value_alignments
+        ],
+        "embedding_alignment_completed_infobox": None if embedding_alignments is None else [
+            alignment_to_dict(alignment) for alignment in embedding_alignments
+        ],
+    }
+    # only cities with more languages than English and Dutch have these fields
+    if city.urls is not None:
+        data["urls"] = city.urls
+    if city.infoboxes is not None:
+        data["infoboxes"] = city.infoboxes
+    if city.other_fields:
+        data.update(city.other_fields)
+    return data
+
+
+@metrics.timed("json_load")
+def load_json(path: str):
+    metrics.increment("json_bytes_total", os.path.getsize(path), direction="load")
+    if orjson is not None:
+        with open(path, "rb") as file:
+            return orjson.loads(file.read())
+
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+@metrics.timed("json_dump")
+def dump_json(data, path: str, indent: bool = True) -> None:
+    """
+    Writes data to a json file with the standard json module: an indentation of four spaces and
+    escaped non-ASCII characters like the rest of the repository. orjson can only indent with two
+    spaces and does not escape, so it would write different files depending on whether it is
+    installed.
+    """
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=4 if indent else None)
+
+    metrics.increment("json_bytes_total", os.path.getsize(path), direction="dump")
+
+
+def load_infobox_cities(path: str) -> list[InfoBoxCity]:
+    return [infobox_city_from_dict(city) for city in load_json(path)]
+
+
+def dump_infobox_cities(cities: list[InfoBoxCity], path: str, indent: bool = True) -> None:
+    dump_json([infobox_city_to_dict(city) for city in cities], path, indent)
+
+
+def time_call(function, repeat: int) -> float:
+    """Returns the best wall clock time of repeat calls of function"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv: list[str]):
+    """
+    Micro-benchmark of the load and dump throughput of the dataclasses_json path and the fast path.
+    The load and dump rows time the files on disk with load_infobox_cities and dump_infobox_cities.
+    Run with: python serialization.py [data/cities-completed_250000.json] [repeat]
+    """
+    path = argv[1] if len(argv) > 1 else "data/cities-completed_250000.json"
+    repeat = int(argv[2]) if len(argv) > 2 else 5
+
+    # normalise older output files first, so that both paths decode the same data
+    cities = load_infobox_cities(path)
+    data = [infobox_city_to_dict(city) for city in cities]
+
+    with tempfile.TemporaryDirectory() as directory:
+        normalised_path = os.path.join(directory, "cities.json")
+        output_path = os.path.join(directory, "output.json")
+        dump_json(data, normalised_path)
+
+        def load_dataclasses_json() -> list[InfoBoxCity]:
+            with open(normalised_path, "r", encoding="utf-8") as file:
+                return [InfoBoxCity.from_dict(city) for city in json.load(file)]
+
+        def dump_dataclasses_json() -> None:
+            with open(output_path, "w", encoding="utf-8") as file:
+                json.dump([city.to_dict() for city in cities], file, indent=4)
+
+        results = {
+            "decode dataclasses_json": time_call(
+                lambda: [InfoBoxCity.from_dict(city) for city in data], repeat
+            ),
+            "decode fast": time_call(
+                lambda: [infobox_city_from_dict(city) for city in data], repeat
+            ),
+            "encode dataclasses_json": time_call(
+                lambda: [city.to_dict() for city in cities], repeat
+            ),
+            "encode fast": time_call(
+                lambda: [infobox_city_to_dict(city) for city in cities], repeat
+            ),
+            "load json + dataclasses_json": time_call(load_dataclasses_json, repeat),
+            f"load {'orjson' if orjson is not None else 'json'} + fast": time_call(
+                lambda: load_infobox_cities(normalised_path), repeat
+            ),
+            "dump json + dataclasses_json": time_call(dump_dataclasses_json, repeat),
+            "dump json + fast": time_call(
+                lambda: dump_infobox_cities(cities, output_path), repeat
+            ),
+        }
+
+    print(f"{len(cities)} cities from {path}, best of {repeat}")
+    for name, seconds in results.items():
+        print(f"{name:<32} {seconds * 1000:8.2f} ms {len(cities) / seconds:12.0f} cities/s")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
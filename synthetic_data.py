@@ -0,0 +1,173 @@
+"""
+Generates synthetic infoboxes, infobox html, similarity mappings and a tiny model for benchmarks
+and tests.
+"""
+import random
+
+from config import RANDOM_SEED
+from util import InfoBoxCity
+
+
+def generate_cities(
+        number_of_cities: int,
+        keys_per_infobox: int = 20,
+        value_overlap: float = 0.5,
+        number_of_keys: int = 200,
+        seed: int = RANDOM_SEED,
+        other_languages: list[str] = (),
+        reformat: float = 0.0,
+) -> list[InfoBoxCity]:
+    """
+    Generates cities with an English and a Dutch infobox. English key i corresponds to Dutch key
+    i, and for a fraction value_overlap of the shared keys both infoboxes have the same value.
+    The infoboxes of the other languages are generated like the Dutch infobox. A fraction reformat
+    of the shared values is written with Dutch thousands separators, 1.234 instead of 1,234.
+    :param number_of_cities: the number of cities to generate
+    :param keys_per_infobox: the number of keys in each infobox
+    :param value_overlap: the fraction of shared keys that have the same value in both languages
+    :param number_of_keys: the number of distinct keys per language
+    :param seed: the random seed
+    :param other_languages: the codes of the languages besides English and Dutch
+    :param reformat: the fraction of the shared values that is formatted differently
+    :return: the generated cities
+    """
+    generator = random.Random(seed)
+    keys_per_infobox = min(keys_per_infobox, number_of_keys)
+
+    cities = []
+    for index in range(number_of_cities):
+        key_ids_en = generator.sample(range(number_of_keys), keys_per_infobox)
+        key_ids_nl = generator.sample(range(number_of_keys), keys_per_infobox)
+
+        infobox_en = {
+            f"Property {key_id}": [f"{generator.randrange(10 ** 6):,}"] for key_id in key_ids_en
+        }
+
+        def generate_infobox(
+                key_ids: list[int], key_name: str, value_name: str
+        ) -> dict[str, list[str]]:
+            infobox = {}
+            for key_id in key_ids:
+                value = infobox_en.get(f"Property {key_id}", None)
+                if value is None or generator.random() >= value_overlap:
+                    value = [f"{value_name} {generator.randrange(10 ** 6)}"]
+                elif reformat > 0 and generator.random() < reformat:
+                    value = [item.replace(",", ".") for item in value]
+                infobox[f"{key_name} {key_id}"] = list(value)
+            return infobox
+
+        infobox_nl = generate_infobox(key_ids_nl, "Eigenschap", "waarde")
+        infoboxes = {
+            language: generate_infobox(
+                generator.sample(range(number_of_keys), keys_per_infobox),
+                f"{language} property",
+                f"{language} value",
+            )
+            for language in other_languages
+        }
+
+        cities.append(InfoBoxCity(
+            name=f"City {index}",
+            uri=f"http://www.wikidata.org/entity/Q{index}",
+            url_en=f"https://en.wikipedia.org/wiki/City_{index}",
+            url_nl=f"https://nl.wikipedia.org/wiki/Stad_{index}",
+            infobox_en=infobox_en,
+            infobox_nl=infobox_nl,
+            urls={
+                language: f"https://{language}.wikipedia.org/wiki/City_{index}"
+                for language in other_languages
+            } if other_languages else None,
+            infoboxes=infoboxes if other_languages else None,
+        ))
+
+    return cities
+
+
+def generate_infobox_html(infobox: dict[str, list[str]]) -> str:
+    """Generates a wikipedia page with the infobox as html table, with references and noise"""
+    rows = "".join(
+        f"<tr><th scope=\"row\">{key}\xa0</th><td>" + "\n".join(values)
+        + "[1]<span>\u200b</span></td></tr>"
+        for key, values in infobox.items()
+    )
+    return (
+        "<html><body><div id=\"content\">"
+        f"<table class=\"infobox\"><tbody><tr><th colspan=\"2\">Title</th></tr>{rows}</tbody>"
+        "</table><p>Some text of the article.</p></div></body></html>"
+    )
+
+
+def generate_infobox_wikitext(
+        infobox: dict[str, list[str]], template: str = "Infobox settlement"
+) -> str:
+    """Generates the wikitext of an article with the infobox as template, with markup and noise"""
+    parameters = "".join(
+        f"\n| {key} = [[Link|{values[0]}]]"
+        + "".join("<br />{{nowrap|" + value + "}}" for value in values[1:])
+        + "<ref>{{cite web|url=https://example.org|title=Source}}</ref><!-- comment -->"
+        for key, values in infobox.items()
+    )
+    return (
+        "{{Short description|City}}\n"
+        f"{{{{{template}{parameters}\n| image_skyline = [[File:Skyline.jpg|250px|thumb]]\n}}}}\n"
+        "'''City''' is a city. {{Citation needed|date=May 2024}}"
+    )
+
+
+def generate_similarity_mapping(
+        number_of_properties: int, seed: int = RANDOM_SEED
+) -> dict[str, dict[str, float]]:
+    """
+    Generates a similarity mapping in the format of compute_threshold.create_similarity_mapping,
+    where the distance between a property and itself tends to be smaller than to the others.
+    """
+    generator = random.Random(seed)
+    ids = [f"http://www.wikidata.org/entity/P{index}" for index in range(number_of_properties)]
+
+    return {
+        property_id1: {
+            property_id2: generator.uniform(0.0, 0.8) if property_id1 == property_id2
+            else generator.uniform(0.3, 1.5)
+            for property_id2 in ids
+        }
+        for property_id1 in ids
+    }
+
+
+def create_tiny_model(path: str, seed: int = RANDOM_SEED) -> str:
+    """
+    Saves a tiny, randomly initialised XLM-RoBERTa model with a small word piece tokenizer, so the
+    embedding stages can be benchmarked and tested without downloading the real model.
+    :return: the path of the model
+    """
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors, trainers
+    from transformers import PreTrainedTokenizerFast, XLMRobertaConfig, XLMRobertaModel
+
+    tokenizer = Tokenizer(models.WordPiece(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.train_from_iterator(
+        ["Property Eigenschap 0 1 2 3 4 5 6 7 8 9 population bevolking country land"],
+        trainers.WordPieceTrainer(
+            vocab_size=100, special_tokens=["<s>", "<pad>", "</s>", "<unk>"]
+        ),
+    )
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>",
+        pair="<s> $A </s> </s> $B </s>",
+        special_tokens=[("<s>", 0), ("</s>", 2)],
+    )
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", pad_token="<pad>",
+        unk_token="<unk>", cls_token="<s>", sep_token="</s>",
+    )
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = XLMRobertaConfig(
+        vocab_size=len(tokenizer), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=64, pad_token_id=tokenizer.pad_token_id,
+    )
+    XLMRobertaModel(config).save_pretrained(path)
+
+    return path
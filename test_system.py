@@ -1,7 +1,9 @@
 import json
+import numpy as np
+from scipy.spatial.distance import cdist
 from tqdm import tqdm
 from util import CityProperty
-from compute_threshold import create_similarity_mapping
+import metrics
 
 SimilarityMapping = dict[str, dict[str, float]]
 
@@ -62,6 +64,117 @@ def test_all_properties(similarity_mapping: SimilarityMapping) -> dict[int, int]
     return positions
 
 
+def distance_matrix(properties: dict[str, dict]) -> tuple[list[str], np.ndarray]:
+    """Computes the same distances as create_similarity_mapping as a matrix, where row i is the
+    Dutch embedding and column j the English embedding of property ids[i] and ids[j]
+    """
+    ids = list(properties)
+    embeddings_nl = np.array([properties[property_id]["emb_nl"] for property_id in ids])
+    embeddings_en = np.array([properties[property_id]["emb_en"] for property_id in ids])
+
+    return ids, cdist(embeddings_nl, embeddings_en)
+
+
+def mapping_to_matrix(similarity_mapping: SimilarityMapping) -> tuple[list[str], np.ndarray]:
+    """Converts a similarity mapping to a matrix with the rows and columns in the same order"""
+    ids = list(similarity_mapping)
+    matrix = np.array([
+        [similarity_mapping[property_id1][property_id2] for property_id2 in ids]
+        for property_id1 in ids
+    ])
+    return ids, matrix
+
+
+def compute_ranks(matrix: np.ndarray, indices: np.ndarray = None) -> np.ndarray:
+    """Computes the position of the correct property in every row of the matrix, restricted to
+    the rows and columns in indices. Gives the same positions as test_all_properties: a property
+    is ranked behind all smaller distances, and behind equal distances that come before it.
+    """
+    if indices is not None:
+        matrix = matrix[np.ix_(indices, indices)]
+
+    correct = matrix.diagonal()[:, np.newaxis]
+    smaller = (matrix < correct).sum(axis=1)
+    equal_before = np.tril(matrix == correct, k=-1).sum(axis=1)
+
+    return smaller + equal_before + 1
+
+
+def compute_ranks_per_city(
+    prop_per_city: dict[str, dict[str, CityProperty]],
+    ids: list[str],
+    matrix: np.ndarray,
+) -> np.ndarray:
+    """Computes the ranks of the properties of every city among the properties of that city"""
+    index = {property_id: idx for idx, property_id in enumerate(ids)}
+
+    ranks = [
+        compute_ranks(matrix, np.array([index[property_id] for property_id in city], dtype=int))
+        for city in prop_per_city.values()
+    ]
+
+    return np.concatenate(ranks) if ranks else np.array([], dtype=int)
+
+
+def positions_histogram(ranks: np.ndarray, size: int) -> dict[int, int]:
+    """Counts the ranks in the same format as test_all_properties"""
+    counts = np.bincount(ranks, minlength=size + 1)
+    return {position: int(counts[position]) for position in range(1, size + 1)}
+
+
+def ranking_metrics(ranks: np.ndarray, ks: tuple[int, ...] = (1, 3, 5, 10)) -> dict[str, float]:
+    """Computes the mean reciprocal rank and hits@k of the ranks"""
+    results = {"mrr": float(np.mean(1 / ranks))}
+    for k in ks:
+        results[f"hits@{k}"] = float(np.mean(ranks <= k))
+    return results
+
+
+def to_percent(positions: dict[int, int]) -> dict[int, float]:
+    return {
+        position: round(count / sum(positions.values()) * 100, 1)
+        for position, count in positions.items()
+    }
+
+
+def evaluate(
+    ids: list[str],
+    matrix: np.ndarray,
+    properties_per_city: dict[str, dict[str, CityProperty]],
+) -> dict[str, dict]:
+    """Ranks all properties, and the properties per city, and returns the position percentages
+    and the ranking metrics of both
+    """
+    with metrics.stage("compute_ranks", scope="all"):
+        ranks = compute_ranks(matrix)
+    with metrics.stage("compute_ranks", scope="per_city"):
+        ranks_city = compute_ranks_per_city(properties_per_city, ids, matrix)
+
+    return {
+        "all": {
+            "positions": to_percent(positions_histogram(ranks, len(ids))),
+            "metrics": ranking_metrics(ranks),
+        },
+        "per_city": {
+            "positions": to_percent(positions_histogram(ranks_city, len(ids))),
+            "metrics": ranking_metrics(ranks_city),
+        },
+    }
+
+
+def save_evaluation(
+    embeddings_path: str, properties_per_city_path: str, evaluation_path: str
+) -> None:
+    """Evaluates the embeddings in embeddings_path and writes the results to evaluation_path"""
+    with open(embeddings_path, "r", encoding="utf-8") as inp:
+        ids, matrix = distance_matrix(json.load(inp))
+    with open(properties_per_city_path, "r", encoding="utf-8") as inp:
+        properties_per_city = json.load(inp)
+
+    with open(evaluation_path, "w", encoding="utf-8") as out:
+        json.dump(evaluate(ids, matrix, properties_per_city), out, indent=4)
+
+
 def main():
     """Tests the extracted word embeddings extracted from all-properties.json"""
 
@@ -72,26 +185,22 @@ def main():
 
     try:
         with open("./data/similarity-mappings.json", "r", encoding="utf-8") as inp:
-            similarity_mapping = json.load(inp)
+            ids, matrix = mapping_to_matrix(json.load(inp))
     except FileNotFoundError:
-        similarity_mapping = create_similarity_mapping(all_properties)
-        with open("./data/similarity-mappings.json", "w", encoding="utf-8") as out:
-            json.dump(similarity_mapping, out)
+        ids, matrix = distance_matrix(all_properties)
 
-    positions = test_all_properties(similarity_mapping)
-    positions_percent = {
-        position: round(count / sum(positions.values()) * 100, 1)
-        for position, count in positions.items()
-    }
-    positions_city_percent = test_per_city(properties_per_city, similarity_mapping)
+    results = evaluate(ids, matrix, properties_per_city)
 
     print("These are the positions of all the similarities:")
-    print(positions_percent)
+    print(results["all"]["positions"])
+    print(results["all"]["metrics"])
 
     print("---" * 20)
 
-    print("These are the positions of all the similarities:")
-    print(positions_city_percent)
+    print("These are the positions of the similarities per city:")
+    print(results["per_city"]["positions"])
+    print(results["per_city"]["metrics"])
+    metrics.export("test_system")
 
 
 if __name__ == "__main__":
@@ -1,34 +1,21 @@
-import json
-import pprint
-
-from util import InfoBoxCity
+from database import (
+    connect, sync_annotations, precision_per_method, ANNOTATORS, VALUE_ALIGNMENT,
+    EMBEDDING_ALIGNMENT
+)
 
 
 def main():
-    names = ["Rina", "Sijbren", "Bjorn", "Oscar"]
-    verified_cities = []
-    for name in names:
-        with open(f"data/test-cities_{name}.json", "r") as file:
-            cities = [InfoBoxCity.from_dict(city) for city in json.load(file)]
-            verified_cities.extend(cities)
-
-    total_value_alignment = 0
-    correct_value_alignment = 0
-
-    total_embedding_alignment = 0
-    correct_embedding_alignment = 0
-
-    for city in verified_cities:
-        total_value_alignment += len(city.value_alignment_completed_infobox)
-        total_embedding_alignment += len(city.embedding_alignment_completed_infobox)
+    connection = connect()
 
-        for alignment in city.value_alignment_completed_infobox:
-            if alignment.correct:
-                correct_value_alignment += 1
+    # only the annotation files that were edited since the last run are imported again
+    for name in ANNOTATORS:
+        sync_annotations(connection, name, f"data/test-cities_{name}.json")
 
-        for alignment in city.embedding_alignment_completed_infobox:
-            if alignment.correct:
-                correct_embedding_alignment += 1
+    results = precision_per_method(connection)
+    correct_value_alignment, total_value_alignment = results.get(VALUE_ALIGNMENT, (0, 0))
+    correct_embedding_alignment, total_embedding_alignment = results.get(
+        EMBEDDING_ALIGNMENT, (0, 0)
+    )
 
     print(f"Value alignment: {correct_value_alignment}/{total_value_alignment}")
     print(f"Embedding alignment: {correct_embedding_alignment}/{total_embedding_alignment}")
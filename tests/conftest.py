@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# the modules are scripts in the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def tiny_model(tmp_path_factory) -> str:
+    """The tiny randomly initialised model of synthetic_data, saved to a directory"""
+    pytest.importorskip("transformers")
+    from synthetic_data import create_tiny_model
+
+    return create_tiny_model(str(tmp_path_factory.mktemp("tiny-model")))
@@ -0,0 +1,109 @@
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from completion_service import CompletionService, KeyEncoder, create_handler
+from util import InfoBoxCity
+
+URI = "http://www.wikidata.org/entity/Q1"
+
+
+@pytest.fixture(scope="module")
+def port():
+    cities = [InfoBoxCity(
+        "Utrecht", URI, "", "",
+        {"population": ["361,924"], "area": ["99.21 km2"], "mayor": ["Sharon Dijksma"]},
+        {"burgemeester": ["Sharon Dijksma"]},
+    )]
+    service = CompletionService(
+        cities, {"population": "inwoners", "mayor": "burgemeester"}, {"area": "oppervlakte"}
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), create_handler(service))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_port
+    server.shutdown()
+    thread.join()
+
+
+def request(port: int, method: str, path: str, body=None) -> tuple[int, dict]:
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode("utf-8")
+    connection.request(method, path, body=body)
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+def completions(response: dict) -> tuple[list, list]:
+    return tuple(
+        [(alignment["original_property"], alignment["property_"]) for alignment in response[key]]
+        for key in ["value_alignment_completed_infobox", "embedding_alignment_completed_infobox"]
+    )
+
+
+def test_get_cached_city(port):
+    status, response = request(port, "GET", f"/complete?uri={URI}")
+
+    assert status == 200
+    assert completions(response) == ([("population", "inwoners")], [("area", "oppervlakte")])
+    assert response["value_alignment_completed_infobox"][0]["values"] == ["361,924"]
+
+
+@pytest.mark.parametrize("path", ["/complete?uri=http://www.wikidata.org/entity/Q2", "/complete"])
+def test_get_unknown_city(port, path):
+    status, response = request(port, "GET", path)
+
+    assert status == 404
+    assert "Unknown city" in response["error"]
+
+
+def test_post_infobox_pair(port):
+    status, response = request(port, "POST", "/complete", {
+        "infobox_en": {"population": ["1"], "area": ["2"]},
+        "infobox_nl": {"inwoners": ["3"]},
+    })
+
+    assert status == 200
+    assert completions(response) == ([], [("area", "oppervlakte")])
+
+
+@pytest.mark.parametrize("body, message", [
+    (b"{", "Expecting property name"),
+    ([1, 2], "the body must be an object, not list"),
+    ({"infobox_en": {}}, "the body has no infobox_nl"),
+    ({"infobox_en": [], "infobox_nl": {}}, "infobox_en must be an object, not list"),
+    ({"infobox_en": {"area": "2"}, "infobox_nl": {}}, "infobox_en['area'] must be a list"),
+    ({"infobox_en": {}, "infobox_nl": {"oppervlakte": [2]}}, "must be a list of strings"),
+    ({"uri": ["a"]}, "uri must be a string"),
+])
+def test_post_malformed_body(port, body, message):
+    status, response = request(port, "POST", "/complete", body)
+
+    assert status == 400
+    assert response["error"].startswith("Invalid request: ")
+    assert message in response["error"]
+
+
+def test_key_encoder_encodes_every_property_once():
+    encoded = []
+
+    def pipe(text: str) -> list:
+        encoded.append(text)
+        time.sleep(0.01)
+        return [[[float(len(text)), 0.0]]]
+
+    encoder = KeyEncoder({"inwoners", "oppervlakte"}, pipe)
+    encoded.clear()
+    with ThreadPoolExecutor(8) as executor:
+        alignments = list(executor.map(encoder.align, ["population"] * 16))
+
+    assert encoded == ["population"]
+    assert len(set(alignments)) == 1
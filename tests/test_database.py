@@ -0,0 +1,44 @@
+import json
+
+from database import (
+    connect, precision_per_method, sync_annotations, VALUE_ALIGNMENT, EMBEDDING_ALIGNMENT
+)
+from serialization import dump_infobox_cities
+from synthetic_data import generate_cities
+from util import Alignment
+
+
+def annotated_cities() -> list:
+    cities = generate_cities(2)
+    for city in cities:
+        city.value_alignment_completed_infobox = [
+            Alignment("Area", "Oppervlakte", ["1 km²"], True),
+            Alignment("Mayor", "Burgemeester", ["Jan"], False),
+        ]
+        city.embedding_alignment_completed_infobox = [
+            Alignment("Founded", "Gesticht", ["1200"], True),
+        ]
+    return cities
+
+
+def test_sync_annotations_follows_edits(tmp_path):
+    connection = connect(str(tmp_path / "infoboxes.db"))
+    path = tmp_path / "test-cities_Rina.json"
+    dump_infobox_cities(annotated_cities(), str(path))
+
+    assert sync_annotations(connection, "Rina", str(path))
+    assert precision_per_method(connection) == {
+        VALUE_ALIGNMENT: (2, 4), EMBEDDING_ALIGNMENT: (2, 2)
+    }
+    assert not sync_annotations(connection, "Rina", str(path))
+
+    # relabel one alignment and drop the embedding alignments of the second city
+    cities = json.loads(path.read_text(encoding="utf-8"))
+    cities[0]["value_alignment_completed_infobox"][1]["correct"] = True
+    cities[1]["embedding_alignment_completed_infobox"] = []
+    path.write_text(json.dumps(cities), encoding="utf-8")
+
+    assert sync_annotations(connection, "Rina", str(path))
+    assert precision_per_method(connection) == {
+        VALUE_ALIGNMENT: (3, 4), EMBEDDING_ALIGNMENT: (1, 1)
+    }
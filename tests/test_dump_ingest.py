@@ -0,0 +1,77 @@
+import bz2
+import tracemalloc
+
+from dump_ingest import parse_entity, read_xml_pages
+
+NAMESPACE = "http://www.mediawiki.org/xml/export-0.10/"
+
+
+def write_xml_dump(path, pages: int) -> None:
+    with bz2.open(path, "wt", encoding="utf-8") as file:
+        file.write(f'<mediawiki xmlns="{NAMESPACE}"><siteinfo><sitename>Wikipedia</sitename>'
+                   "</siteinfo>\n")
+        for index in range(pages):
+            file.write(
+                f"<page><title>Page {index}</title><ns>0</ns><revision><text>"
+                f"{{{{Infobox settlement | population_total = {index} }}}} {'text ' * 100}"
+                "</text></revision></page>\n"
+            )
+        file.write("</mediawiki>\n")
+
+
+def peak_memory(path, titles: set[str]) -> tuple[int, list]:
+    tracemalloc.start()
+    try:
+        pages = [title for title, _ in read_xml_pages(str(path), titles)]
+        return tracemalloc.get_traced_memory()[1], pages
+    finally:
+        tracemalloc.stop()
+
+
+def test_read_xml_pages_yields_the_wanted_pages(tmp_path):
+    write_xml_dump(tmp_path / "pages.xml.bz2", 100)
+
+    pages = list(read_xml_pages(str(tmp_path / "pages.xml.bz2"), {"Page 3", "Page 70", "Other"}))
+
+    assert [title for title, _ in pages] == ["Page 3", "Page 70"]
+    assert pages[1][1].startswith("{{Infobox settlement | population_total = 70 }}")
+
+
+def test_read_xml_pages_memory_does_not_grow_with_the_dump(tmp_path):
+    write_xml_dump(tmp_path / "small.xml.bz2", 2_000)
+    write_xml_dump(tmp_path / "large.xml.bz2", 20_000)
+
+    small, _ = peak_memory(tmp_path / "small.xml.bz2", {"Page 1"})
+    large, pages = peak_memory(tmp_path / "large.xml.bz2", {"Page 1", "Page 19999"})
+
+    assert pages == ["Page 1", "Page 19999"]
+    assert large < 2 * small
+
+
+def test_parse_entity_keeps_the_articles_of_other_languages():
+    entity = {
+        "type": "item",
+        "id": "Q803",
+        "labels": {"en": {"value": "Utrecht"}},
+        "sitelinks": {
+            "enwiki": {"title": "Utrecht"},
+            "nlwiki": {"title": "Utrecht (stad)"},
+            "dewiki": {"title": "Utrecht"},
+            "plwiki": {"title": "Utrecht"},
+        },
+        "claims": {
+            "P31": [{"rank": "normal", "mainsnak": {
+                "snaktype": "value", "datavalue": {"value": {"id": "Q515"}}
+            }}],
+            "P1082": [{"rank": "normal", "mainsnak": {
+                "snaktype": "value", "datavalue": {"value": {"amount": "+361924"}}
+            }}],
+        },
+    }
+
+    _, city, property_ids = parse_entity(entity, 100_000, ["de", "fr"])
+
+    assert city["url_nl"] == "https://nl.wikipedia.org/wiki/Utrecht_(stad)"
+    assert city["urls"] == {"de": "https://de.wikipedia.org/wiki/Utrecht"}
+    assert "urls" not in parse_entity(entity, 100_000)[1]
+    assert parse_entity(entity, 1_000_000, ["de"]) is None
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import cdist
+
+pytest.importorskip("torch")
+import embedding_alignment  # noqa: E402
+from embedding_alignment import align_languages, encode_properties  # noqa: E402
+from inference_backend import FeatureExtractor  # noqa: E402
+from infobox_store import InfoBoxStore  # noqa: E402
+from synthetic_data import generate_cities  # noqa: E402
+from util import EmbeddingComparisonMode, Language  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def extractor(tiny_model):
+    return FeatureExtractor(tiny_model, "fp32")
+
+
+def test_languages_are_aligned_like_language_pairs(extractor, monkeypatch):
+    cities = generate_cities(10, keys_per_infobox=4, number_of_keys=12, other_languages=["de"])
+    store = InfoBoxStore.from_cities(cities)
+    source = sorted(store.unique_properties(Language.EN))
+    embeddings = {
+        language: encode_properties(sorted(store.unique_properties(language)), extractor)
+        for language in [Language.NL, Language.DE]
+    }
+    # a threshold that some of the closest properties are within, and some are not
+    distances = {
+        language: cdist(encode_properties(source, extractor), target_embeddings)
+        for language, target_embeddings in embeddings.items()
+    }
+    threshold = float(np.median(np.concatenate([
+        language_distances.min(axis=1) for language_distances in distances.values()
+    ])))
+    monkeypatch.setattr(embedding_alignment, "EUCLIDEAN_THRESHOLD", threshold)
+
+    alignments = align_languages(
+        store, EmbeddingComparisonMode.EUCLIDEAN, Language.EN, [Language.NL, Language.DE],
+        extractor, batch_size=5,
+    )
+
+    aligned = 0
+    for language, language_distances in distances.items():
+        targets = sorted(store.unique_properties(language))
+        expected = {
+            property_: targets[best]
+            for property_, best, distance in zip(
+                source, language_distances.argmin(axis=1), language_distances.min(axis=1)
+            )
+            if distance < threshold
+        }
+        aligned += len(expected)
+        assert alignments[language] == expected
+        assert align_languages(
+            store, EmbeddingComparisonMode.EUCLIDEAN, Language.EN, [language], extractor
+        )[language] == expected
+    assert 0 < aligned < 2 * len(source)
+
+
+def test_languages_without_properties_have_no_alignments(extractor):
+    cities = generate_cities(3, keys_per_infobox=2, number_of_keys=4)
+
+    assert align_languages(
+        cities, EmbeddingComparisonMode.COSINE, Language.EN, [Language.DE], extractor
+    ) == {Language.DE: {}}
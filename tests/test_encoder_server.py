@@ -0,0 +1,26 @@
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip("torch")
+from encoder_server import BatchEncoder  # noqa: E402
+
+
+def test_invalid_layer_is_rejected_before_batching(tiny_model):
+    encoder = BatchEncoder(tiny_model)
+
+    with pytest.raises(ValueError):
+        encoder.embed(["abc"], layer=3)
+    assert encoder.embed(["abc"], layer=-3)[0].shape == (32,)
+    assert encoder.requests.empty()
+
+
+def test_failing_request_does_not_fail_the_batch(tiny_model):
+    encoder = BatchEncoder(tiny_model)
+    valid, invalid = Future(), Future()
+
+    encoder.encode_batch([("abc", -1, valid), ("abc", 7, invalid)])
+
+    assert valid.result().shape == (32,)
+    with pytest.raises(IndexError):
+        invalid.result()
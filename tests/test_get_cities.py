@@ -0,0 +1,111 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+
+from get_cities import iter_cities
+
+# the bindings of the query, ordered by ?cid, Q2 and Q4 have several Dutch articles
+BINDINGS = [
+    {
+        "cid": {"value": f"http://www.wikidata.org/entity/Q{city}"},
+        "city": {"value": f"City {city}"},
+        "article_en": {"value": f"https://en.wikipedia.org/wiki/City_{city}"},
+        "article_nl": {"value": f"https://nl.wikipedia.org/wiki/Stad_{city}_{article}"},
+    }
+    for city, articles in [(1, 1), (2, 2), (3, 1), (4, 3), (5, 1), (6, 1)]
+    for article in range(articles)
+]
+# Q3 also has a German article
+BINDINGS[3]["article_de"] = {"value": "https://de.wikipedia.org/wiki/Stadt_3"}
+
+
+@pytest.fixture
+def endpoint():
+    """A SPARQL endpoint that applies the keyset filter and the limit of the query"""
+    requested = []
+    failures = []
+
+    class SparqlHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            query = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+            query = query["query"][0]
+            after = re.search(r'STR\(\?cid\) > "([^"]*)"', query)
+            after = after.group(1) if after else None
+            requested.append(after)
+
+            if failures:
+                status, result = failures.pop(0), {}
+            else:
+                limit = int(re.search(r"LIMIT (\d+)", query).group(1))
+                status, result = 200, {"results": {"bindings": [
+                    binding for binding in BINDINGS
+                    if after is None or binding["cid"]["value"] > after
+                ][:limit]}}
+
+            body = json.dumps(result).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SparqlHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/sparql", requested, failures
+    server.shutdown()
+    thread.join()
+
+
+def test_cities_are_paginated_with_a_keyset(endpoint):
+    url, requested, _ = endpoint
+
+    cities = list(iter_cities(page_size=3, url=url))
+
+    # Q4 has two bindings on the second page and one that the keyset filter skips on the third
+    assert [city["name"] for city in cities] == [f"City {city}" for city in range(1, 7)]
+    assert cities[1]["url_nl"] == "https://nl.wikipedia.org/wiki/Stad_2_0"
+    # the keyset moves to the last city of every page, and the short third page is the last
+    assert requested == [
+        None, "http://www.wikidata.org/entity/Q2", "http://www.wikidata.org/entity/Q4"
+    ]
+
+
+def test_a_full_last_page_is_followed_by_an_empty_page(endpoint):
+    url, requested, _ = endpoint
+
+    assert len(list(iter_cities(page_size=len(BINDINGS), url=url))) == 6
+    assert requested == [None, "http://www.wikidata.org/entity/Q6"]
+
+
+def test_only_server_errors_are_retried(endpoint):
+    url, requested, failures = endpoint
+
+    failures.extend([503, 429])
+    assert len(list(iter_cities(page_size=100, url=url))) == 6
+    assert len(requested) == 3
+
+    failures.append(400)
+    with pytest.raises(requests.HTTPError, match="Status 400"):
+        list(iter_cities(page_size=100, url=url))
+    assert len(requested) == 4
+
+
+def test_the_urls_of_other_languages_are_kept(endpoint):
+    url, _, _ = endpoint
+
+    cities = list(iter_cities(page_size=3, url=url, languages=["de", "fr"]))
+
+    assert cities[2]["urls"] == {"de": "https://de.wikipedia.org/wiki/Stadt_3"}
+    assert all("urls" not in city for city in cities[:2] + cities[3:])
+    assert "urls" not in list(iter_cities(page_size=3, url=url))[2]
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+from inference_backend import FeatureExtractor  # noqa: E402
+
+TEXTS = ["population", "area", "mayor of the city", "a", "elevation above sea level"]
+
+
+def test_batched_embeddings_ignore_the_padding(tiny_model):
+    extractor = FeatureExtractor(tiny_model, "fp32")
+
+    embeddings = extractor.embed(TEXTS, batch_size=2)
+
+    expected = np.concatenate([extractor(text).mean(axis=1) for text in TEXTS])
+    np.testing.assert_allclose(embeddings, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_onnx_embeddings_match_torch(tiny_model, tmp_path):
+    onnxruntime = pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    torch_extractor = FeatureExtractor(tiny_model, "fp32")
+    onnx_extractor = FeatureExtractor(tiny_model, "onnx", str(tmp_path))
+    directory = os.path.dirname(onnx_extractor.model.path)
+
+    # the export itself gives the same hidden states as torch
+    session = onnxruntime.InferenceSession(
+        os.path.join(directory, "model.onnx"), providers=["CPUExecutionProvider"]
+    )
+    inputs = torch_extractor.tokenizer(TEXTS, return_tensors="np", padding=True)
+    exported = session.run(["last_hidden_state"], {
+        "input_ids": inputs["input_ids"].astype(np.int64),
+        "attention_mask": inputs["attention_mask"].astype(np.int64),
+    })[0]
+    expected = torch_extractor.hidden_states(
+        torch_extractor.tokenizer(TEXTS, return_tensors="pt", padding=True)
+    )
+    np.testing.assert_allclose(exported, expected, rtol=1e-4, atol=1e-4)
+
+    # the int8 weights only change the embeddings slightly
+    embeddings, reference = onnx_extractor.embed(TEXTS), torch_extractor.embed(TEXTS)
+    similarity = (embeddings * reference).sum(axis=1) / (
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1)
+    )
+    assert similarity.min() > 0.99
+
+    # the export is reused
+    modified = os.path.getmtime(onnx_extractor.model.path)
+    assert FeatureExtractor(tiny_model, "onnx", str(tmp_path)).model.path \
+        == onnx_extractor.model.path
+    assert os.path.getmtime(onnx_extractor.model.path) == modified
@@ -0,0 +1,56 @@
+import copy
+
+import pytest
+
+from infobox_store import InfoBoxStore
+from synthetic_data import generate_cities
+from util import Language
+from value_alignment import align_properties, process_cities, process_store
+
+main = pytest.importorskip("main")
+
+
+@pytest.fixture
+def cities():
+    return generate_cities(300, keys_per_infobox=12, number_of_keys=40)
+
+
+def test_to_cities_round_trip(cities):
+    assert InfoBoxStore.from_cities(cities).to_cities() == cities
+
+
+def test_languages_that_are_not_in_language_are_skipped():
+    city = generate_cities(1, other_languages=["de", "pl"])[0]
+
+    assert city.languages() == [Language.EN, Language.NL, Language.DE]
+    store = InfoBoxStore.from_cities([city])
+    assert list(store.columns) == [Language.EN, Language.NL, Language.DE]
+    assert store.to_cities()[0].infoboxes == {"de": city.infoboxes["de"]}
+
+
+def test_process_store_equals_process_cities(cities):
+    expected = process_cities(cities)
+    actual = process_store(InfoBoxStore.from_cities(cities))
+
+    assert actual == expected
+    # align_properties breaks ties by insertion order
+    assert list(actual.items()) == list(expected.items())
+
+
+@pytest.mark.parametrize("mode", list(main.CompletionMode))
+def test_complete_store_equals_complete_infobox(cities, mode):
+    value_alignments = align_properties(process_cities(cities))
+    embedding_alignments = {f"Property {index}": f"Eigenschap {index}" for index in range(0, 40, 3)}
+    # aligned properties that do not occur in any infobox
+    embedding_alignments["Property 1"] = "Nieuwe eigenschap"
+
+    completed = main.complete_store(
+        mode, InfoBoxStore.from_cities(cities), value_alignments, embedding_alignments
+    )
+    expected = main.complete_infobox(
+        mode, copy.deepcopy(cities), value_alignments, embedding_alignments
+    )
+
+    for city, (value_completed, embedding_completed) in zip(expected, completed):
+        assert value_completed == city.value_alignment_completed_infobox
+        assert embedding_completed == city.embedding_alignment_completed_infobox
@@ -0,0 +1,185 @@
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import metrics
+import parse_infoboxes
+from parse_infoboxes import get_wiki_page, iter_infoboxes, retry_delay, save_infoboxes
+from serialization import load_infobox_cities
+from synthetic_data import generate_infobox_html
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """Serves /page/<index> with an infobox after a random delay, /missing with 404 and
+    /throttled/<name> with 429 the first two times"""
+    protocol_version = "HTTP/1.1"
+    requests_per_path = {}
+    lock = threading.Lock()
+
+    def send(self, status: int, body: bytes = b"", headers: dict = None) -> None:
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.lock:
+            count = self.requests_per_path[self.path] = self.requests_per_path.get(self.path, 0) + 1
+
+        if self.path.startswith("/page/"):
+            time.sleep(random.uniform(0, 0.02))
+            index = self.path.rsplit("/", 1)[1]
+            self.send(200, generate_infobox_html({"Index": [index]}).encode("utf-8"))
+        elif self.path.startswith("/throttled/") and count <= 2:
+            self.send(429, headers={"Retry-After": "0"})
+        elif self.path.startswith("/throttled/"):
+            self.send(200, generate_infobox_html({"Retried": [str(count)]}).encode("utf-8"))
+        else:
+            self.send(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    thread.join()
+
+
+def test_retry_delay_honours_retry_after():
+    response = requests.Response()
+    assert retry_delay(response, 0) == parse_infoboxes.RETRY_SECONDS
+    assert retry_delay(response, 3) == 8 * parse_infoboxes.RETRY_SECONDS
+
+    response.headers["Retry-After"] = "7"
+    assert retry_delay(response, 3) == 7
+    response.headers["Retry-After"] = "100000"
+    assert retry_delay(response, 0) == parse_infoboxes.MAX_RETRY_SECONDS
+    response.headers["Retry-After"] = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert retry_delay(response, 0) == 0
+
+
+def test_get_wiki_page_retries_a_limited_number_of_times(server_url, monkeypatch):
+    assert "Retried" in get_wiki_page(f"{server_url}/throttled/once")
+
+    with pytest.raises(requests.HTTPError, match="404"):
+        get_wiki_page(f"{server_url}/missing")
+    assert PageHandler.requests_per_path["/missing"] == 1
+
+    monkeypatch.setattr(parse_infoboxes, "MAX_RETRIES", 1)
+    with pytest.raises(requests.HTTPError, match="429"):
+        get_wiki_page(f"{server_url}/throttled/twice")
+    assert PageHandler.requests_per_path["/throttled/twice"] == 2
+
+
+@pytest.mark.parametrize("fetch_threads, parse_processes", [(4, 2), (4, 0), (1, 1)])
+def test_iter_infoboxes_keeps_the_order_of_the_urls(server_url, fetch_threads, parse_processes):
+    metrics.REGISTRY.reset()
+    urls = [f"{server_url}/page/{index}" for index in range(40)]
+    statistics = {}
+
+    infoboxes = list(iter_infoboxes(urls, fetch_threads, parse_processes, 4, statistics))
+
+    assert infoboxes == [{"Index": [str(index)]} for index in range(40)]
+    assert statistics["fetch"].items == statistics["parse"].items == 40
+    # the phases of the parse processes are recorded in this process
+    histograms = {name: histogram for (name, _), histogram in metrics.REGISTRY.histograms.items()}
+    assert histograms["parse_html_seconds"].count == histograms["extract_rows_seconds"].count == 40
+
+
+@pytest.mark.parametrize("fetch_threads, parse_processes", [(4, 2), (4, 0), (1, 0)])
+def test_failed_pages_are_skipped(server_url, fetch_threads, parse_processes):
+    metrics.REGISTRY.reset()
+    urls = [f"{server_url}/page/{index}" for index in range(20)]
+    urls[5] = f"{server_url}/missing"
+    statistics = {}
+
+    infoboxes = list(iter_infoboxes(urls, fetch_threads, parse_processes, 4, statistics))
+
+    assert infoboxes == [{} if index == 5 else {"Index": [str(index)]} for index in range(20)]
+    assert statistics["parse"].items == 19
+    assert metrics.REGISTRY.counters[
+        ("failed_pages_total", (("source", "wikipedia"), ("status", "404")))
+    ] == 1
+
+
+def unused_port() -> int:
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        return unused.getsockname()[1]
+
+
+@pytest.mark.parametrize("parse_processes", [2, 0])
+def test_iter_infoboxes_raises_errors_that_are_not_per_page(server_url, parse_processes):
+    urls = [f"{server_url}/page/{index}" for index in range(20)]
+    # nothing listens on the port, so the connection is refused
+    urls[5] = f"http://127.0.0.1:{unused_port()}/page/5"
+    infoboxes = []
+
+    with pytest.raises(requests.ConnectionError):
+        for infobox in iter_infoboxes(urls, 4, parse_processes, 4):
+            infoboxes.append(infobox)
+
+    # the error is raised as soon as it arrives, the infoboxes before it stay in order
+    assert infoboxes == [{"Index": [str(index)]} for index in range(len(infoboxes))]
+    assert len(infoboxes) <= 5
+
+    # the fetch threads and the dispatcher stop once the error is raised
+    def pipeline_threads() -> list[str]:
+        return [
+            thread.name for thread in threading.enumerate()
+            if thread.name.endswith(("(fetch)", "(dispatch)"))
+        ]
+
+    deadline = time.monotonic() + 5
+    while pipeline_threads() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert pipeline_threads() == []
+
+
+@pytest.mark.parametrize("fetch_threads, parse_processes", [(1, 0), (3, 0), (2, 1)])
+def test_infoboxes_of_other_languages_are_saved(
+        server_url, tmp_path, fetch_threads, parse_processes
+):
+    cities = [
+        {
+            "uri": f"http://www.wikidata.org/entity/Q{index}",
+            "name": f"City {index}",
+            "url_en": f"{server_url}/page/{index}0",
+            "url_nl": f"{server_url}/page/{index}1",
+        }
+        for index in range(1, 5)
+    ]
+    cities[1]["urls"] = {"de": f"{server_url}/page/22", "fr": f"{server_url}/page/23"}
+    # a deleted article does not stop the crawl
+    cities[3]["url_en"] = f"{server_url}/missing"
+    with open(tmp_path / "cities.json", "w") as file:
+        json.dump(cities, file)
+
+    statistics = save_infoboxes(
+        str(tmp_path / "cities.json"), str(tmp_path / "infoboxes.json"), fetch_threads,
+        parse_processes,
+    )
+
+    saved = load_infobox_cities(str(tmp_path / "infoboxes.json"))
+    assert [city.infobox_nl for city in saved] == [
+        {"Index": [f"{index}1"]} for index in range(1, 5)
+    ]
+    assert saved[1].urls == cities[1]["urls"]
+    assert saved[1].infoboxes == {"de": {"Index": ["22"]}, "fr": {"Index": ["23"]}}
+    assert saved[0].urls is None and saved[0].infoboxes is None
+    assert saved[3].infobox_en == {}
+    assert statistics["write"]["items"] == 4
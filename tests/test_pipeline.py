@@ -0,0 +1,46 @@
+import json
+import os
+
+import pipeline
+from pipeline import Stage, create_stages, module_dependencies, run_pipeline
+
+
+def test_stage_modules_include_transitive_imports():
+    directory = os.path.dirname(os.path.abspath(pipeline.__file__))
+    modules = {
+        stage.name: module_dependencies(stage.modules, directory) for stage in create_stages()
+    }
+
+    assert "inference_backend.py" in modules["extract_embeddings"]
+    assert "inference_backend.py" in modules["embedding_alignment"]
+    assert {"value_alignment.py", "embedding_alignment.py", "infobox_store.py"} \
+        <= set(modules["complete_infoboxes"])
+    assert "pipeline.py" not in modules["get_cities"]
+
+
+def test_run_pipeline_skips_unchanged_stages(tmp_path):
+    source, middle, target = (str(tmp_path / name) for name in ("a.txt", "b.txt", "c.txt"))
+    (tmp_path / "a.txt").write_text("1")
+
+    def copy(input_path: str, output_path: str) -> None:
+        with open(input_path) as file, open(output_path, "w") as out:
+            out.write(file.read() + "!")
+
+    stages = [
+        Stage("first", copy, [source], [middle], ["util.py"]),
+        Stage("second", copy, [middle], [target], ["util.py"]),
+        Stage("other", copy, [source], [str(tmp_path / "d.txt")], ["util.py"]),
+    ]
+    state_path = str(tmp_path / "state.json")
+
+    assert run_pipeline(stages, state_path=state_path) == {
+        "first": "run", "second": "run", "other": "run"
+    }
+    assert set(json.loads((tmp_path / "state.json").read_text())) == {"first", "second", "other"}
+    assert set(run_pipeline(stages, state_path=state_path).values()) == {"skipped"}
+
+    (tmp_path / "c.txt").write_text("edited")
+    assert run_pipeline(stages, state_path=state_path)["second"] == "run"
+    (tmp_path / "a.txt").write_text("2")
+    assert set(run_pipeline(stages, state_path=state_path).values()) == {"run"}
+    assert (tmp_path / "c.txt").read_text() == "2!!"
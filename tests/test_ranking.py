@@ -0,0 +1,39 @@
+import numpy as np
+
+import test_system as system
+
+
+def random_mapping(size: int, seed: int = 0) -> dict[str, dict[str, float]]:
+    # small integer distances, so that many distances are equal
+    distances = np.random.default_rng(seed).integers(0, 4, (size, size))
+    ids = [f"P{index}" for index in range(size)]
+    return {
+        property_id1: {
+            property_id2: float(distances[row, column]) for column, property_id2 in enumerate(ids)
+        }
+        for row, property_id1 in enumerate(ids)
+    }
+
+
+def test_compute_ranks_matches_test_all_properties():
+    mapping = random_mapping(40)
+    ids, matrix = system.mapping_to_matrix(mapping)
+
+    positions = system.positions_histogram(system.compute_ranks(matrix), len(ids))
+
+    assert positions == system.test_all_properties(mapping)
+
+
+def test_ranks_per_city_match_test_per_city():
+    mapping = random_mapping(30, seed=1)
+    ids, matrix = system.mapping_to_matrix(mapping)
+    rng = np.random.default_rng(2)
+    properties_per_city = {
+        f"Q{city}": {property_id: {} for property_id in rng.choice(ids, 8, replace=False)}
+        for city in range(5)
+    }
+
+    ranks = system.compute_ranks_per_city(properties_per_city, ids, matrix)
+    positions = system.to_percent(system.positions_histogram(ranks, len(ids)))
+
+    assert positions == system.test_per_city(properties_per_city, mapping)
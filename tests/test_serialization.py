@@ -0,0 +1,32 @@
+import json
+
+import serialization
+from serialization import dump_infobox_cities, infobox_city_to_dict, load_infobox_cities
+from synthetic_data import generate_cities
+
+
+def test_round_trip_keeps_legacy_fields(tmp_path):
+    city = infobox_city_to_dict(generate_cities(1)[0])
+    city["all_alignment_completed_infobox"] = [
+        {"original_property": "Area", "property_": "Oppervlakte", "values": ["1 km²"]}
+    ]
+    path = tmp_path / "cities.json"
+    path.write_text(json.dumps([city]), encoding="utf-8")
+
+    dump_infobox_cities(load_infobox_cities(str(path)), str(tmp_path / "dumped.json"))
+
+    dumped = json.loads((tmp_path / "dumped.json").read_text(encoding="utf-8"))
+    assert dumped == [city]
+
+
+def test_dump_does_not_depend_on_orjson(tmp_path, monkeypatch):
+    cities = generate_cities(3)
+    cities[0].infobox_nl["Coördinaten"] = ["6° 12′ NB"]
+
+    dump_infobox_cities(cities, str(tmp_path / "installed.json"))
+    monkeypatch.setattr(serialization, "orjson", None)
+    dump_infobox_cities(cities, str(tmp_path / "missing.json"))
+
+    installed = (tmp_path / "installed.json").read_bytes()
+    assert installed == (tmp_path / "missing.json").read_bytes()
+    assert installed.isascii() and installed.startswith(b'[\n    {\n        "name"')
@@ -0,0 +1,55 @@
+import pytest
+
+import benchmark
+from infobox_store import InfoBoxStore
+from synthetic_data import generate_cities, generate_similarity_mapping
+from util import Language
+
+
+def test_generated_cities_have_the_requested_size():
+    cities = generate_cities(
+        50, keys_per_infobox=7, number_of_keys=30, other_languages=["de", "fr"]
+    )
+
+    assert len(cities) == 50
+    assert len({city.uri for city in cities}) == 50
+    for city in cities:
+        for infobox in [city.infobox_en, city.infobox_nl, *city.infoboxes.values()]:
+            assert len(infobox) == 7
+            assert all(
+                isinstance(values, list) and len(values) == 1 and isinstance(values[0], str)
+                for values in infobox.values()
+            )
+        assert set(city.urls) == set(city.infoboxes) == {"de", "fr"}
+        assert all(key.startswith("Property ") for key in city.infobox_en)
+        assert all(key.startswith("Eigenschap ") for key in city.infobox_nl)
+
+    store = InfoBoxStore.from_cities(cities, [Language.EN, Language.NL, Language.DE])
+    assert len(store) == 50
+    assert len(store.unique_properties(Language.EN)) <= 30
+
+
+def test_generated_cities_are_reproducible():
+    assert generate_cities(5, seed=1) == generate_cities(5, seed=1)
+    assert generate_cities(5, seed=1) != generate_cities(5, seed=2)
+    assert generate_cities(5, keys_per_infobox=500, number_of_keys=10)[0].infobox_en.keys() \
+        == {f"Property {index}" for index in range(10)}
+
+
+def test_similarity_mapping_is_square():
+    mapping = generate_similarity_mapping(6)
+
+    assert len(mapping) == 6
+    assert all(set(row) == set(mapping) for row in mapping.values())
+
+
+def test_benchmarks_run_on_a_small_scale():
+    pytest.importorskip("transformers")
+
+    results = benchmark.run_benchmarks(scale=0.01, repeat=1)
+
+    assert "embedding_alignment.align_properties" in results
+    assert all(result["seconds"] >= 0 and result["items"] > 0 for result in results.values())
+    assert benchmark.compare(results, results) == pytest.approx(
+        {name: 1.0 for name, result in results.items() if result["seconds"] > 0}
+    )
@@ -0,0 +1,118 @@
+from infobox_store import InfoBoxStore
+from synthetic_data import generate_cities
+from util import Alignment, InfoBoxCity, Language
+from value_alignment import (
+    annotated_alignments, compare_matching_modes, process_store, process_store_approximate,
+    process_store_languages,
+)
+
+
+def city(index: int, infobox_en: dict, infobox_nl: dict) -> InfoBoxCity:
+    return InfoBoxCity(
+        name=f"City {index}",
+        uri=f"http://www.wikidata.org/entity/Q{index}",
+        url_en=f"https://en.wikipedia.org/wiki/City_{index}",
+        url_nl=f"https://nl.wikipedia.org/wiki/City_{index}",
+        infobox_en=infobox_en,
+        infobox_nl=infobox_nl,
+    )
+
+
+def test_approximate_matching_requires_the_same_numbers():
+    # the areas share nine of their eleven tokens, but are of different years
+    area = "about 120 square kilometres of land and water in {}"
+    store = InfoBoxStore.from_cities([
+        city(0, {"Population": ["1,234,567"], "Area": [area.format(1990)]},
+             {"Inwoners": ["1.234.567"], "Oppervlakte": [area.format(2005)]}),
+        city(1, {"Population": ["7,654"], "Mayor": ["Jan de Vries"]},
+             {"Inwoners": ["7654"], "Burgemeester": ["Jan de Vries"]}),
+    ])
+
+    assert process_store(store) == {"Mayor": {"Burgemeester": 1}}
+    assert process_store_approximate(store) == {
+        "Population": {"Inwoners": 2}, "Mayor": {"Burgemeester": 1}
+    }
+
+
+def test_approximate_matching_counts_every_exact_pair():
+    store = InfoBoxStore.from_cities(generate_cities(200, reformat=0.5))
+
+    exact, approximate = process_store(store), process_store_approximate(store)
+
+    for key, counts in exact.items():
+        for target, count in counts.items():
+            assert approximate[key][target] >= count
+
+
+def test_precision_on_the_annotated_alignments():
+    annotated = [city(0, {}, {}), city(1, {}, {})]
+    annotated[0].value_alignment_completed_infobox = [
+        Alignment("Mayor", "Burgemeester", ["Jan"], True),
+        Alignment("Population", "Oppervlakte", ["7,654"], False),
+    ]
+    annotated[1].embedding_alignment_completed_infobox = [
+        Alignment("Population", "Oppervlakte", ["8,000"], True),
+        Alignment("Population", "Inwoners", ["8,000"], True),
+    ]
+    annotations = annotated_alignments(annotated)
+    assert annotations == {
+        ("Mayor", "Burgemeester"): True,
+        ("Population", "Oppervlakte"): True,
+        ("Population", "Inwoners"): True,
+    }
+
+    store = InfoBoxStore.from_cities([
+        city(2, {"Population": ["7,654"], "Mayor": ["Piet"], "Website": ["a.nl"]},
+             {"Inwoners": ["7.654"], "Burgemeester": ["Piet"], "Website": ["a.nl"]}),
+    ])
+    annotations[("Mayor", "Burgemeester")] = False
+    results = compare_matching_modes(store, annotations=annotations, repeat=1)
+
+    assert results["exact"]["alignments"] == 2
+    assert results["exact"]["annotated_alignments"] == 1
+    assert results["exact"]["annotated_precision"] == 0.0
+    assert results["approximate"]["alignments"] == 3
+    assert results["approximate"]["annotated_alignments"] == 2
+    assert results["approximate"]["annotated_precision"] == 0.5
+    # of the two alignments annotated as correct, only the approximate matching finds one
+    assert results["exact"]["annotated_recall"] == 0.0
+    assert results["approximate"]["annotated_recall"] == 0.5
+    assert results["approximate"]["annotated_recall_gain"] == 0.5
+    assert results["approximate"]["approximate_only_alignments"] == 1
+
+
+def test_comparison_reports_the_recall_gain():
+    store = InfoBoxStore.from_cities(
+        generate_cities(300, keys_per_infobox=20, number_of_keys=60, reformat=0.5)
+    )
+    correct = {f"Property {index}": f"Eigenschap {index}" for index in range(60)}
+
+    results = compare_matching_modes(store, correct, repeat=1)
+
+    exact, approximate = results["exact"], results["approximate"]
+    assert approximate["recall_gain"] == approximate["recall"] - exact["recall"]
+    assert approximate["recall_gain"] >= 0
+    assert approximate["correct_pairs"] > exact["correct_pairs"]
+    assert approximate["approximate_only_alignments"] >= 0
+    assert "annotated_recall_gain" not in approximate
+
+
+def test_languages_are_joined_like_language_pairs():
+    cities = generate_cities(100, other_languages=["de", "fr"])
+    store = InfoBoxStore.from_cities(cities)
+
+    targets = [Language.NL, Language.DE, Language.FR]
+    properties = process_store_languages(store, Language.EN, targets)
+
+    assert properties[Language.NL] == process_store(store)
+    for target in [Language.DE, Language.FR]:
+        expected = {}
+        for city_ in cities:
+            for key, values in city_.infobox_en.items():
+                for key_target, values_target in city_.infobox(target).items():
+                    if values == values_target:
+                        counts = expected.setdefault(key, {})
+                        counts[key_target] = counts.get(key_target, 0) + 1
+        assert properties[target] == expected
+        assert expected
+        assert process_store_languages(store, Language.EN, [target])[target] == expected
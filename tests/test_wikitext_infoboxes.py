@@ -0,0 +1,141 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import mock_mediawiki_api
+from wikitext_infoboxes import (
+    convert_infobox_wikitext_to_dict, fetch_wikitexts, get_infoboxes_batch
+)
+
+UTRECHT = """{{Short description|City in the Netherlands}}
+{{Infobox settlement
+| name = Utrecht <!-- the name -->
+| subdivision_type = Country
+| subdivision_name = {{flag|Netherlands}}
+| subdivision_type1 = [[Provinces of the Netherlands|Province]]
+| subdivision_name1 = [[Utrecht (province)|Utrecht]]
+| leader_title = [[Mayor]]
+| leader_name = Sharon Dijksma
+| area_total_km2 = 99.21
+| population_total = {{formatnum:361924}}<ref>{{cite web|url=https://cbs.nl}}</ref>
+| population_density_km2 = 3,648
+| timezone = [[Central European Time|CET]]
+| website = {{URL|utrecht.nl}}
+| blank_name_sec1 = Vehicle registration
+| blank_info_sec1 = UT
+| postal_code_type = Postcode
+| postal_code = 3450–3455, 3500–3585
+| demographics_type1 = {{plainlist|
+* Dutch
+* Other}}
+}}
+'''Utrecht''' is a city."""
+
+
+def test_parameters_are_mapped_to_labels():
+    assert convert_infobox_wikitext_to_dict(UTRECHT) == {
+        "Name": ["Utrecht"],
+        "Country": ["Netherlands"],
+        "Province": ["Utrecht"],
+        "Mayor": ["Sharon Dijksma"],
+        "Total": ["361924"],
+        "Density": ["3,648"],
+        "Time zone": ["CET"],
+        "Vehicle registration": ["UT"],
+        "Postcode": ["3450–3455, 3500–3585"],
+        "Demographics type1": ["Dutch", "Other"],
+    }
+
+
+@pytest.fixture
+def api_url():
+    pages = {
+        "en": {"Utrecht": UTRECHT},
+        "nl": {
+            f"Plaats {index}":
+                f"{{{{Infobox plaats\n| inwoners = {index}\n| deelstaat = Bayern\n}}}}"
+            for index in range(45)
+        },
+    }
+    redirects = {"en": {"Utrecht (city)": "Utrecht"}}
+    yield from serve(mock_mediawiki_api.create_handler(pages, redirects))
+
+
+def serve(handler: type[BaseHTTPRequestHandler]):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/{{language}}/api.php"
+    server.shutdown()
+    thread.join()
+
+
+@pytest.fixture
+def scripted_api():
+    """An API that answers with the next of the (status, result) responses per request"""
+    responses = []
+
+    class ScriptedHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            status, result = responses.pop(0)
+            body = json.dumps(result).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    for api_url in serve(ScriptedHandler):
+        yield api_url, responses
+
+
+def test_batch_follows_redirects_and_continuations(api_url):
+    urls_nl = [f"https://nl.wikipedia.org/wiki/Plaats_{index}" for index in range(45)]
+    urls = [
+        "https://en.wikipedia.org/wiki/utrecht_(city)",
+        "https://en.wikipedia.org/wiki/Missing",
+        *urls_nl,
+    ]
+
+    infoboxes = get_infoboxes_batch(urls, api_url)
+
+    assert infoboxes[urls[0]] == convert_infobox_wikitext_to_dict(UTRECHT)
+    assert infoboxes[urls[1]] == {}
+    assert [infoboxes[url] for url in urls_nl] == [
+        {"Inwoners": [str(index)], "Deelstaat": ["Bayern"]} for index in range(45)
+    ]
+
+
+def test_server_errors_are_retried(scripted_api):
+    api_url, responses = scripted_api
+    page = {"title": "Utrecht", "revisions": [{"slots": {"main": {"content": UTRECHT}}}]}
+    responses.extend([(503, {}), (429, {}), (200, {"query": {"pages": [page]}})])
+
+    assert fetch_wikitexts(["Utrecht"], "en", api_url) == {"Utrecht": UTRECHT}
+    assert responses == []
+
+
+def test_client_errors_are_not_retried(scripted_api):
+    api_url, responses = scripted_api
+    responses.extend([(400, {"error": {"code": "badrequest"}}), (200, {})])
+
+    with pytest.raises(requests.HTTPError, match="Status 400"):
+        fetch_wikitexts(["Utrecht"], "en", api_url)
+    assert len(responses) == 1
+
+
+def test_api_errors_are_raised(scripted_api):
+    api_url, responses = scripted_api
+    responses.append((200, {"error": {"code": "maxlag", "info": "Waiting for a database"}}))
+
+    with pytest.raises(RuntimeError, match="maxlag: Waiting for a database"):
+        fetch_wikitexts(["Utrecht"], "en", api_url)
@@ -0,0 +1,110 @@
+import metrics
+from work_queue import (
+    complete, connect, enqueue, get_results, lease, progress, release, requeue_failed,
+    run_worker, run_workers, DONE, FAILED, LEASED, MAX_ATTEMPTS, PENDING,
+)
+
+CITIES = [
+    {"uri": f"http://www.wikidata.org/entity/Q{index}", "name": f"City {index}"}
+    for index in range(5)
+]
+
+
+def queue(tmp_path):
+    connection = connect(str(tmp_path / "queue.db"))
+    assert enqueue(connection, "infoboxes", CITIES) == len(CITIES)
+    assert enqueue(connection, "infoboxes", CITIES) == 0
+    return connection
+
+
+def test_expired_lease_is_handed_out_again(tmp_path):
+    connection = queue(tmp_path)
+
+    # the lease of the first worker has already expired, as if the worker crashed
+    crashed = lease(connection, "infoboxes", "crashed", 2, lease_seconds=-1)
+    taken_over = lease(connection, "infoboxes", "second", 3)
+    assert [uri for uri, _ in taken_over] == [uri for uri, _ in crashed] + [CITIES[2]["uri"]]
+    assert lease(connection, "infoboxes", "third", 3) == [
+        (city["uri"], city) for city in CITIES[3:]
+    ]
+
+    # the first worker can no longer release a city it lost, but it may still complete it
+    release(connection, "infoboxes", CITIES[0]["uri"], "crashed", "error")
+    assert progress(connection, "infoboxes") == {LEASED: 5}
+    complete(connection, "infoboxes", CITIES[0]["uri"], "crashed", {"first": True})
+    complete(connection, "infoboxes", CITIES[0]["uri"], "second", {"first": False})
+
+    assert progress(connection, "infoboxes") == {DONE: 1, LEASED: 4}
+    assert get_results(connection, "infoboxes") == [(CITIES[0], {"first": False})]
+
+
+def test_city_fails_after_max_attempts(tmp_path):
+    connection = queue(tmp_path)
+    uri = CITIES[0]["uri"]
+
+    for _ in range(MAX_ATTEMPTS - 1):
+        assert lease(connection, "infoboxes", "worker", lease_seconds=-1)[0][0] == uri
+    assert lease(connection, "infoboxes", "worker")[0][0] == uri
+    release(connection, "infoboxes", uri, "worker", "error")
+
+    assert progress(connection, "infoboxes") == {FAILED: 1, PENDING: 4}
+    assert lease(connection, "infoboxes", "worker")[0][0] == CITIES[1]["uri"]
+
+
+def test_failed_cities_can_be_requeued(tmp_path):
+    connection = queue(tmp_path)
+    uri = CITIES[0]["uri"]
+    for _ in range(MAX_ATTEMPTS):
+        lease(connection, "infoboxes", "worker")
+        release(connection, "infoboxes", uri, "worker", "error")
+    assert progress(connection, "infoboxes") == {FAILED: 1, PENDING: 4}
+
+    assert requeue_failed(connection, "infoboxes") == 1
+    assert requeue_failed(connection, "infoboxes") == 0
+    assert progress(connection, "infoboxes") == {PENDING: 5}
+
+    # the city gets MAX_ATTEMPTS new attempts
+    for _ in range(MAX_ATTEMPTS - 1):
+        assert lease(connection, "infoboxes", "worker")[0][0] == uri
+        release(connection, "infoboxes", uri, "worker", "error")
+    assert progress(connection, "infoboxes") == {PENDING: 5}
+
+
+def process_name(city: dict) -> dict:
+    metrics.increment("processed_total", task="test")
+    return {"name": city["name"]}
+
+
+def test_run_workers_merges_the_metrics_of_the_workers(tmp_path):
+    path = str(tmp_path / "queue.db")
+    queue(tmp_path).close()
+    metrics.REGISTRY.reset()
+
+    assert run_workers(path, "infoboxes", 2, process_name) == len(CITIES)
+
+    assert progress(connect(path), "infoboxes") == {DONE: len(CITIES)}
+    counters = metrics.REGISTRY.counters
+    assert counters[("processed_total", (("task", "test"),))] == len(CITIES)
+    assert counters[("queue_completed_total", (("task", "infoboxes"),))] == len(CITIES)
+
+
+def test_run_worker_retries_failed_cities(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue(tmp_path).close()
+    failures = set()
+
+    def process(city: dict) -> dict:
+        # every city fails the first time it is processed
+        if city["uri"] not in failures:
+            failures.add(city["uri"])
+            raise RuntimeError("temporary error")
+        return {"name": city["name"]}
+
+    processed = run_worker(str(tmp_path / "queue.db"), "infoboxes", "worker", process=process)
+
+    connection = connect(str(tmp_path / "queue.db"))
+    assert processed == len(CITIES)
+    assert progress(connection, "infoboxes") == {DONE: len(CITIES)}
+    assert get_results(connection, "infoboxes") == [
+        (city, {"name": city["name"]}) for city in CITIES
+    ]
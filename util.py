@@ -38,7 +38,7 @@ class City:
 
 
 @dataclass_json
-@dataclass
+@dataclass(slots=True)
 class Alignment:
     """An alignment between two properties"""
     original_property: str
@@ -48,7 +48,7 @@ class Alignment:
 
 
 @dataclass_json
-@dataclass
+@dataclass(slots=True)
 class InfoBoxCity:
     """A city with its name, population, and wikidata URI"""
     name: str
@@ -61,6 +61,77 @@ class InfoBoxCity:
     value_alignment_completed_infobox: list[Alignment] = None
     embedding_alignment_completed_infobox: list[Alignment] = None
 
+    # the urls and infoboxes of the languages other than English and Dutch, by language code
+    urls: dict[str, str] = None
+    infoboxes: dict[str, dict[str, list[str]]] = None
+
+    # the fields of the json file that are not known to this class, like the
+    # all_alignment_completed_infobox of older files, so that they are written back unchanged
+    other_fields: dict[str, object] = None
+
+    def infobox(self, language: "Language") -> dict[str, list[str]]:
+        if language == Language.EN:
+            return self.infobox_en
+        if language == Language.NL:
+            return self.infobox_nl
+        return (self.infoboxes or {}).get(language.value, {})
+
+    def url(self, language: "Language") -> str | None:
+        if language == Language.EN:
+            return self.url_en
+        if language == Language.NL:
+            return self.url_nl
+        return (self.urls or {}).get(language.value, None)
+
+    def languages(self) -> list["Language"]:
+        """
+        English, Dutch and the other languages the city has an infobox in. Infoboxes in languages
+        that are not a member of Language are skipped, add the language to Language to align them.
+        """
+        codes = {language.value for language in Language}
+        return [Language.EN, Language.NL] + [
+            Language(code) for code in (self.infoboxes or {}) if code in codes
+        ]
+
+
+class Language(Enum):
+    """The Wikipedia languages, add a member to align the infoboxes of another Wikipedia"""
+    EN = "en"
+    NL = "nl"
+    DE = "de"
+    FR = "fr"
+    ES = "es"
+    IT = "it"
+
+
+def city_urls(city: dict) -> dict[str, str]:
+    """The urls of the articles of a city as stored in the cities file, by language code"""
+    return {"en": city["url_en"], "nl": city["url_nl"], **city.get("urls", {})}
+
+
+def city_with_infoboxes(city: dict, infoboxes: dict[str, dict[str, list[str]]]) -> InfoBoxCity:
+    """
+    The InfoBoxCity of a city as stored in the cities file.
+    :param city: the city, with the urls of the languages other than English and Dutch in urls
+    :param infoboxes: the infobox of every language of city_urls, by language code
+    """
+    urls = city.get("urls", None) or None
+    return InfoBoxCity(
+        name=city["name"],
+        uri=city["uri"],
+        url_en=city["url_en"],
+        url_nl=city["url_nl"],
+        infobox_en=infoboxes["en"],
+        infobox_nl=infoboxes["nl"],
+        urls=urls,
+        infoboxes=None if urls is None else {code: infoboxes[code] for code in urls},
+    )
+
+
+class ValueMatchingMode(Enum):
+    EXACT = "exact"
+    APPROXIMATE = "approximate"
+
 
 class EmbeddingComparisonMode(Enum):
     COSINE = "cosine"
@@ -1,7 +1,26 @@
 import itertools
 import json
+import os
+import re
+import sys
+import unicodedata
+from functools import partial
 
-from util import InfoBoxCity
+import numpy as np
+
+from config import MINHASH_BANDS, MINHASH_PERMUTATIONS, MINHASH_THRESHOLD, VALUE_MATCHING
+from infobox_store import InfoBoxStore
+import metrics
+from serialization import load_infobox_cities, time_call
+from util import InfoBoxCity, Language, ValueMatchingMode
+
+# a thousands separator is followed by exactly three digits, spaces are not included because
+# they also separate the numbers of a list
+THOUSANDS_SEPARATOR_REGEX = re.compile(r"(?<=\d)[.,'\u00a0\u202f](?=\d{3}(?!\d))")
+DECIMAL_COMMA_REGEX = re.compile(r"(?<=\d),(?=\d)")
+TOKEN_REGEX = re.compile(r"\d+(?:\.\d+)?|[^\W\d_]+")
+# the tokens of many values at once, the values are separated by a NUL token
+SEPARATED_TOKEN_REGEX = re.compile(TOKEN_REGEX.pattern + r"|\0")
 
 
 def process_city(
@@ -22,6 +41,7 @@ def process_city(
     return properties
 
 
+@metrics.timed("value_alignment")
 def process_cities(cities: list[InfoBoxCity]) -> dict[str, dict[str, int]]:
     properties = {}
 
@@ -31,6 +51,323 @@ def process_cities(cities: list[InfoBoxCity]) -> dict[str, dict[str, int]]:
     return properties
 
 
+def join_entries(
+        codes_en: np.ndarray, codes_nl: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns all pairs of English and Dutch entries with equal codes, in the same order as
+    itertools.product over the entries of each city.
+    """
+    order = np.argsort(codes_nl, kind="stable")
+    sorted_codes = codes_nl[order]
+    starts = np.searchsorted(sorted_codes, codes_en, side="left")
+    counts = np.searchsorted(sorted_codes, codes_en, side="right") - starts
+
+    entries_en = np.repeat(np.arange(len(codes_en)), counts)
+    first_pairs = np.cumsum(counts) - counts
+    positions = np.arange(counts.sum()) - np.repeat(first_pairs - starts, counts)
+
+    return entries_en, order[positions]
+
+
+@metrics.timed("value_alignment", source="store")
+def process_store(store: InfoBoxStore) -> dict[str, dict[str, int]]:
+    """
+    Same as process_cities, but joins the interned value lists of all cities at once. The
+    insertion order of the result is the same as process_cities, so align_properties breaks ties
+    in the same way.
+    """
+    return process_store_languages(store, Language.EN, [Language.NL])[Language.NL]
+
+
+def process_store_languages(
+        store: InfoBoxStore, source: Language, targets: list[Language]
+) -> dict[Language, dict[str, dict[str, int]]]:
+    """
+    Counts the co-occurrences of the properties of the source language with those of every target
+    language. The entries of all target languages are joined with the source entries at once, so
+    the cost grows with the number of entries, not with the number of language pairs. For each
+    target the result is the same as joining the source and that target alone.
+    :param store: the infoboxes of the cities
+    :param source: the language whose properties are aligned
+    :param targets: the languages that the properties are aligned to
+    :return: for every target language, the counts per source property and target property
+    """
+    columns_source = store.columns[source]
+    codes_source = columns_source.entry_cities.astype(np.int64) * store.value_list_count \
+        + columns_source.value_list_ids
+
+    # the entries of the targets one after the other, the stable sort of join_entries keeps the
+    # entries of every target in their own order
+    columns_targets = [store.columns[target] for target in targets]
+    codes_targets = np.concatenate([
+        columns.entry_cities.astype(np.int64) * store.value_list_count + columns.value_list_ids
+        for columns in columns_targets
+    ])
+    key_ids_targets = np.concatenate([columns.key_ids for columns in columns_targets])
+    languages_targets = np.repeat(
+        np.arange(len(targets), dtype=np.int64),
+        [len(columns.key_ids) for columns in columns_targets],
+    )
+
+    entries_source, entries_targets = join_entries(codes_source, codes_targets)
+    pairs = (
+        languages_targets[entries_targets] * len(store.vocabulary)
+        + columns_source.key_ids[entries_source]
+    ) * len(store.vocabulary) + key_ids_targets[entries_targets]
+
+    unique_pairs, first_indices, counts = np.unique(
+        pairs, return_index=True, return_counts=True
+    )
+    properties = {target: {} for target in targets}
+    for index in np.argsort(first_indices):
+        language_and_key, key_target = divmod(int(unique_pairs[index]), len(store.vocabulary))
+        language, key_source = divmod(language_and_key, len(store.vocabulary))
+        properties[targets[language]].setdefault(store.vocabulary[key_source], {})[
+            store.vocabulary[key_target]
+        ] = int(counts[index])
+
+    return properties
+
+
+def normalize_value(value: str) -> list[str]:
+    """
+    Splits a value into lower case words and numbers. Thousands separators are removed and a
+    decimal comma becomes a decimal point, so 1,234,567 and 1.234.567 have the same tokens, and
+    km² becomes km 2.
+    """
+    return [TOKEN_REGEX.findall(value) for value in normalize_values([value])][0]
+
+
+def normalize_values(values: list[str]) -> list[str]:
+    """Normalises the values for normalize_value in one pass over all values"""
+    text = "\0".join(values)
+    if not text.isascii():
+        text = unicodedata.normalize("NFKC", text)
+    text = DECIMAL_COMMA_REGEX.sub(".", THOUSANDS_SEPARATOR_REGEX.sub("", text.lower()))
+    return text.split("\0")
+
+
+def expand_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """The indices of all ranges starts[i]:ends[i] after each other"""
+    lengths = ends - starts
+    return np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+
+def mix(values: np.ndarray) -> np.ndarray:
+    """The splitmix64 finalizer, a fast bijective hash of 64 bit integers"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def value_list_tokens(
+        store: InfoBoxStore, languages: list[Language]
+) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """
+    The set of normalised tokens of every value list of the languages, as CSR-style arrays: the
+    tokens of value list i are token_ids[offsets[i]:offsets[i + 1]]. Value lists that only occur
+    in other languages have no tokens.
+    :return: the offsets, the token ids and the string of every token id
+    """
+    # the values of every value list, from the first entry with that value list
+    list_ids = []
+    value_ids = []
+    for language in languages:
+        columns = store.columns[language]
+        unique_lists, entries = np.unique(columns.value_list_ids, return_index=True)
+        starts, ends = columns.value_offsets[entries], columns.value_offsets[entries + 1]
+        list_ids.append(np.repeat(unique_lists.astype(np.int64), ends - starts))
+        value_ids.append(columns.value_ids[expand_ranges(starts, ends)])
+    list_ids, value_ids = np.concatenate(list_ids), np.concatenate(value_ids)
+
+    # every value string is normalised and split into tokens once, all values in one pass
+    unique_values, value_indices = np.unique(value_ids, return_inverse=True)
+    text = "\0".join(
+        normalize_values([store.vocabulary[value_id] for value_id in unique_values])
+    )
+    tokens = SEPARATED_TOKEN_REGEX.findall(text + "\0")
+    ids = {token: index for index, token in enumerate(dict.fromkeys(["\0", *tokens]))}
+    all_token_ids = np.array([ids[token] for token in tokens], dtype=np.int64)
+    separators = all_token_ids == 0
+    value_token_ids = all_token_ids[~separators] - 1
+    value_offsets = np.zeros(len(unique_values) + 1, dtype=np.int64)
+    value_offsets[1:] = np.flatnonzero(separators) - np.arange(len(unique_values))
+    ids = list(ids)[1:]
+
+    # the tokens of the values of every list, without duplicates and sorted by list
+    starts, ends = value_offsets[value_indices], value_offsets[value_indices + 1]
+    codes = np.unique(
+        np.repeat(list_ids, ends - starts) * max(len(ids), 1)
+        + value_token_ids[expand_ranges(starts, ends)]
+    )
+    list_ids, token_ids = np.divmod(codes, max(len(ids), 1))
+
+    offsets = np.zeros(store.value_list_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(list_ids, minlength=store.value_list_count), out=offsets[1:])
+    return offsets, token_ids, ids
+
+
+def minhash_signatures(
+        store: InfoBoxStore, languages: list[Language], permutations: int = MINHASH_PERMUTATIONS
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes the MinHash signature of the token set of every value list. The fraction of equal
+    signature values of two value lists estimates the Jaccard similarity of their token sets.
+    :return: the signatures with shape (value lists, permutations), which value lists have
+    tokens at all, and a hash of the set of numbers of every value list
+    """
+    offsets, token_ids, tokens = value_list_tokens(store, languages)
+    # the token ids are only compared within this store, so they are hashed instead of the text
+    token_hashes = mix(token_ids.astype(np.uint64) + np.uint64(1))
+    numeric = np.array([token[0].isdigit() for token in tokens], dtype=bool)[token_ids]
+    seeds = mix(np.arange(1, permutations + 1, dtype=np.uint64))
+
+    has_tokens = np.diff(offsets) > 0
+    starts = offsets[:-1][has_tokens]
+    minimums = np.empty((permutations, len(starts)), dtype=np.uint64)
+    for permutation in range(permutations if len(starts) else 0):
+        # the lists without tokens are empty ranges between the starts, so every reduced range
+        # holds the tokens of one list
+        minimums[permutation] = np.minimum.reduceat(
+            mix(token_hashes ^ seeds[permutation]), starts
+        )
+
+    signatures = np.full(
+        (store.value_list_count, permutations), np.iinfo(np.uint64).max, dtype=np.uint64
+    )
+    signatures[has_tokens] = minimums.T
+
+    # the sum of the hashes does not depend on the order of the numbers, lists without numbers
+    # have 0
+    numbers = np.zeros(store.value_list_count, dtype=np.uint64)
+    if len(starts):
+        numbers[has_tokens] = np.add.reduceat(token_hashes * numeric, starts)
+    return signatures, has_tokens, numbers
+
+
+def band_codes(
+        signatures: np.ndarray,
+        entry_cities: np.ndarray,
+        numbers: np.ndarray,
+        bands: int = MINHASH_BANDS
+) -> np.ndarray:
+    """
+    Hashes each band of rows of the signatures together with the city of the entry and the
+    numbers of its values. Two entries of the same city with the same numbers share a band code
+    when all rows of that band are equal.
+    :return: the codes with shape (entries, bands)
+    """
+    rows = signatures.reshape(len(signatures), bands, signatures.shape[1] // bands)
+    codes = mix(
+        entry_cities.astype(np.uint64)[:, np.newaxis] * np.uint64(bands)
+        + np.arange(bands, dtype=np.uint64)
+    )
+    codes = mix(codes ^ numbers[:, np.newaxis])
+    for row in range(rows.shape[2]):
+        codes = mix(codes ^ rows[:, :, row])
+    return codes.view(np.int64)
+
+
+@metrics.timed("value_alignment", source="approximate")
+def process_store_approximate(
+        store: InfoBoxStore,
+        source: Language = Language.EN,
+        target: Language = Language.NL,
+        signatures: tuple[np.ndarray, np.ndarray, np.ndarray] = None,
+        bands: int = MINHASH_BANDS,
+        threshold: float = MINHASH_THRESHOLD,
+) -> dict[str, dict[str, int]]:
+    """
+    Same as process_store, but also counts the entries of a city whose values are similar
+    instead of equal. The values are compared as sets of normalised tokens: the entries with the
+    same numbers that share a band of their MinHash signatures are candidates, and a candidate
+    pair is counted when its estimated Jaccard similarity is at least the threshold. Requiring
+    the same numbers keeps a shared unit and a year from matching two different quantities. The
+    candidates are found with the same sorted join as the exact values, so the cost stays close
+    to linear in the entries.
+    :param store: the infoboxes of the cities
+    :param source: the language whose properties are aligned
+    :param target: the language that the properties are aligned to
+    :param signatures: the signatures, has_tokens and numbers of minhash_signatures for both
+    languages, computed if not given
+    :param bands: the number of bands the signatures are split into, more bands find pairs with
+    a lower similarity
+    :param threshold: the minimal estimated Jaccard similarity of a pair
+    :return: the counts per source property and target property
+    """
+    signatures, has_tokens, numbers = signatures or minhash_signatures(store, [source, target])
+    columns_source, columns_target = store.columns[source], store.columns[target]
+
+    # equal value lists always match, also when they have no tokens
+    entries_source, entries_target = join_entries(
+        columns_source.entry_cities.astype(np.int64) * store.value_list_count
+        + columns_source.value_list_ids,
+        columns_target.entry_cities.astype(np.int64) * store.value_list_count
+        + columns_target.value_list_ids,
+    )
+    pairs = [entries_source.astype(np.int64) * len(columns_target.key_ids) + entries_target]
+
+    tokens_source = np.flatnonzero(has_tokens[columns_source.value_list_ids])
+    tokens_target = np.flatnonzero(has_tokens[columns_target.value_list_ids])
+    codes_source = band_codes(
+        signatures[columns_source.value_list_ids[tokens_source]],
+        columns_source.entry_cities[tokens_source],
+        numbers[columns_source.value_list_ids[tokens_source]],
+        bands,
+    )
+    codes_target = band_codes(
+        signatures[columns_target.value_list_ids[tokens_target]],
+        columns_target.entry_cities[tokens_target],
+        numbers[columns_target.value_list_ids[tokens_target]],
+        bands,
+    )
+    # the codes are random, sorting the source codes first keeps the lookups of the join in
+    # cache and makes it several times faster
+    order = np.argsort(codes_source.ravel())
+    candidates_source, candidates_target = join_entries(
+        codes_source.ravel()[order], codes_target.ravel()
+    )
+    candidates = np.unique(
+        tokens_source[order[candidates_source] // bands].astype(np.int64)
+        * len(columns_target.key_ids)
+        + tokens_target[candidates_target // bands]
+    )
+    metrics.increment("value_candidates_total", len(candidates), source="approximate")
+
+    candidates_source, candidates_target = np.divmod(candidates, len(columns_target.key_ids))
+    similarity = (
+        signatures[columns_source.value_list_ids[candidates_source]]
+        == signatures[columns_target.value_list_ids[candidates_target]]
+    ).mean(axis=1)
+    # a band code collision of two cities or of different numbers is not a match
+    same_city = columns_source.entry_cities[candidates_source] \
+        == columns_target.entry_cities[candidates_target]
+    same_numbers = numbers[columns_source.value_list_ids[candidates_source]] \
+        == numbers[columns_target.value_list_ids[candidates_target]]
+    pairs.append(candidates[(similarity >= threshold) & same_city & same_numbers])
+
+    entries_source, entries_target = np.divmod(
+        np.unique(np.concatenate(pairs)), len(columns_target.key_ids)
+    )
+    key_pairs = columns_source.key_ids[entries_source].astype(np.int64) * len(store.vocabulary) \
+        + columns_target.key_ids[entries_target]
+
+    unique_pairs, first_indices, counts = np.unique(
+        key_pairs, return_index=True, return_counts=True
+    )
+    properties = {}
+    for index in np.argsort(first_indices):
+        key_source, key_target = divmod(int(unique_pairs[index]), len(store.vocabulary))
+        properties.setdefault(store.vocabulary[key_source], {})[
+            store.vocabulary[key_target]
+        ] = int(counts[index])
+
+    return properties
+
+
 def align_properties(properties: dict[str, dict[str, int]]) -> dict[str, str]:
     alignments = {}
 
@@ -41,7 +378,12 @@ def align_properties(properties: dict[str, dict[str, int]]) -> dict[str, str]:
     return alignments
 
 
-def get_unique_properties(cities: list[InfoBoxCity]) -> tuple[set[str], set[str]]:
+def get_unique_properties(
+        cities: list[InfoBoxCity] | InfoBoxStore
+) -> tuple[set[str], set[str]]:
+    if isinstance(cities, InfoBoxStore):
+        return cities.unique_properties(Language.EN), cities.unique_properties(Language.NL)
+
     properties_en = set()
     properties_nl = set()
 
@@ -52,11 +394,203 @@ def get_unique_properties(cities: list[InfoBoxCity]) -> tuple[set[str], set[str]
     return properties_en, properties_nl
 
 
-def main():
-    with open("data/infoboxes.json", "r") as file:
-        cities = [InfoBoxCity.from_dict(city) for city in json.load(file)]
+def annotated_alignments(cities: list[InfoBoxCity]) -> dict[tuple[str, str], bool]:
+    """
+    The annotated alignments of the test cities of both alignment methods, as saved in
+    test-cities_<name>.json. A pair of properties is correct when at least half of its
+    annotations say so.
+    """
+    labels = {}
+    for city in cities:
+        for alignment in (city.value_alignment_completed_infobox or []) \
+                + (city.embedding_alignment_completed_infobox or []):
+            labels.setdefault((alignment.original_property, alignment.property_), []).append(
+                alignment.correct
+            )
+    return {pair: 2 * sum(values) >= len(values) for pair, values in labels.items()}
+
+
+def compare_matching_modes(
+        store: InfoBoxStore,
+        correct_alignments: dict[str, str] = None,
+        annotations: dict[tuple[str, str], bool] = None,
+        repeat: int = 5
+) -> dict[str, dict[str, float]]:
+    """
+    Runs the exact and the approximate value matching on the English and Dutch infoboxes.
+    :param store: the infoboxes of the cities
+    :param correct_alignments: the correct Dutch property of English properties, if known
+    :param annotations: whether an alignment is correct, for the annotated alignments
+    :param repeat: the time is the best of this number of runs
+    :return: for each mode the time, the number of counted pairs and alignments, and for the
+    approximate mode the time of the signatures included in its time and the number of
+    alignments that the exact mode does not find. With the correct alignments also the pairs
+    counted for them, the fraction of them that is aligned correctly (recall) and the fraction of
+    the alignments of their properties that is correct (precision). With the annotations the
+    number of alignments that are annotated, the fraction of those that is correct, and the
+    fraction of the alignments annotated as correct that is found (annotated recall). The
+    approximate mode also has the difference of both recalls with the exact mode (recall gain).
+    """
+    results = {}
+    mode_alignments = {}
+    correct_pairs = {pair for pair, correct in (annotations or {}).items() if correct}
+    for mode in ValueMatchingMode:
+        if mode == ValueMatchingMode.APPROXIMATE:
+            function = partial(process_store_approximate, store)
+        else:
+            function = partial(process_store, store)
+        properties = function()
+        alignments = mode_alignments[mode] = align_properties(properties)
+        results[mode.value] = {
+            "seconds": time_call(function, repeat),
+            "pairs": sum(sum(counts.values()) for counts in properties.values()),
+            "alignments": len(alignments),
+        }
+        if mode == ValueMatchingMode.APPROXIMATE:
+            # the part of the time that tokenizes the values and computes the signatures
+            results[mode.value]["signature_seconds"] = time_call(
+                partial(minhash_signatures, store, [Language.EN, Language.NL]), repeat
+            )
+
+        if correct_alignments:
+            aligned = [key for key in alignments if key in correct_alignments]
+            results[mode.value]["correct_pairs"] = sum(
+                properties.get(key, {}).get(target, 0)
+                for key, target in correct_alignments.items()
+            )
+            results[mode.value]["recall"] = sum(
+                alignments.get(key, None) == target for key, target in correct_alignments.items()
+            ) / len(correct_alignments)
+            results[mode.value]["precision"] = sum(
+                alignments[key] == correct_alignments[key] for key in aligned
+            ) / max(len(aligned), 1)
+
+        if annotations:
+            labels = [
+                annotations[pair] for pair in alignments.items() if pair in annotations
+            ]
+            results[mode.value]["annotated_alignments"] = len(labels)
+            results[mode.value]["annotated_precision"] = sum(labels) / max(len(labels), 1)
+            results[mode.value]["annotated_recall"] = len(
+                correct_pairs & set(alignments.items())
+            ) / max(len(correct_pairs), 1)
+
+    exact, approximate = (
+        results[ValueMatchingMode.EXACT.value], results[ValueMatchingMode.APPROXIMATE.value]
+    )
+    approximate["approximate_only_alignments"] = len(
+        set(mode_alignments[ValueMatchingMode.APPROXIMATE].items())
+        - set(mode_alignments[ValueMatchingMode.EXACT].items())
+    )
+    for recall in ["recall", "annotated_recall"]:
+        if recall in approximate:
+            approximate[f"{recall}_gain"] = approximate[recall] - exact[recall]
+
+    return results
+
+
+def save_value_alignments(
+        infoboxes_path: str,
+        value_alignments_path: str,
+        mode: ValueMatchingMode = ValueMatchingMode(VALUE_MATCHING)
+) -> None:
+    store = InfoBoxStore.from_cities(load_infobox_cities(infoboxes_path))
+    if mode == ValueMatchingMode.APPROXIMATE:
+        alignments = align_properties(process_store_approximate(store))
+    else:
+        alignments = align_properties(process_store(store))
+
+    with open(value_alignments_path, "w") as file:
+        json.dump(alignments, file, indent=4)
+
+
+def save_language_alignments(
+        infoboxes_path: str,
+        alignments_path: str,
+        source: Language,
+        targets: list[Language],
+        mode: ValueMatchingMode = ValueMatchingMode(VALUE_MATCHING)
+) -> None:
+    """Writes the alignments from the source language to every target, by language code"""
+    store = InfoBoxStore.from_cities(load_infobox_cities(infoboxes_path), [source, *targets])
+    if mode == ValueMatchingMode.APPROXIMATE:
+        signatures = minhash_signatures(store, [source, *targets])
+        properties = {
+            target: process_store_approximate(store, source, target, signatures)
+            for target in targets
+        }
+    else:
+        with metrics.stage("value_alignment", source="languages"):
+            properties = process_store_languages(store, source, targets)
+
+    with open(alignments_path, "w") as file:
+        json.dump(
+            {target.value: align_properties(properties[target]) for target in targets},
+            file,
+            indent=4,
+        )
+
+
+def main(argv: list[str]):
+    """
+    Aligns the English and Dutch properties, or with languages the properties of the first
+    language to those of the others, which are written to data/value-alignments_<languages>.json.
+    With --approximate the values are matched approximately, with --compare the exact and the
+    approximate matching of the English and Dutch values are compared, and their precision on the
+    annotated test cities of every annotator.
+    Run with: python value_alignment.py [infoboxes_path] [source target ...] [--approximate]
+          or: python value_alignment.py [infoboxes_path] --compare [test_cities_path ...]
+    """
+    mode = ValueMatchingMode.APPROXIMATE if "--approximate" in argv \
+        else ValueMatchingMode(VALUE_MATCHING)
+    compare = "--compare" in argv
+    argv = [arg for arg in argv if arg not in ("--approximate", "--compare")]
+    infoboxes_path = argv[1] if len(argv) > 1 else "data/infoboxes.json"
+
+    if compare:
+        from database import ANNOTATORS
+
+        test_cities_paths = argv[2:] or [
+            path for path in (f"data/test-cities_{name}.json" for name in ANNOTATORS)
+            if os.path.exists(path)
+        ]
+        results = compare_matching_modes(
+            InfoBoxStore.from_cities(
+                load_infobox_cities(infoboxes_path), [Language.EN, Language.NL]
+            ),
+            annotations=annotated_alignments([
+                city for path in test_cities_paths for city in load_infobox_cities(path)
+            ]),
+        )
+        for name, result in results.items():
+            print(name, ", ".join(f"{key}: {value:g}" for key, value in result.items()))
+        approximate = results[ValueMatchingMode.APPROXIMATE.value]
+        print(
+            f"approximate matching adds {approximate['approximate_only_alignments']} alignments"
+            + (f", annotated recall gain {approximate['annotated_recall_gain']:+.3f}"
+               if "annotated_recall_gain" in approximate else "")
+        )
+        metrics.export("value_alignment")
+        return
+
+    if len(argv) > 3:
+        source, *targets = [Language(code) for code in argv[2:]]
+        save_language_alignments(
+            infoboxes_path,
+            f"data/value-alignments_{'-'.join(argv[2:])}.json",
+            source,
+            targets,
+            mode,
+        )
+        metrics.export("value_alignment")
+        return
+
+    cities = load_infobox_cities(infoboxes_path)
 
-    properties = process_cities(cities)
+    if mode == ValueMatchingMode.APPROXIMATE:
+        properties = process_store_approximate(InfoBoxStore.from_cities(cities))
+    else:
+        properties = process_cities(cities)
     alignments = align_properties(properties)
 
     print(alignments)
@@ -67,7 +601,8 @@ def main():
         "unique_nl: ", len(unique_nl),
         "alignments: ", len(alignments)
     )
+    metrics.export("value_alignment")
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv)
@@ -0,0 +1,400 @@
+"""
+Alternative source for the infoboxes: instead of downloading the rendered html of every article,
+the raw wikitext of up to 50 articles is fetched per request through the MediaWiki action API
+(prop=revisions), and the Infobox settlement / Infobox plaats templates are parsed directly into
+the same dict[str, list[str]] as parse_infoboxes. The template parameter names are mapped to
+the labels of the rendered table where they are known (population_total renders as Total,
+subdivision_name1 as the value of subdivision_type1), other parameters are written as a label
+(deelstaat as Deelstaat), so the keys mostly match those of parse_infoboxes.
+"""
+import html
+import json
+import re
+import sys
+from urllib.parse import unquote, urlparse
+
+import requests
+from tqdm import tqdm
+
+import metrics
+from get_properties import USER_AGENT
+from parse_infoboxes import clean_text, request_with_retries
+from serialization import dump_infobox_cities
+from util import city_urls, city_with_infoboxes
+
+API_URL = "https://{language}.wikipedia.org/w/api.php"
+MAX_TITLES = 50
+
+# template names in lower case, "Infobox plaats in Duitsland" and the like match as well
+INFOBOX_TEMPLATES = ["infobox settlement", "infobox plaats"]
+
+# templates that render as a list of their items
+LIST_TEMPLATES = [
+    "plainlist", "plain list", "flatlist", "unbulleted list", "ubl", "hlist", "collapsible list"
+]
+
+# templates that render as their first parameter, other templates are removed
+TEXT_TEMPLATES = [
+    "nowrap", "small", "big", "nobold", "flag", "flagu", "flagcountry", "formatnum", "nts",
+    "abbr", "sort",
+]
+
+# the rendered labels of the Infobox settlement parameters, a label that occurs twice is
+# overwritten by the last parameter, like a repeated row header in parse_infoboxes
+PARAMETER_LABELS = {
+    "area_total_km2": "Total",
+    "area_land_km2": "Land",
+    "area_water_km2": "Water",
+    "area_urban_km2": "Urban",
+    "area_metro_km2": "Metro",
+    "population_total": "Total",
+    "population_urban": "Urban",
+    "population_metro": "Metro",
+    "population_density_km2": "Density",
+    "population_density_urban_km2": "Urbandensity",
+    "population_density_metro_km2": "Metrodensity",
+    "population_rank": "Rank",
+    "population_demonym": "Demonym",
+    "elevation_m": "Elevation",
+    "timezone": "Time zone",
+    "timezone1": "Time zone",
+    "timezone_DST": "Summer (DST)",
+    "timezone1_DST": "Summer (DST)",
+    "government_type": "Type",
+    "governing_body": "Body",
+    "founder": "Founded by",
+    "named_for": "Named for",
+    "postal_code": "Postal code",
+    "area_code": "Area code",
+    "iso_code": "ISO 3166 code",
+    "registration_plate": "Vehicle registration",
+    "website": "Website",
+}
+
+# parameters whose label is the value of another parameter, for example
+# | subdivision_type1 = Province | subdivision_name1 = Utrecht renders as Province: Utrecht
+LABEL_PARAMETERS = [
+    (re.compile(pattern), replacement) for pattern, replacement in [
+        (r"^subdivision_name(\d*)$", r"subdivision_type\1"),
+        (r"^leader_name(\d*)$", r"leader_title\1"),
+        (r"^established_date(\d*)$", r"established_title\1"),
+        (r"^seat(\d*)$", r"seat_type\1"),
+        (r"^postal_code(\d*)$", r"postal_code_type\1"),
+        (r"^area_code(\d*)$", r"area_code_type\1"),
+        (r"^(blank\d*)_info(_sec\d+)?$", r"\1_name\2"),
+    ]
+]
+
+COMMENT_REGEX = re.compile(r"<!--.*?-->", flags=re.DOTALL)
+REFERENCE_REGEX = re.compile(r"<ref[^>/]*/>|<ref[^>]*>.*?</ref>", flags=re.DOTALL | re.IGNORECASE)
+TEMPLATE_START_REGEX = re.compile(r"\{\{\s*([^|{}<\n]+?)\s*(?=\||}}|\n)")
+FILE_LINK_REGEX = re.compile(r"\[\[(?:File|Image|Bestand|Afbeelding):[^\]]*]]", flags=re.IGNORECASE)
+LINK_REGEX = re.compile(r"\[\[(?:[^|\]]*\|)?([^\]]*)]]")
+EXTERNAL_LINK_REGEX = re.compile(r"\[(?:https?:)?//\S+(?:\s([^\]]*))?]")
+BREAK_REGEX = re.compile(r"<br\s*/?>", flags=re.IGNORECASE)
+TAG_REGEX = re.compile(r"<[^>]+>")
+
+
+def parse_page_url(url: str) -> tuple[str, str]:
+    """Returns the language and the title of a wikipedia url"""
+    parsed = urlparse(url)
+    title = unquote(parsed.path.split("/wiki/", 1)[1]).replace("_", " ")
+    return parsed.netloc.split(".")[0], title
+
+
+def normalise_name(name: str) -> str:
+    return " ".join(name.replace("_", " ").split()).lower()
+
+
+def split_template(text: str, start: int) -> tuple[list[str], int]:
+    """
+    Splits the template that starts with the braces at text[start] on the pipes of its own level,
+    pipes in nested templates and links are not split on.
+    :return: the name and the parameters of the template, and the index after the template
+    """
+    parts = []
+    braces = links = 0
+    part_start = index = start + 2
+
+    while index < len(text):
+        pair = text[index:index + 2]
+        if pair == "{{":
+            braces += 1
+            index += 2
+        elif pair == "}}":
+            if braces == 0:
+                parts.append(text[part_start:index])
+                return parts, index + 2
+            braces -= 1
+            index += 2
+        elif pair == "[[":
+            links += 1
+            index += 2
+        elif pair == "]]" and links > 0:
+            links -= 1
+            index += 2
+        else:
+            if text[index] == "|" and braces == 0 and links == 0:
+                parts.append(text[part_start:index])
+                part_start = index + 1
+            index += 1
+
+    parts.append(text[part_start:])
+    return parts, len(text)
+
+
+def is_named(part: str) -> bool:
+    """Whether a template parameter is named, an equals sign in a nested template does not count"""
+    return "=" in re.split(r"\{\{|\[\[", part, maxsplit=1)[0]
+
+
+def render_template(parts: list[str]) -> str:
+    """Renders a nested template as text, for the templates that are common in infobox values"""
+    name = normalise_name(parts[0])
+    positional = [render_templates(part).strip() for part in parts[1:] if not is_named(part)]
+
+    # magic words like {{formatnum:1234}} have their first parameter after a colon
+    if ":" in name and not name.startswith("#"):
+        name, first = parts[0].split(":", 1)
+        name = normalise_name(name)
+        positional.insert(0, render_templates(first).strip())
+
+    if name in LIST_TEMPLATES:
+        items = [
+            item.lstrip("*#").strip() for part in positional for item in part.split("\n")
+        ]
+        return "\n".join(item for item in items if item != "")
+    if name == "lang" and len(positional) > 1:
+        return positional[1]
+    if name == "convert" and len(positional) > 1:
+        return f"{positional[0]} {positional[1]}"
+    if name in TEXT_TEMPLATES and positional:
+        return positional[0]
+    return ""
+
+
+def render_templates(text: str) -> str:
+    """Replaces every template in the text by its rendered text"""
+    result = []
+    index = 0
+    while True:
+        start = text.find("{{", index)
+        if start == -1:
+            result.append(text[index:])
+            return "".join(result)
+
+        result.append(text[index:start])
+        parts, index = split_template(text, start)
+        result.append(render_template(parts))
+
+
+def convert_value(value: str) -> list[str]:
+    """Converts the wikitext of an infobox value to a list of clean text values"""
+    value = render_templates(value)
+    value = FILE_LINK_REGEX.sub("", value)
+    value = LINK_REGEX.sub(r"\1", value)
+    value = EXTERNAL_LINK_REGEX.sub(lambda match: match.group(1) or "", value)
+    value = BREAK_REGEX.sub("\n", value)
+    value = TAG_REGEX.sub("", value)
+    value = html.unescape(value.replace("'''", "").replace("''", ""))
+
+    items = [clean_text(item.lstrip("*#")) for item in value.split("\n")]
+    return [item for item in items if item != ""]
+
+
+def is_infobox_template(name: str) -> bool:
+    name = normalise_name(name)
+    return any(
+        name == template or name.startswith(f"{template} ") for template in INFOBOX_TEMPLATES
+    )
+
+
+def label_parameter(parameter: str) -> str | None:
+    """The parameter that holds the label of a parameter, if it has one"""
+    for pattern, replacement in LABEL_PARAMETERS:
+        if pattern.match(parameter):
+            return pattern.sub(replacement, parameter)
+    return None
+
+
+def parameters_to_labels(parameters: dict[str, list[str]]) -> dict[str, list[str]]:
+    """
+    Replaces the template parameter names by the labels of the rendered infobox. Parameters that
+    are the label of another parameter are left out.
+    """
+    used_labels = {label_parameter(parameter) for parameter in parameters} & parameters.keys()
+
+    infobox = {}
+    for parameter, values in parameters.items():
+        if parameter in used_labels:
+            continue
+        label = label_parameter(parameter)
+        if label in parameters:
+            key = parameters[label][0]
+        elif parameter in PARAMETER_LABELS:
+            key = PARAMETER_LABELS[parameter]
+        else:
+            key = parameter.replace("_", " ")
+            key = key[:1].upper() + key[1:]
+        infobox[key] = values
+    return infobox
+
+
+def convert_infobox_wikitext_to_dict(wikitext: str) -> dict[str, list[str]]:
+    """
+    Parses the first Infobox settlement or Infobox plaats template of an article. Only named
+    parameters with a non-empty value are included.
+    :param wikitext: the wikitext of the article
+    :return: dictionary with the labels of the parameters as keys and the values in a list
+    """
+    wikitext = COMMENT_REGEX.sub("", wikitext)
+    wikitext = REFERENCE_REGEX.sub("", wikitext)
+
+    for match in TEMPLATE_START_REGEX.finditer(wikitext):
+        if not is_infobox_template(match.group(1)):
+            continue
+
+        parts, _ = split_template(wikitext, match.start())
+        parameters = {}
+        for part in parts[1:]:
+            if not is_named(part):
+                continue
+            key, value = part.split("=", 1)
+            key, values = clean_text(key), convert_value(value)
+            if key != "" and values:
+                parameters[key] = values
+        return parameters_to_labels(parameters)
+
+    return {}
+
+
+def fetch_wikitexts(
+        titles: list[str], language: str, api_url: str = API_URL
+) -> dict[str, str | None]:
+    """
+    Fetches the wikitext of at most MAX_TITLES articles in one request, following redirects.
+    :param titles: the titles of the articles
+    :param language: the language of the wikipedia
+    :param api_url: the url of the action API, with {language} as placeholder
+    :return: the wikitext for every title, or None if the article does not exist
+    :raises requests.HTTPError: if the request keeps failing, see request_with_retries
+    :raises RuntimeError: if the API answers with an error
+    """
+    data = {
+        "action": "query",
+        "prop": "revisions",
+        "rvprop": "content",
+        "rvslots": "main",
+        "redirects": 1,
+        "format": "json",
+        "formatversion": 2,
+        "titles": "|".join(titles),
+    }
+    source = f"mediawiki_{language}"
+
+    renamed = {}
+    wikitexts = {}
+    while True:
+        response = request_with_retries(
+            lambda: requests.post(
+                api_url.format(language=language), data=data, headers={"User-Agent": USER_AGENT}
+            ),
+            source,
+        )
+        metrics.increment("fetch_bytes_total", len(response.content), source=source)
+
+        result = response.json()
+        # errors like an invalid title, maxlag or a read-only wiki come with status 200
+        if "error" in result:
+            raise RuntimeError(
+                f"MediaWiki API error {result['error'].get('code')}: "
+                f"{result['error'].get('info')}"
+            )
+        query = result.get("query", {})
+        for item in query.get("normalized", []) + query.get("redirects", []):
+            renamed[item["from"]] = item["to"]
+        for page in query.get("pages", []):
+            revisions = page.get("revisions", None)
+            if revisions:
+                wikitexts[page["title"]] = revisions[0]["slots"]["main"]["content"]
+
+        # the API returns the content of large batches in several parts
+        if "continue" not in result:
+            break
+        data.update(result["continue"])
+
+    def resolve(title: str) -> str:
+        seen = set()
+        while title in renamed and title not in seen:
+            seen.add(title)
+            title = renamed[title]
+        return title
+
+    return {title: wikitexts.get(resolve(title), None) for title in titles}
+
+
+def get_infoboxes_batch(
+        urls: list[str], api_url: str = API_URL
+) -> dict[str, dict[str, list[str]]]:
+    """
+    Get the infoboxes of wikipedia pages, with one request per MAX_TITLES pages of a language.
+    :param urls: the urls of the wikipedia pages
+    :param api_url: the url of the action API, with {language} as placeholder
+    :return: the infobox of every url, empty if the page has no infobox
+    """
+    titles_per_language = {}
+    for url in urls:
+        language, title = parse_page_url(url)
+        titles_per_language.setdefault(language, {})[title] = url
+
+    infoboxes = {}
+    for language, titles in titles_per_language.items():
+        titles = list(titles.items())
+        for start in tqdm(
+                range(0, len(titles), MAX_TITLES), desc=f"Getting {language} wikitext", leave=False
+        ):
+            batch = titles[start:start + MAX_TITLES]
+            wikitexts = fetch_wikitexts([title for title, _ in batch], language, api_url)
+            for title, url in batch:
+                wikitext = wikitexts[title]
+                with metrics.stage("parse_wikitext"):
+                    infoboxes[url] = {} if wikitext is None \
+                        else convert_infobox_wikitext_to_dict(wikitext)
+
+    return infoboxes
+
+
+def save_infoboxes(cities_path: str, infoboxes_path: str, api_url: str = API_URL) -> None:
+    """Writes the infoboxes of the cities, in English, Dutch and the languages in their urls"""
+    with open(cities_path, "r") as file:
+        cities = json.load(file)
+
+    infoboxes = get_infoboxes_batch(
+        [url for city in cities for url in city_urls(city).values()], api_url
+    )
+    dump_infobox_cities(
+        [
+            city_with_infoboxes(city, {
+                language: infoboxes[url] for language, url in city_urls(city).items()
+            })
+            for city in cities
+        ],
+        infoboxes_path,
+    )
+
+
+def main(argv: list[str]):
+    """
+    Retrieves the infoboxes of the cities from the wikitext of the articles.
+    Run with: python wikitext_infoboxes.py [population] [api_url]
+    """
+    population = int(argv[1]) if len(argv) > 1 else 1_000_000
+    api_url = argv[2] if len(argv) > 2 else API_URL
+    save_infoboxes(
+        f"data/cities_{population}.json", f"data/infoboxes-wikitext_{population}.json", api_url
+    )
+    metrics.export("wikitext_infoboxes")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,352 @@
+"""
+SQLite work queue to spread the crawl of parse_infoboxes and get_properties over several worker
+processes on one machine. The database is in WAL mode, which needs memory that is shared between
+the processes, so the file must be on a local disk and not on a network filesystem. The cities of
+a task are enqueued once. A worker leases a few cities at a time, and a lease that is not
+completed before it expires, for example because the worker crashed, is handed out again.
+Results are upserted per city, so a city that is completed twice is still stored once. A city
+that fails MAX_ATTEMPTS times is marked as failed until it is requeued. When every city is done,
+collect writes the same output files as the single process scripts.
+"""
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+import traceback
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+from serialization import infobox_city_from_dict, infobox_city_to_dict, dump_infobox_cities
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    task TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (task, uri)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (task, status, position);
+
+CREATE TABLE IF NOT EXISTS results (
+    task TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (task, uri)
+);
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # transactions are started explicitly, so that a lease is a single write transaction
+    connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+@contextmanager
+def transaction(connection: sqlite3.Connection):
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+def enqueue(connection: sqlite3.Connection, task: str, cities: Iterable[dict]) -> int:
+    """
+    Adds the cities to the queue of a task, cities that are already in the queue are left as is.
+    :param cities: the cities as stored in the cities file, or as yielded by iter_cities
+    :return: the number of cities that were added
+    """
+    with transaction(connection):
+        before = connection.total_changes
+        connection.executemany(
+            "INSERT INTO items (task, uri, position, payload) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (task, uri) DO NOTHING",
+            [
+                (task, city["uri"], position, json.dumps(city))
+                for position, city in enumerate(cities)
+            ],
+        )
+        return connection.total_changes - before
+
+
+def lease(
+        connection: sqlite3.Connection,
+        task: str,
+        worker: str,
+        count: int = 1,
+        lease_seconds: float = LEASE_SECONDS
+) -> list[tuple[str, dict]]:
+    """
+    Leases the next pending cities of a task, including cities with an expired lease. A city whose
+    lease expired MAX_ATTEMPTS times is marked as failed instead of being handed out again.
+    :return: the uri and the city of every leased item
+    """
+    now = time.time()
+    with transaction(connection):
+        connection.execute(
+            "UPDATE items SET status = ?, error = 'lease expired' "
+            "WHERE task = ? AND status = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, task, LEASED, now, MAX_ATTEMPTS),
+        )
+        rows = connection.execute(
+            "SELECT uri, payload, status FROM items "
+            "WHERE task = ? AND (status = ? OR (status = ? AND lease_expires < ?)) "
+            "ORDER BY position LIMIT ?",
+            (task, PENDING, LEASED, now, count),
+        ).fetchall()
+        connection.executemany(
+            "UPDATE items SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 "
+            "WHERE task = ? AND uri = ?",
+            [(LEASED, worker, now + lease_seconds, task, uri) for uri, _, _ in rows],
+        )
+
+    metrics.increment("queue_leases_total", len(rows), task=task)
+    expired = sum(status == LEASED for _, _, status in rows)
+    if expired:
+        metrics.increment("queue_expired_leases_total", expired, task=task)
+
+    return [(uri, json.loads(payload)) for uri, payload, _ in rows]
+
+
+def complete(
+        connection: sqlite3.Connection, task: str, uri: str, worker: str, result
+) -> None:
+    """Stores the result of a city and marks it as done, storing it again replaces the result"""
+    with transaction(connection):
+        connection.execute(
+            "INSERT INTO results (task, uri, worker, result) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (task, uri) DO UPDATE "
+            "SET worker = excluded.worker, result = excluded.result",
+            (task, uri, worker, json.dumps(result)),
+        )
+        connection.execute(
+            "UPDATE items SET status = ?, worker = ?, lease_expires = NULL, error = NULL "
+            "WHERE task = ? AND uri = ?",
+            (DONE, worker, task, uri),
+        )
+    metrics.increment("queue_completed_total", task=task)
+
+
+def release(
+        connection: sqlite3.Connection, task: str, uri: str, worker: str, error: str
+) -> None:
+    """Returns a city that could not be processed to the queue, or fails it after MAX_ATTEMPTS"""
+    with transaction(connection):
+        connection.execute(
+            "UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+            "lease_expires = NULL, error = ? "
+            "WHERE task = ? AND uri = ? AND worker = ? AND status = ?",
+            (MAX_ATTEMPTS, FAILED, PENDING, error, task, uri, worker, LEASED),
+        )
+    metrics.increment("queue_errors_total", task=task)
+
+
+def requeue_failed(connection: sqlite3.Connection, task: str) -> int:
+    """
+    Returns the failed cities of a task to the queue with MAX_ATTEMPTS new attempts.
+    :return: the number of cities that were requeued
+    """
+    with transaction(connection):
+        before = connection.total_changes
+        connection.execute(
+            "UPDATE items SET status = ?, worker = NULL, attempts = 0, error = NULL "
+            "WHERE task = ? AND status = ?",
+            (PENDING, task, FAILED),
+        )
+        return connection.total_changes - before
+
+
+def progress(connection: sqlite3.Connection, task: str) -> dict[str, int]:
+    """Returns the number of cities per status"""
+    return dict(connection.execute(
+        "SELECT status, COUNT(*) FROM items WHERE task = ? GROUP BY status", (task,)
+    ).fetchall())
+
+
+def get_results(connection: sqlite3.Connection, task: str) -> list[tuple[dict, object]]:
+    """Returns the city and the result of every done city, in the order they were enqueued"""
+    rows = connection.execute(
+        "SELECT items.payload, results.result FROM items "
+        "JOIN results ON results.task = items.task AND results.uri = items.uri "
+        "WHERE items.task = ? ORDER BY items.position",
+        (task,),
+    ).fetchall()
+    return [(json.loads(payload), json.loads(result)) for payload, result in rows]
+
+
+def process_infoboxes(city: dict) -> dict:
+    from parse_infoboxes import get_city_infoboxes
+    return infobox_city_to_dict(get_city_infoboxes(city))
+
+
+def process_properties(city: dict) -> dict:
+    from get_properties import get_entity_properties_and_labels
+    properties = get_entity_properties_and_labels(city["uri"].split("/")[-1])
+    return {property_id: property_.to_dict() for property_id, property_ in properties.items()}
+
+
+def collect_infoboxes(results: list[tuple[dict, dict]], population: int) -> None:
+    dump_infobox_cities(
+        [infobox_city_from_dict(result) for _, result in results],
+        f"data/infoboxes_{population}.json",
+    )
+
+
+def collect_properties(results: list[tuple[dict, dict]], population: int) -> None:
+    from get_properties import write_properties
+    from util import CityProperty
+
+    properties_per_city = {
+        city["uri"].split("/")[-1]: {
+            property_id: CityProperty.from_dict(property_)
+            for property_id, property_ in result.items()
+        }
+        for city, result in results
+    }
+    write_properties(
+        properties_per_city,
+        f"data/properties-per-city_{population}.json",
+        f"data/all-properties_{population}.json",
+    )
+
+
+TASKS = {
+    "infoboxes": (process_infoboxes, collect_infoboxes),
+    "properties": (process_properties, collect_properties),
+}
+
+
+def run_worker(
+        path: str,
+        task: str,
+        worker: str | None = None,
+        batch_size: int = 1,
+        lease_seconds: float = LEASE_SECONDS,
+        process=None
+) -> int:
+    """
+    Processes cities of a task until the queue is empty. While other workers still hold leases,
+    the worker waits, so that it can take over the cities of a worker that crashed.
+    :param process: the function that processes a city, by default the function of the task
+    :return: the number of cities processed by this worker
+    """
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    process = process or TASKS[task][0]
+    connection = connect(path)
+
+    processed = 0
+    while True:
+        items = lease(connection, task, worker, batch_size, lease_seconds)
+        if not items:
+            if progress(connection, task).get(LEASED, 0) == 0:
+                break
+            time.sleep(min(1.0, lease_seconds))
+            continue
+
+        for uri, city in items:
+            try:
+                result = process(city)
+            except Exception:
+                release(connection, task, uri, worker, traceback.format_exc())
+                continue
+            complete(connection, task, uri, worker, result)
+            processed += 1
+
+    connection.close()
+    return processed
+
+
+def run_worker_process(path: str, task: str, process=None) -> tuple[int, metrics.Registry]:
+    """Runs a worker in a process of run_workers, and returns the metrics of the process"""
+    # a forked process starts with a copy of the metrics of its parent
+    metrics.REGISTRY.reset()
+    processed = run_worker(path, task, process=process)
+    return processed, metrics.REGISTRY
+
+
+def run_workers(path: str, task: str, workers: int, process=None) -> int:
+    """
+    Runs workers in separate processes until the queue is empty. The metrics of the workers are
+    merged into the metrics of this process, so that they can be exported once for the task.
+    :return: the number of cities processed by the workers
+    """
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(run_worker_process, path, task, process) for _ in range(workers)
+        ]
+        processed = 0
+        for future in futures:
+            worker_processed, registry = future.result()
+            processed += worker_processed
+            metrics.REGISTRY.merge(registry)
+    return processed
+
+
+def main(argv: list[str]):
+    """
+    Enqueues the cities of a task, runs workers, shows the progress or writes the output files.
+    The task is "infoboxes" (parse_infoboxes) or "properties" (get_properties).
+    Run with: python work_queue.py enqueue <task> [population]
+          or: python work_queue.py work <task> [population] [workers]
+          or: python work_queue.py status <task> [population]
+          or: python work_queue.py requeue-failed <task> [population]
+          or: python work_queue.py collect <task> [population]
+    """
+    command, task = argv[1], argv[2]
+    population = int(argv[3]) if len(argv) > 3 else 1_000_000
+    if task not in TASKS:
+        raise ValueError(f"Unknown task {task}")
+
+    path = f"data/work-queue_{population}.db"
+    connection = connect(path)
+
+    if command == "enqueue":
+        with open(f"data/cities_{population}.json", "r", encoding="utf-8") as file:
+            print(f"Added {enqueue(connection, task, json.load(file))} cities")
+    elif command == "work":
+        workers = int(argv[4]) if len(argv) > 4 else os.cpu_count()
+        print(f"Processed {run_workers(path, task, workers)} cities")
+        print(progress(connection, task))
+        metrics.export(f"work_queue_{task}")
+    elif command == "status":
+        print(progress(connection, task))
+    elif command == "requeue-failed":
+        print(f"Requeued {requeue_failed(connection, task)} cities")
+    elif command == "collect":
+        status = progress(connection, task)
+        if set(status) != {DONE}:
+            raise RuntimeError(
+                f"Not every city is done: {status}, "
+                "run requeue-failed and work again for the failed cities"
+            )
+        TASKS[task][1](get_results(connection, task), population)
+    else:
+        raise ValueError(f"Unknown command {command}")
+
+
+if __name__ == '__main__':
+    main(sys.argv)